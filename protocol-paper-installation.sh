@@ -21,4 +21,4 @@ conda activate papolarityenv;
 
 conda install --yes -c conda-forge parallel=20191122;
 conda install --yes -c bioconda star=2.7.3a bedtools=2.29.2 samtools=1.9 csvtk=0.19.1 sra-tools=2.8.0;
-pip install cutadapt==2.7 pasio==1.1.2 papolarity==1.1.2;
+pip install cutadapt==2.7 papolarity==1.1.2;
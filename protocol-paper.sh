@@ -14,7 +14,7 @@
 # #   (technically, steps before 3.3.4 don't need them).
 # # If it's the case, specify SAMPLES explicitly and comment out steps in a section 3.3.*
 # #
-# # This pipeline uses several auxiliary tools: GNU parallel, csvtk and python package pasio.
+# # This pipeline uses several auxiliary tools: GNU parallel and csvtk.
 # # You can find installation instructions in ./protocol-paper-installation.sh
 # # To obtain data we used in a paper, follow ./protocol-paper-obtain-data.sh
 
@@ -112,14 +112,26 @@ echo '=== 3.2. Polarity score estimation ==='
 echo '3.2.1. Estimating polarity scores'
 
 mkdir -p ./coverage_features/raw;
-(
-  for SAMPLE in $SAMPLES 'pooled'; do
-    echo papolarity coverage_features \
-                    "./cds_coverage/${SAMPLE}.bedgraph.gz" \
-                    --prefix "${SAMPLE}_" \
-                    --output-file "./coverage_features/raw/${SAMPLE}.tsv"
-  done
-) | parallel
+
+SAMPLE_FILES_cds_coverage=$( echo $SAMPLES 'pooled' | xargs -n1 echo | xargs -n1 -I{} echo './cds_coverage/{}.bedgraph.gz' | tr '\n' ' ' )
+SAMPLE_PREFIXES=$( echo $SAMPLES 'pooled' | xargs -n1 echo | xargs -n1 -I{} echo '{}_' | tr '\n' ' ' )
+
+# All samples are processed by a single command (in parallel), features are written into a single table
+papolarity coverage_features \
+                $SAMPLE_FILES_cds_coverage \
+                --prefix $SAMPLE_PREFIXES \
+                --jobs 4 \
+                --check-sorted case-insensitive \
+                --output-file "./coverage_features/raw/all.tsv"
+
+# Columns are selected by exact names: a sample name can be a prefix of another sample name
+for SAMPLE in $SAMPLES 'pooled'; do
+    SAMPLE_FIELDS=$( echo mean_coverage coverage_q25 coverage_q50 coverage_q75 total_coverage polarity | xargs -n1 echo | xargs -n1 -I{} echo "${SAMPLE}_{}" | tr '\n' ',' | sed -e 's/,$//' )
+    csvtk --tabs cut \
+        "./coverage_features/raw/all.tsv" \
+        --fields "transcript_id,${SAMPLE_FIELDS}" \
+        --out-file "./coverage_features/raw/${SAMPLE}.tsv"
+done
 
 
 # 3.2.2. Filtering transcript lists
@@ -225,7 +237,7 @@ echo '=== 3.3. Relative slope estimation ==='
 # 3.3.1. Segmentation of coverage profiles
 echo '3.3.1. Segmentation of coverage profiles'
 
-pasio ./coverage/pooled.bedgraph.gz --alpha 1 --beta 1 --output-file ./segmentation.bed.gz --output-mode bed
+papolarity segment_coverage ./coverage/pooled.bedgraph.gz --alpha 1 --beta 1 --jobs 4 --output-file ./segmentation.bed.gz
 
 # 3.3.2. Clip segmentation
 echo '3.3.2. Clip segmentation'
@@ -268,18 +280,19 @@ mkdir -p ./coverage_flattened;
 echo '3.3.4. Calculate slope for a pair of samples.'
 
 mkdir -p ./comparison/raw;
-(
-  for EXPERIMENT in $EXPERIMENTS; do
-      echo papolarity compare_coverage \
-                      ./cds_segmentation.bed.gz \
-                      "./cds_coverage/${CONTROL}.bedgraph.gz" \
-                      "./cds_coverage/${EXPERIMENT}.bedgraph.gz" \
-                      --check-sorted case-insensitive \
-                      --segment-coverage-quantile 0.25 1 \
-                      --prefix "${EXPERIMENT}_" \
-                      --output-file "comparison/raw/${EXPERIMENT}.tsv"
-  done
-) | parallel
+
+EXPERIMENT_FILES_cds_coverage=$( echo $EXPERIMENTS | xargs -n1 echo | xargs -n1 -I{} echo './cds_coverage/{}.bedgraph.gz' | tr '\n' ' ' )
+
+# Control is loaded and segment-summed once for all experiments.
+# Results for each experiment are stored at `comparison/raw/${EXPERIMENT}.tsv`
+papolarity compare_coverage \
+                ./cds_segmentation.bed.gz \
+                "./cds_coverage/${CONTROL}.bedgraph.gz" \
+                $EXPERIMENT_FILES_cds_coverage \
+                --check-sorted case-insensitive \
+                --segment-coverage-quantile 0.25 1 \
+                --sample-names $CONTROL $EXPERIMENTS \
+                --output-dir "comparison/raw"
 
 # 3.3.5. Finalizing profile comparison statistics
 echo '3.3.5. Finalizing profile comparison statistics'
@@ -35,7 +35,7 @@ setuptools.setup(
         "Programming Language :: Python :: 3.8",
     ],
     python_requires='>=3.7',
-    install_requires=['pybedtools >= 0.8.0', 'numpy >= 1.8.0', 'sklearn', 'six', 'matplotlib', 'seaborn'],
+    install_requires=['pybedtools >= 0.8.0', 'pysam', 'numpy >= 1.8.0', 'scipy', 'six', 'matplotlib', 'seaborn'],
     extras_require={
         'dev': ['pytest', 'pytest-benchmark', 'flake8', 'tox', 'wheel', 'twine', 'setuptools_scm'],
     },
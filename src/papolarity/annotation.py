@@ -1,56 +1,393 @@
-from collections import defaultdict
+import os
+import json
 import itertools
+import functools
+import numpy as np
 import pybedtools
 from .gtf_parser import GTFRecord
-from .utils import take_the_only
+from .parallel import ordered_map
+from .file_chunks import split_file
 from .fasta_reader import fasta_from_file
 from .dto.coding_transcript_info import CodingTranscriptInfo
+from .annotation_snapshot import snapshot_filename, save_arrays, load_arrays
 
-class Annotation:
-    def __init__(self):
-        self.gene_by_id = {}
-        self.transcript_by_id = {}
+# Strands are stored as numbers
+STRAND_CODES = {'+': 1, '-': -1}
+STRAND_BY_CODE = {1: '+', -1: '-'}
+
+# Minimal number of records in an annotation chunk loaded by `Annotation.each_chunk_in_file`
+CHUNK_SIZE = 10000
+
+# Attributes stored in annotation snapshots (along with attributes of filters) so that a snapshot can be filtered by them.
+# Filters by these attributes (e.g. `transcript_type=protein_coding`) reuse a single snapshot of a GTF file
+SNAPSHOT_ATTRIBUTES = frozenset({'gene_type', 'gene_biotype', 'transcript_type', 'transcript_biotype', 'tag', 'level', 'transcript_support_level'})
+
+# Number of file chunks per worker process when annotation is loaded in parallel (several chunks per worker balance the load)
+FILE_CHUNKS_PER_JOB = 4
+
+class UngroupedAnnotationError(ValueError):
+    '''Records of a gene don't go contiguously, so annotation can't be loaded chunk by chunk'''
+    pass
+
+class AnnotationBuilder:
+    '''
+    Collects GTF records one by one and builds an `Annotation` of them.
+    Values of `kept_attributes` of each record are stored as an interned attribute set, so that annotation can be filtered later.
+    '''
+    def __init__(self, kept_attributes=()):
+        self.kept_attributes = sorted(kept_attributes)
+        self.contig_codes = {}
+        self.type_codes = {}
+        self.attribute_set_codes = {}
+        self.gene_by_id = {} # gene_id --> (contig, start, stop, strand, attribute set)
+        self.transcript_by_id = {} # transcript_id --> (contig, start, stop, strand, attribute set)
         self.geneId_by_transcript = {}
-        self.transcripts_by_gene = defaultdict(list)
-        self.parts_by_transcript = defaultdict(list)
+        self.part_transcript_ids = []
+        self.part_columns = ([], [], [], [], [], []) # type, contig, start, stop, strand, attribute set
 
     @classmethod
-    def load(cls, filename, relevant_attributes=None, multivalue_keys=frozenset(), ignore_unknown_multivalues=False, condition=None):
-        annotation = cls()
-        records = GTFRecord.each_in_file(filename, multivalue_keys=multivalue_keys, ignore_unknown_multivalues=ignore_unknown_multivalues)
-
-        if relevant_attributes is not None:
-            # that's the minimum list of attributes for a library to properly work
-            necessary_attributes = {'gene_id', 'transcript_id',}
-            relevant_attributes = relevant_attributes.union(necessary_attributes)
-            records = map(lambda rec: rec.attributes_filtered(relevant_attributes), records)
-        if condition:
-            records = filter(condition, records)
+    def _intern(cls, codes, value):
+        if value not in codes:
+            codes[value] = len(codes)
+        return codes[value]
 
-        for rec in records:
-            annotation.push_record(rec)
-        return annotation
+    @classmethod
+    def _attribute_set_key(cls, attributes, attribute_names):
+        # multivalue attributes are lists, they are converted to (hashable) tuples
+        return tuple((k, tuple(attributes[k]) if isinstance(attributes[k], list) else attributes[k]) for k in attribute_names if k in attributes)
 
     def push_record(self, rec):
         gene_id = rec.attributes['gene_id']
+        contig = self._intern(self.contig_codes, rec.contig)
+        strand = STRAND_CODES[rec.strand]
+        attribute_set = self._intern(self.attribute_set_codes, self._attribute_set_key(rec.attributes, self.kept_attributes))
         if rec.type == 'gene':
-            self.gene_by_id[gene_id] = rec
+            self.gene_by_id[gene_id] = (contig, rec.start, rec.stop, strand, attribute_set)
+            return
+        transcript_id = rec.attributes['transcript_id']
+        if rec.type == 'transcript':
+            self.transcript_by_id[transcript_id] = (contig, rec.start, rec.stop, strand, attribute_set)
+            self.geneId_by_transcript[transcript_id] = gene_id
         else:
-            transcript_id = rec.attributes['transcript_id']
-            if rec.type == 'transcript':
-                self.transcript_by_id[transcript_id] = rec
-                self.geneId_by_transcript[transcript_id] = gene_id
-                self.transcripts_by_gene[gene_id].append(rec)
-            else:
-                self.parts_by_transcript[transcript_id].append(rec)
+            # parts can go before a transcript record (or even without it)
+            self.geneId_by_transcript.setdefault(transcript_id, gene_id)
+            self.part_transcript_ids.append(transcript_id)
+            feature_type = self._intern(self.type_codes, rec.type)
+            for (column, value) in zip(self.part_columns, (feature_type, contig, rec.start, rec.stop, strand, attribute_set)):
+                column.append(value)
+
+    def push_annotation(self, annotation, accepted_attribute_sets=None):
+        '''
+        Adds records of an annotation (the result is the same as if its records were pushed one by one).
+        If a boolean mask `accepted_attribute_sets` is specified, only records with accepted attribute sets are added.
+        '''
+        contig_codes = np.array([self._intern(self.contig_codes, contig) for contig in annotation.contigs], dtype=np.int64)
+        type_codes = np.array([self._intern(self.type_codes, feature_type) for feature_type in annotation.types], dtype=np.int64)
+        attribute_set_keys = [self._attribute_set_key(attributes, attributes) for attributes in map(json.loads, annotation.attribute_sets)]
+        attribute_set_codes = np.array([self._intern(self.attribute_set_codes, key) for key in attribute_set_keys], dtype=np.int64)
+        if accepted_attribute_sets is None:
+            accepted_attribute_sets = np.ones(len(attribute_set_keys), dtype=bool)
+
+        gene_indices = np.flatnonzero(accepted_attribute_sets[annotation.gene_attribute_sets])
+        gene_rows = zip([annotation.gene_ids[idx] for idx in gene_indices.tolist()], contig_codes[annotation.gene_contigs[gene_indices]].tolist(),
+                        annotation.gene_starts[gene_indices].tolist(), annotation.gene_stops[gene_indices].tolist(),
+                        annotation.gene_strands[gene_indices].tolist(), attribute_set_codes[annotation.gene_attribute_sets[gene_indices]].tolist())
+        for (gene_id, *gene_row) in gene_rows:
+            self.gene_by_id[gene_id] = tuple(gene_row)
+
+        num_records = annotation.num_transcript_records
+        transcript_indices = np.flatnonzero(accepted_attribute_sets[annotation.transcript_attribute_sets[:num_records]])
+        transcript_rows = zip([annotation._transcript_ids[idx] for idx in transcript_indices.tolist()],
+                              [annotation.transcript_gene_ids[idx] for idx in transcript_indices.tolist()],
+                              contig_codes[annotation.transcript_contigs[transcript_indices]].tolist(), annotation.transcript_starts[transcript_indices].tolist(),
+                              annotation.transcript_stops[transcript_indices].tolist(), annotation.transcript_strands[transcript_indices].tolist(),
+                              attribute_set_codes[annotation.transcript_attribute_sets[transcript_indices]].tolist())
+        for (transcript_id, gene_id, *transcript_row) in transcript_rows:
+            self.transcript_by_id[transcript_id] = tuple(transcript_row)
+            self.geneId_by_transcript[transcript_id] = gene_id
+        # transcripts known only by parts (or which records were not accepted)
+        for (transcript_id, gene_id) in zip(annotation._transcript_ids, annotation.transcript_gene_ids):
+            self.geneId_by_transcript.setdefault(transcript_id, gene_id)
+
+        part_indices = np.flatnonzero(accepted_attribute_sets[annotation.part_attribute_sets])
+        transcript_ids = annotation._transcript_ids
+        self.part_transcript_ids.extend(transcript_ids[idx] for idx in annotation.part_transcripts[part_indices].tolist())
+        part_columns = (type_codes[annotation.part_types[part_indices]], contig_codes[annotation.part_contigs[part_indices]],
+                        annotation.part_starts[part_indices], annotation.part_stops[part_indices], annotation.part_strands[part_indices],
+                        attribute_set_codes[annotation.part_attribute_sets[part_indices]])
+        for (column, values) in zip(self.part_columns, part_columns):
+            column.extend(values.tolist())
+
+    def build(self):
+        # transcripts with records go first (in order of records), then transcripts known only by their parts
+        transcript_ids = list(self.transcript_by_id)
+        transcript_rows = list(self.transcript_by_id.values())
+        num_transcript_records = len(transcript_ids)
+        for transcript_id in dict.fromkeys(self.part_transcript_ids):
+            if transcript_id not in self.transcript_by_id:
+                transcript_ids.append(transcript_id)
+                transcript_rows.append((-1, -1, -1, 0, -1))
+        transcript_idx_by_id = {transcript_id: idx for (idx, transcript_id) in enumerate(transcript_ids)}
+        transcript_columns = np.array(transcript_rows, dtype=np.int64).reshape(-1, 5)
+        gene_columns = np.array(list(self.gene_by_id.values()), dtype=np.int64).reshape(-1, 5)
+
+        part_transcripts = np.array([transcript_idx_by_id[transcript_id] for transcript_id in self.part_transcript_ids], dtype=np.int64)
+        part_columns = [np.array(column, dtype=np.int64) for column in self.part_columns]
+        part_types, part_contigs, part_starts, part_stops, part_strands, part_attribute_sets = part_columns
+        # parts are grouped by transcript and type and sorted by start (stable sort keeps order of equal records)
+        order = np.lexsort((part_starts, part_types, part_transcripts))
+        return Annotation(
+            contigs=list(self.contig_codes),
+            types=list(self.type_codes),
+            attribute_sets=[json.dumps({k: (list(v) if isinstance(v, tuple) else v) for (k, v) in key}) for key in self.attribute_set_codes],
+            gene_ids=list(self.gene_by_id),
+            gene_contigs=gene_columns[:, 0].astype(np.int32),
+            gene_starts=gene_columns[:, 1],
+            gene_stops=gene_columns[:, 2],
+            gene_strands=gene_columns[:, 3].astype(np.int8),
+            gene_attribute_sets=gene_columns[:, 4].astype(np.int32),
+            transcript_ids=transcript_ids,
+            transcript_gene_ids=[self.geneId_by_transcript[transcript_id] for transcript_id in transcript_ids],
+            num_transcript_records=num_transcript_records,
+            transcript_contigs=transcript_columns[:, 0].astype(np.int32),
+            transcript_starts=transcript_columns[:, 1],
+            transcript_stops=transcript_columns[:, 2],
+            transcript_strands=transcript_columns[:, 3].astype(np.int8),
+            transcript_attribute_sets=transcript_columns[:, 4].astype(np.int32),
+            part_transcripts=part_transcripts[order],
+            part_types=part_types[order].astype(np.int16),
+            part_contigs=part_contigs[order].astype(np.int32),
+            part_starts=part_starts[order],
+            part_stops=part_stops[order],
+            part_strands=part_strands[order].astype(np.int8),
+            part_attribute_sets=part_attribute_sets[order].astype(np.int32),
+        )
+
+def load_chunk_arrays(file_chunk, condition=None, kept_attributes=(), **parse_options):
+    '''Loads annotation from a chunk of a GTF file, returns it as arrays (module-level function to be run in a worker process)'''
+    records = GTFRecord.each_in_lines(file_chunk.each_line(), **parse_options)
+    if condition:
+        records = filter(condition, records)
+    return Annotation.from_records(records, kept_attributes=kept_attributes).to_arrays()
+
+class Annotation:
+    '''
+    Genomic annotation of genes, transcripts and their parts (exons, CDS, UTRs, codons etc) stored as arrays.
+    Contigs and feature types are interned, strands are coded as +1/-1.
+    Parts are sorted by transcript, type and start, so parts of a certain type of a transcript form a contiguous slice.
+    Only coordinates, strands and gene/transcript identifiers are kept; other fields of records are dropped.
+    Attributes kept by a builder are stored as interned attribute sets (json-encoded dictionaries), so that records can be filtered by them.
+    '''
+    # arrays which define an annotation (they are stored in a snapshot)
+    ARRAY_FIELDS = ['gene_contigs', 'gene_starts', 'gene_stops', 'gene_strands', 'gene_attribute_sets',
+                    'transcript_contigs', 'transcript_starts', 'transcript_stops', 'transcript_strands', 'transcript_attribute_sets',
+                    'part_transcripts', 'part_types', 'part_contigs', 'part_starts', 'part_stops', 'part_strands', 'part_attribute_sets']
+    LIST_FIELDS = ['contigs', 'types', 'attribute_sets', 'gene_ids', 'transcript_ids', 'transcript_gene_ids']
+
+    def __init__(self, contigs, types, attribute_sets, gene_ids, transcript_ids, transcript_gene_ids, num_transcript_records, **arrays):
+        self.contigs = contigs
+        self.types = types
+        self.attribute_sets = attribute_sets
+        self.gene_ids = gene_ids
+        self._transcript_ids = transcript_ids
+        self.transcript_gene_ids = transcript_gene_ids
+        # only first `num_transcript_records` transcripts have their own records, others are known only by parts
+        self.num_transcript_records = num_transcript_records
+        for field in self.ARRAY_FIELDS:
+            setattr(self, field, arrays[field])
+        self.type_index = {feature_type: idx for (idx, feature_type) in enumerate(types)}
+        self.gene_index = {gene_id: idx for (idx, gene_id) in enumerate(gene_ids)}
+        self.transcript_index = {transcript_id: idx for (idx, transcript_id) in enumerate(transcript_ids)}
+        # parts of transcript `t` of type `k` are at [part_offsets[t*K + k], part_offsets[t*K + k + 1]) where K is a number of types
+        group_keys = self.part_transcripts * len(types) + self.part_types
+        self.part_offsets = np.searchsorted(group_keys, np.arange(len(transcript_ids) * len(types) + 1), side='left')
+
+    @classmethod
+    def load(cls, filename, relevant_attributes=None, multivalue_keys=frozenset(), ignore_unknown_multivalues=False, condition=None, feature_types=None, line_filter=None,
+             cache_dir=None, jobs=1):
+        '''
+        Loads annotation from a GTF file.
+        Only `relevant_attributes` (if specified) are decoded, records of types other than `feature_types` (if specified) are skipped.
+        `line_filter` is a fast prefilter of raw lines, `condition` is a filter of parsed records.
+        If `cache_dir` is specified, an unfiltered annotation with `SNAPSHOT_ATTRIBUTES` and `relevant_attributes` is stored there as a binary snapshot
+        and reused by subsequent loads with any filters (see `load_snapshot`).
+        With several `jobs` a plain or block-gzipped file is split into chunks which are parsed in parallel
+        (filters should be picklable then); ordinary gzip files are parsed in a single process.
+        '''
+        if cache_dir is not None:
+            annotation = cls.load_snapshot(filename, cache_dir, relevant_attributes=relevant_attributes, multivalue_keys=multivalue_keys,
+                                           ignore_unknown_multivalues=ignore_unknown_multivalues, feature_types=feature_types, jobs=jobs)
+            return annotation.filtered(condition) if condition else annotation
+
+        relevant_attributes = cls.with_necessary_attributes(relevant_attributes)
+        parse_options = {
+            'relevant_attributes': relevant_attributes,
+            'multivalue_keys': multivalue_keys,
+            'ignore_unknown_multivalues': ignore_unknown_multivalues,
+            'feature_types': feature_types,
+            'line_filter': line_filter,
+        }
+        return cls._load_records(filename, jobs=jobs, condition=condition, **parse_options)
+
+    @classmethod
+    def load_snapshot(cls, filename, cache_dir, relevant_attributes=None, multivalue_keys=frozenset(), ignore_unknown_multivalues=False, feature_types=None, jobs=1):
+        '''
+        Loads unfiltered annotation from a snapshot in `cache_dir` or parses GTF file and stores its snapshot.
+        Records keep values of `SNAPSHOT_ATTRIBUTES` and `relevant_attributes`, so a snapshot can be filtered by them (see `filtered`).
+        A snapshot is shared by loads with any filters by these attributes.
+        '''
+        kept_attributes = SNAPSHOT_ATTRIBUTES.union(relevant_attributes or set())
+        load_options = {
+            'kept_attributes': sorted(kept_attributes),
+            'multivalue_keys': sorted(multivalue_keys),
+            'ignore_unknown_multivalues': ignore_unknown_multivalues,
+            'feature_types': None if feature_types is None else sorted(feature_types),
+        }
+        cache_filename = snapshot_filename(cache_dir, filename, load_options)
+        if os.path.exists(cache_filename):
+            return cls.from_arrays(load_arrays(cache_filename))
+        annotation = cls._load_records(filename, jobs=jobs, kept_attributes=kept_attributes,
+                                       relevant_attributes=cls.with_necessary_attributes(kept_attributes), multivalue_keys=multivalue_keys,
+                                       ignore_unknown_multivalues=ignore_unknown_multivalues, feature_types=feature_types)
+        save_arrays(annotation.to_arrays(), cache_filename)
+        return annotation
+
+    @classmethod
+    def _load_records(cls, filename, jobs=1, condition=None, kept_attributes=(), **parse_options):
+        file_chunks = split_file(filename, jobs * FILE_CHUNKS_PER_JOB) if jobs > 1 else None
+        if file_chunks is None:
+            return cls.from_records(cls.each_record_in_file(filename, condition=condition, **parse_options), kept_attributes=kept_attributes)
+        # partial annotations are merged in order of chunks, so the result doesn't depend on number of jobs
+        builder = AnnotationBuilder()
+        load_chunk_fn = functools.partial(load_chunk_arrays, condition=condition, kept_attributes=kept_attributes, **parse_options)
+        for arrays in ordered_map(load_chunk_fn, file_chunks, jobs=jobs):
+            builder.push_annotation(cls.from_arrays(arrays))
+        return builder.build()
+
+    @classmethod
+    def each_chunk_in_file(cls, filename, chunk_size=CHUNK_SIZE, relevant_attributes=None, multivalue_keys=frozenset(), ignore_unknown_multivalues=False,
+                           condition=None, feature_types=None, line_filter=None):
+        '''
+        Loads annotation from a GTF file chunk by chunk (options are the same as in `load`).
+        Yields annotations of consecutive genes with at least `chunk_size` records in total (except the last one),
+        so only records of a single chunk are kept in memory.
+        Records of each gene should go contiguously (as in GENCODE and Ensembl), otherwise `UngroupedAnnotationError` is raised.
+        '''
+        records = cls.each_record_in_file(filename, relevant_attributes=cls.with_necessary_attributes(relevant_attributes),
+                                          multivalue_keys=multivalue_keys, ignore_unknown_multivalues=ignore_unknown_multivalues,
+                                          condition=condition, feature_types=feature_types, line_filter=line_filter)
+        finished_genes = set()
+        chunk = []
+        for (gene_id, gene_records) in itertools.groupby(records, key=lambda rec: rec.attributes['gene_id']):
+            if gene_id in finished_genes:
+                raise UngroupedAnnotationError(f'Records of gene `{gene_id}` don\'t go contiguously')
+            finished_genes.add(gene_id)
+            chunk.extend(gene_records)
+            if len(chunk) >= chunk_size:
+                yield cls.from_records(chunk)
+                chunk = []
+        if chunk:
+            yield cls.from_records(chunk)
+
+    @classmethod
+    def each_record_in_file(cls, filename, relevant_attributes=None, multivalue_keys=frozenset(), ignore_unknown_multivalues=False, condition=None, feature_types=None, line_filter=None):
+        records = GTFRecord.each_in_file(filename, multivalue_keys=multivalue_keys, ignore_unknown_multivalues=ignore_unknown_multivalues,
+                                         relevant_attributes=relevant_attributes, feature_types=feature_types, line_filter=line_filter)
+        if condition:
+            records = filter(condition, records)
+        return records
+
+    @classmethod
+    def with_necessary_attributes(cls, relevant_attributes):
+        if relevant_attributes is None:
+            return None
+        # that's the minimum list of attributes for a library to properly work
+        necessary_attributes = {'gene_id', 'transcript_id',}
+        return relevant_attributes.union(necessary_attributes)
+
+    @classmethod
+    def from_records(cls, records, kept_attributes=()):
+        builder = AnnotationBuilder(kept_attributes)
+        for rec in records:
+            builder.push_record(rec)
+        return builder.build()
+
+    def filtered(self, condition):
+        '''
+        Annotation of records which pass a `condition`.
+        Condition is checked only once per attribute set, so it should depend only on attributes kept in attribute sets.
+        '''
+        accepted_attribute_sets = np.array([bool(condition(GTFRecord(None, None, None, None, None, None, None, None, json.loads(attributes))))
+                                            for attributes in self.attribute_sets], dtype=bool)
+        builder = AnnotationBuilder()
+        builder.push_annotation(self, accepted_attribute_sets)
+        return builder.build()
+
+    def to_arrays(self):
+        '''Annotation as a dictionary of numpy arrays'''
+        arrays = {field: getattr(self, field) for field in self.ARRAY_FIELDS}
+        arrays.update({field: np.array(getattr(self, field), dtype=str) for field in ['contigs', 'types', 'attribute_sets', 'gene_ids', 'transcript_gene_ids']})
+        arrays['transcript_ids'] = np.array(self._transcript_ids, dtype=str)
+        arrays['num_transcript_records'] = np.array(self.num_transcript_records)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        lists = {field: arrays[field].tolist() for field in cls.LIST_FIELDS}
+        return cls(**lists, num_transcript_records=int(arrays['num_transcript_records']),
+                   **{field: arrays[field] for field in cls.ARRAY_FIELDS})
+
+    @property
+    def transcript_ids(self):
+        '''Identifiers of transcripts (which have their own records) in order of records'''
+        return self._transcript_ids[:self.num_transcript_records]
+
+    def transcript_gene_id(self, transcript_id):
+        return self.transcript_gene_ids[self.transcript_index[transcript_id]]
+
+    def gene_record(self, gene_id):
+        idx = self.gene_index[gene_id]
+        return GTFRecord(self.contigs[self.gene_contigs[idx]], None, 'gene', int(self.gene_starts[idx]), int(self.gene_stops[idx]),
+                         None, STRAND_BY_CODE[self.gene_strands[idx]], None, {'gene_id': gene_id})
+
+    def transcript_record(self, transcript_id):
+        idx = self.transcript_index[transcript_id]
+        if idx >= self.num_transcript_records:
+            raise KeyError(transcript_id)
+        attributes = {'gene_id': self.transcript_gene_ids[idx], 'transcript_id': transcript_id}
+        return GTFRecord(self.contigs[self.transcript_contigs[idx]], None, 'transcript', int(self.transcript_starts[idx]), int(self.transcript_stops[idx]),
+                         None, STRAND_BY_CODE[self.transcript_strands[idx]], None, attributes)
+
+    def _parts_range(self, transcript_id, feature_type=None):
+        '''Range of indices of transcript parts of a certain type (or of all types)'''
+        transcript_idx = self.transcript_index.get(transcript_id)
+        if transcript_idx is None:
+            return (0, 0)
+        num_types = len(self.types)
+        if feature_type is None:
+            return (self.part_offsets[transcript_idx * num_types], self.part_offsets[(transcript_idx + 1) * num_types])
+        type_idx = self.type_index.get(feature_type)
+        if type_idx is None:
+            return (0, 0)
+        group_idx = transcript_idx * num_types + type_idx
+        return (self.part_offsets[group_idx], self.part_offsets[group_idx + 1])
+
+    def transcript_parts(self, transcript_id, feature_type):
+        '''Parts of a certain type of a transcript as GTF records sorted by start'''
+        start_idx, stop_idx = self._parts_range(transcript_id, feature_type)
+        if start_idx == stop_idx:
+            return []
+        attributes = {'gene_id': self.transcript_gene_id(transcript_id), 'transcript_id': transcript_id}
+        rows = zip(self.part_contigs[start_idx:stop_idx].tolist(), self.part_starts[start_idx:stop_idx].tolist(),
+                   self.part_stops[start_idx:stop_idx].tolist(), self.part_strands[start_idx:stop_idx].tolist())
+        return [GTFRecord(self.contigs[contig], None, feature_type, start, stop, None, STRAND_BY_CODE[strand], None, dict(attributes))
+                for (contig, start, stop, strand) in rows]
 
     def transcript_exons(self, transcript_id):
-        parts = self.parts_by_transcript[transcript_id]
-        return [part  for part in parts  if part.type == 'exon']
+        return self.transcript_parts(transcript_id, 'exon')
 
     def transcript_cds(self, transcript_id):
-        parts = self.parts_by_transcript[transcript_id]
-        return [part  for part in parts  if part.type == 'CDS']
+        return self.transcript_parts(transcript_id, 'CDS')
 
     def transcript_start_codons(self, transcript_id):
         '''
@@ -58,9 +395,7 @@ class Annotation:
         don't have an annotated start/stop codon or have
         several segments due to splicing
         '''
-        parts = self.parts_by_transcript[transcript_id]
-        start_codons = [part  for part in parts  if part.type == 'start_codon']
-        return start_codons
+        return self.transcript_parts(transcript_id, 'start_codon')
 
     def transcript_stop_codons(self, transcript_id):
         '''
@@ -68,33 +403,29 @@ class Annotation:
         don't have an annotated start/stop codon or have
         several segments due to splicing
         '''
-        parts = self.parts_by_transcript[transcript_id]
-        stop_codons = [part  for part in parts  if part.type == 'stop_codon']
-        return stop_codons
+        return self.transcript_parts(transcript_id, 'stop_codon')
 
     def transcript_utrs(self, transcript_id):
-        parts = self.parts_by_transcript[transcript_id]
-        return [part  for part in parts  if part.type == 'UTR']
+        return self.transcript_parts(transcript_id, 'UTR')
 
     def transcript_3_utrs(self, transcript_id):
-        parts = self.parts_by_transcript[transcript_id]
-        # start_codons = [part  for part in parts  if part.type == 'start_codon']
-        cds_segments = [part  for part in parts  if part.type == 'CDS']
-        cds_segments = self.segments_ordered_5_to_3(cds_segments)
+        cds_segments = self.segments_ordered_5_to_3(self.transcript_cds(transcript_id))
         # we don't care, that pivot point is not gene start for "-" strand
         # we need just any point in CDS to distinguish 5'-UTR from 3'-UTR
         pivot = cds_segments[0].start
-        return [part  for part in parts  if part.type == 'UTR' and part.in_downstream_of(pivot)]
+        return [part  for part in self.transcript_utrs(transcript_id)  if part.in_downstream_of(pivot)]
 
     def transcript_5_utrs(self, transcript_id):
-        parts = self.parts_by_transcript[transcript_id]
-        cds_segments = [part  for part in parts  if part.type == 'CDS']
-        cds_segments = self.segments_ordered_5_to_3(cds_segments)
+        cds_segments = self.segments_ordered_5_to_3(self.transcript_cds(transcript_id))
         pivot = cds_segments[0].start
-        return [part  for part in parts  if part.type == 'UTR' and part.in_upstream_of(pivot)]
+        return [part  for part in self.transcript_utrs(transcript_id)  if part.in_upstream_of(pivot)]
 
     def transcript_strand(self, transcript_id):
-        return self.segments_strand(self.parts_by_transcript[transcript_id])
+        start_idx, stop_idx = self._parts_range(transcript_id)
+        strands = np.unique(self.part_strands[start_idx:stop_idx])
+        if len(strands) != 1:
+            raise ValueError('Different strands')
+        return STRAND_BY_CODE[strands[0]]
 
     @classmethod
     def segments_strand(cls, segments):
@@ -113,33 +444,72 @@ class Annotation:
         return sorted(segments, key=by_start_coordinate, reverse=reverse_order)
 
     def coding_transcript_info(self, transcript_id):
-        """Return coding transcript info. This method fails when called for non-coding transcript"""
-        gene_id = self.geneId_by_transcript[transcript_id]
-        exons = self.transcript_exons(transcript_id)
-        cds_segments = self.transcript_cds(transcript_id)
-        strand = self.transcript_strand(transcript_id)
-
-        transcript_length = sum(exon.length for exon in exons)
-
-        if len(cds_segments) == 0:
-            return CodingTranscriptInfo(gene_id, transcript_id, transcript_length, '', '')
-
-        len_cds_in_transcript = sum(cds.length for cds in cds_segments)
-        if strand == '+':
-            genomic_cds_start = min([rec.start for rec in cds_segments])
-            len_exons_before_cds = sum( exon.length  for exon in exons  if exon.in_upstream_of(genomic_cds_start) )
-            exon_with_cds = take_the_only([exon for exon in exons  if exon.contain_position(genomic_cds_start)])
-            cds_offset = genomic_cds_start - exon_with_cds.start  # offset of CDS relative to embracing exon
-        elif strand == '-':
-            genomic_cds_start = max([rec.stop - 1 for rec in cds_segments])
-            len_exons_before_cds = sum( exon.length  for exon in exons  if exon.in_upstream_of(genomic_cds_start) )
-            exon_with_cds = take_the_only([exon for exon in exons  if exon.contain_position(genomic_cds_start)])
-            cds_offset = exon_with_cds.stop - 1 - genomic_cds_start  # offset of CDS relative to embracing exon
-
-        cds_start = cds_offset + len_exons_before_cds
-        cds_stop = cds_start + len_cds_in_transcript
-
-        return CodingTranscriptInfo(gene_id, transcript_id, transcript_length, cds_start, cds_stop)
+        """Return coding transcript info. CDS coordinates of a non-coding transcript are None"""
+        return self.coding_transcript_infos([transcript_id])[0]
+
+    def coding_transcript_infos(self, transcript_ids=None):
+        '''
+        Coding transcript infos of transcripts (by default of all transcripts which have records).
+        Computed for all transcripts at once, in time proportional to a total number of their parts.
+        '''
+        if transcript_ids is None:
+            transcript_ids = self.transcript_ids
+        transcript_ids = list(transcript_ids)
+        num_transcripts = len(transcript_ids)
+        num_types = len(self.types)
+        transcript_indices = np.array([self.transcript_index[transcript_id] for transcript_id in transcript_ids], dtype=np.int64)
+
+        # indices of all parts of requested transcripts and positions of their transcripts in a request
+        range_starts = self.part_offsets[transcript_indices * num_types]
+        range_lengths = self.part_offsets[(transcript_indices + 1) * num_types] - range_starts
+        owner = np.repeat(np.arange(num_transcripts), range_lengths)
+        part_indices = np.arange(len(owner)) + np.repeat(range_starts - (np.cumsum(range_lengths) - range_lengths), range_lengths)
+
+        part_strands = self.part_strands[part_indices]
+        num_plus = np.bincount(owner[part_strands == 1], minlength=num_transcripts)
+        strand_ok = (range_lengths > 0) & ((num_plus == 0) | (num_plus == range_lengths))
+        if not np.all(strand_ok):
+            raise ValueError(f'Different strands in transcript `{transcript_ids[np.argmin(strand_ok)]}`')
+        is_plus = (num_plus > 0)
+
+        part_types = self.part_types[part_indices]
+        part_starts = self.part_starts[part_indices]
+        part_stops = self.part_stops[part_indices]
+        is_exon = (part_types == self.type_index.get('exon', -1))
+        is_cds = (part_types == self.type_index.get('CDS', -1))
+        exon_owner, exon_start, exon_stop = owner[is_exon], part_starts[is_exon], part_stops[is_exon]
+        cds_owner, cds_start, cds_stop = owner[is_cds], part_starts[is_cds], part_stops[is_cds]
+
+        transcript_lengths = np.bincount(exon_owner, weights=exon_stop - exon_start, minlength=num_transcripts).astype(np.int64)
+        cds_lengths = np.bincount(cds_owner, weights=cds_stop - cds_start, minlength=num_transcripts).astype(np.int64)
+        has_cds = np.bincount(cds_owner, minlength=num_transcripts) > 0
+
+        # genomic position of CDS start: the leftmost CDS nucleotide on `+` strand, the rightmost on `-` strand
+        genomic_cds_start = np.where(is_plus, np.iinfo(np.int64).max, np.iinfo(np.int64).min)
+        np.minimum.at(genomic_cds_start, cds_owner[is_plus[cds_owner]], cds_start[is_plus[cds_owner]])
+        np.maximum.at(genomic_cds_start, cds_owner[~is_plus[cds_owner]], cds_stop[~is_plus[cds_owner]] - 1)
+        genomic_cds_start[~has_cds] = 0
+
+        exon_is_plus = is_plus[exon_owner]
+        exon_pos = genomic_cds_start[exon_owner]
+        exon_in_upstream = np.where(exon_is_plus, exon_stop <= exon_pos, exon_pos < exon_start)
+        len_exons_before_cds = np.bincount(exon_owner, weights=(exon_stop - exon_start) * exon_in_upstream, minlength=num_transcripts).astype(np.int64)
+        exon_with_cds = (exon_start <= exon_pos) & (exon_pos < exon_stop)
+        # offset of CDS relative to embracing exon
+        exon_cds_offsets = np.where(exon_is_plus, exon_pos - exon_start, exon_stop - 1 - exon_pos)
+        num_exons_with_cds = np.bincount(exon_owner[exon_with_cds], minlength=num_transcripts)
+        cds_offsets = np.bincount(exon_owner[exon_with_cds], weights=exon_cds_offsets[exon_with_cds], minlength=num_transcripts).astype(np.int64)
+        wrong_cds = has_cds & (num_exons_with_cds != 1)
+        if np.any(wrong_cds):
+            idx = np.argmax(wrong_cds)
+            raise ValueError(f'CDS start of transcript `{transcript_ids[idx]}` should be in exactly one exon but is in {num_exons_with_cds[idx]} exons')
+
+        cds_starts = cds_offsets + len_exons_before_cds
+        cds_stops = cds_starts + cds_lengths
+        gene_ids = [self.transcript_gene_ids[idx] for idx in transcript_indices.tolist()]
+        rows = zip(gene_ids, transcript_ids, transcript_lengths.tolist(), cds_starts.tolist(), cds_stops.tolist(), has_cds.tolist())
+        return [CodingTranscriptInfo(gene_id, transcript_id, transcript_length, cds_start if coding else None, cds_stop if coding else None)
+                for (gene_id, transcript_id, transcript_length, cds_start, cds_stop, coding) in rows]
 
     def ordered_segments_by_type(self, transcript_id, feature_type):
         if feature_type == 'exons':
@@ -154,7 +524,7 @@ class Annotation:
             return self.segments_ordered_5_to_3(self.transcript_3_utrs(transcript_id))
         elif feature_type == 'full':
             # full, unspliced transcript
-            return [self.transcript_by_id(transcript_id)]
+            return [self.transcript_record(transcript_id)]
 
 
     def segments_as_bedtool_intervals(self, segments, name='.'):
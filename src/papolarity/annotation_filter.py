@@ -1,8 +1,66 @@
+import functools
+
+# GENCODE attributes which can occur several times in a record
+DEFAULT_MULTIVALUE_KEYS = frozenset({'tag', 'ont'})
+
 def parse_condition(condition_str):
     k,vs = condition_str.split('=', maxsplit=1)
     return (k, vs.split(','))
 
+# Filters are partials of module-level functions (not closures or lambdas)
+# so that they can be passed to worker processes.
 # Known issue: filters now treat all attribute values as strings
+def record_passes(condition_config, rec):
+    k,vs = condition_config
+    value = rec.attributes.get(k, '')
+    # multivalue attributes pass a filter if any of values is acceptable
+    if isinstance(value, list):
+        return any(str(v) in vs for v in value)
+    return str(value) in vs
+
+def line_contains(value, line):
+    return value in line
+
+def line_contains_any(values, line):
+    for value in values:
+        if value in line:
+            return True
+    return False
+
+def passes_all(filters, obj):
+    return all(f(obj) for f in filters)
+
 def create_record_filter(condition_config):
+    return functools.partial(record_passes, condition_config)
+
+def create_line_prefilter(condition_config):
+    '''
+    Fast check of a raw GTF line which rejects lines which can't pass a record filter.
+    Returns None when a filter can't reject anything (e.g. when missing attribute is acceptable).
+    '''
     k,vs = condition_config
-    return lambda rec: str(rec.attributes.get(k, '')) in vs
+    if '' in vs:
+        return None
+    # a value should occur somewhere in a line (lines without it certainly don't pass a filter)
+    if len(vs) == 1:
+        return functools.partial(line_contains, vs[0])
+    return functools.partial(line_contains_any, vs)
+
+def create_filters(condition_strs):
+    '''
+    Takes conditions in `attribute=value_1,value_2,...` format.
+    Returns a tuple (record filter, line prefilter, attributes used in conditions), filters are None if there are no conditions
+    '''
+    condition_configs = [parse_condition(condition_str) for condition_str in condition_strs]
+    record_filters = [create_record_filter(condition_config) for condition_config in condition_configs]
+    line_prefilters = [create_line_prefilter(condition_config) for condition_config in condition_configs]
+    line_prefilters = [line_prefilter for line_prefilter in line_prefilters if line_prefilter is not None]
+    record_filter = functools.partial(passes_all, record_filters) if record_filters else None
+    if len(line_prefilters) == 0:
+        line_prefilter = None
+    elif len(line_prefilters) == 1:
+        line_prefilter = line_prefilters[0]
+    else:
+        line_prefilter = functools.partial(passes_all, line_prefilters)
+    relevant_attributes = {k for (k,v) in condition_configs}
+    return (record_filter, line_prefilter, relevant_attributes)
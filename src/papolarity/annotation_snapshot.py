@@ -0,0 +1,49 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+# Annotation snapshot is a single `.npz` file with arrays of an `Annotation` (see `Annotation.to_arrays`):
+# interned contig and type names, identifiers of genes and transcripts, coordinates and strands of genes, transcripts and their parts,
+# interned sets of attributes of records (so that a snapshot of unfiltered annotation can be filtered after loading).
+# Snapshots are stored in a cache folder under names derived from a GTF file and load options (see `snapshot_filename`).
+FORMAT_NAME = 'papolarity-annotation-snapshot'
+FORMAT_VERSION = 1
+
+def snapshot_filename(cache_dir, gtf_filename, load_options):
+    '''
+    Path of a snapshot of annotation loaded from a GTF file with specified options (a json-serializable dict).
+    File path, size and modification time are the part of a key, so a snapshot of a modified file is never reused.
+    '''
+    stat = os.stat(gtf_filename)
+    key = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'path': os.path.abspath(gtf_filename),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'options': load_options,
+    }
+    key_hash = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, f'annotation_{key_hash}.npz')
+
+def save_arrays(arrays, filename):
+    '''Stores a dictionary of numpy arrays into a snapshot file (atomically, so a partially written snapshot is never read)'''
+    cache_dir = os.path.dirname(filename) or '.'
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, temp_filename = tempfile.mkstemp(dir=cache_dir, suffix='.npz.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, format=np.array([FORMAT_NAME, str(FORMAT_VERSION)]), **arrays)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+
+def load_arrays(filename):
+    '''Loads a dictionary of numpy arrays from a snapshot file'''
+    with np.load(filename, allow_pickle=False) as snapshot:
+        if snapshot['format'].tolist() != [FORMAT_NAME, str(FORMAT_VERSION)]:
+            raise ValueError(f'`{filename}` is not an annotation snapshot of version {FORMAT_VERSION}')
+        return {key: snapshot[key] for key in snapshot.files if key != 'format'}
@@ -0,0 +1,116 @@
+import numpy as np
+from .gzip_utils import open_for_read
+
+# Size (in characters) of a chunk of text which is parsed at once
+BLOCK_SIZE = 16 * 1024 * 1024
+
+def each_text_block(filename, header=False, force_gzip=None, block_size=BLOCK_SIZE):
+    '''
+    Yields large chunks of text from a file.
+    Each chunk consists of whole lines (lines are never split between chunks).
+    '''
+    with open_for_read(filename, force_gzip=force_gzip) as f:
+        if header:
+            f.readline() # skip header
+        remainder = ''
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            last_newline = block.rfind('\n')
+            if last_newline == -1:
+                remainder += block
+                continue
+            yield remainder + block[:(last_newline + 1)]
+            remainder = block[(last_newline + 1):]
+        if remainder:
+            yield remainder
+
+def parse_values(tokens, dtype=float):
+    values = np.array(tokens)
+    try:
+        return values.astype(dtype)
+    except ValueError:
+        # if dtype is integer, string "1.2345e6" can't be directly converted to int
+        return values.astype(float).astype(dtype)
+
+def parse_bedgraph_block(text, dtype=float):
+    '''
+    Parses a chunk of bedgraph lines into arrays.
+    Returns a tuple (chroms, starts, stops, values) where `chroms` is a list of strings
+    and other elements are numpy arrays
+    '''
+    tokens = text.split()
+    if len(tokens) % 4 != 0:
+        raise ValueError('Bedgraph should have exactly 4 columns: chrom, start, stop and coverage value')
+    chroms = tokens[0::4]
+    starts = np.array(tokens[1::4]).astype(np.int64)
+    stops = np.array(tokens[2::4]).astype(np.int64)
+    values = parse_values(tokens[3::4], dtype=dtype)
+    return (chroms, starts, stops, values)
+
+def chrom_boundaries(chroms):
+    '''
+    Returns indices of first elements of each group of identical consecutive chromosomes
+    and an index after the last element
+    '''
+    chroms = np.array(chroms)
+    changes = np.flatnonzero(chroms[1:] != chroms[:-1]) + 1
+    return np.concatenate(([0], changes, [len(chroms)]))
+
+def parse_bed_block(text):
+    '''
+    Parses a chunk of bed lines (3 standard columns + any number of non-standard) into arrays.
+    Returns a tuple (chroms, starts, stops); non-standard columns are ignored
+    '''
+    rows = [line.split('\t', 3) for line in text.splitlines() if line]
+    if len(rows) == 0:
+        return ([], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    if any(len(row) < 3 for row in rows):
+        raise ValueError('Bed file should have at least 3 columns: chrom, start and stop')
+    chroms = [row[0] for row in rows]
+    starts = np.array([row[1] for row in rows]).astype(np.int64)
+    stops = np.array([row[2] for row in rows]).astype(np.int64)
+    return (chroms, starts, stops)
+
+def each_transcript_intervals(filename, header=False, dtype=float, force_gzip=None):
+    '''
+    Yields tuples (transcript_id, starts, stops, values) for each group of
+    consecutive bedgraph lines with the same chromosome (transcript).
+    Lines are parsed in large blocks, no per-line objects are created.
+    '''
+    parsed_blocks = (parse_bedgraph_block(text, dtype=dtype) for text in each_text_block(filename, header=header, force_gzip=force_gzip))
+    yield from _each_chrom_group(parsed_blocks)
+
+def each_bed_intervals(filename, header=False, force_gzip=None):
+    '''Yields tuples (chrom, starts, stops) for each group of consecutive bed lines with the same chromosome'''
+    parsed_blocks = (parse_bed_block(text) for text in each_text_block(filename, header=header, force_gzip=force_gzip))
+    yield from _each_chrom_group(parsed_blocks)
+
+def _each_chrom_group(parsed_blocks):
+    '''
+    Takes blocks `(chroms, *arrays)`, yields `(chrom, *arrays)` for each group of consecutive
+    elements with the same chromosome (groups can span several blocks)
+    '''
+    pending_chrom = None
+    pending_parts = []
+    for (chroms, *arrays) in parsed_blocks:
+        if len(chroms) == 0:
+            continue
+        boundaries = chrom_boundaries(chroms)
+        for (group_start, group_stop) in zip(boundaries[:-1], boundaries[1:]):
+            chrom = chroms[group_start]
+            part = tuple(array[group_start:group_stop] for array in arrays)
+            if chrom != pending_chrom:
+                if pending_parts:
+                    yield (pending_chrom, *_concatenate_parts(pending_parts))
+                pending_chrom = chrom
+                pending_parts = []
+            pending_parts.append(part)
+    if pending_parts:
+        yield (pending_chrom, *_concatenate_parts(pending_parts))
+
+def _concatenate_parts(parts):
+    if len(parts) == 1:
+        return parts[0]
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
@@ -0,0 +1,55 @@
+import numpy as np
+from .run_length_profile import RunLengthProfile
+from .utils import constant_interval_arrays
+
+# Size of formatted text accumulated before it's written to an output stream
+BUFFER_SIZE = 4 * 1024 * 1024
+
+class BedgraphWriter:
+    '''
+    Writes bedgraph intervals given as whole arrays (per transcript).
+    Intervals are formatted in bulk and written to a stream in large chunks.
+    Output is the same as of `CoverageInterval.print_tsv` with the same `dtype`.
+    '''
+    def __init__(self, stream, dtype=float, buffer_size=BUFFER_SIZE):
+        self.stream = stream
+        self.dtype = dtype
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._buffer_length = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excinfo):
+        self.flush()
+
+    def write_intervals(self, chrom, starts, stops, values):
+        if len(starts) == 0:
+            return
+        # `tolist` converts numpy scalars to python ones so that they are formatted the same way as by `str`
+        values = np.asarray(values).astype(self.dtype, copy=False).tolist()
+        prefix = f'{chrom}\t'
+        text = '\n'.join([f'{prefix}{start}\t{stop}\t{value}' for (start, stop, value) in zip(np.asarray(starts).tolist(), np.asarray(stops).tolist(), values)])
+        self._buffer.append(text)
+        self._buffer.append('\n')
+        self._buffer_length += len(text) + 1
+        if self._buffer_length >= self.buffer_size:
+            self.flush()
+
+    def write_profile(self, chrom, profile):
+        '''Writes a dense or a run-length encoded profile as constant intervals'''
+        if isinstance(profile, RunLengthProfile):
+            self.write_intervals(chrom, *profile.merged_runs())
+        else:
+            self.write_intervals(chrom, *constant_interval_arrays(profile))
+
+    def write_transcript_coverages(self, transcript_coverages):
+        for transcript_coverage in transcript_coverages:
+            self.write_profile(transcript_coverage.transcript_id, transcript_coverage.coverage)
+
+    def flush(self):
+        if self._buffer:
+            self.stream.write(''.join(self._buffer))
+            self._buffer = []
+            self._buffer_length = 0
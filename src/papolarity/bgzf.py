@@ -0,0 +1,307 @@
+'''
+BGZF-style block-gzip files. Each block is a separate gzip member (so the file
+is readable by ordinary gzip tools) of at most 64Kb, which lets us seek to any line
+by a virtual offset: `(compressed offset of a block << 16) | (offset inside uncompressed block)`.
+
+A writer can build a contig index: a table with virtual offset of the first line of each contig.
+Index is stored next to the file with an additional `.tidx` extension.
+'''
+import os
+import struct
+import zlib
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+# samtools/htslib use the same limit for uncompressed block size
+MAX_BLOCK_SIZE = 0xff00
+INDEX_EXTENSION = '.tidx'
+
+_BLOCK_HEADER = struct.Struct('<4BI2BH2BHH') # standard gzip header with a single `BC` extra subfield
+_BLOCK_FOOTER = struct.Struct('<2I') # crc32, uncompressed size
+_EOF_BLOCK = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+def index_filename(filename):
+    return filename + INDEX_EXTENSION
+
+def compress_block(data, compresslevel=6):
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    compressed_data = compressor.compress(data) + compressor.flush()
+    block_size = _BLOCK_HEADER.size + len(compressed_data) + _BLOCK_FOOTER.size
+    header = _BLOCK_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, block_size - 1)
+    footer = _BLOCK_FOOTER.pack(zlib.crc32(data), len(data))
+    return header + compressed_data + footer
+
+def make_virtual_offset(block_offset, within_block_offset):
+    return (block_offset << 16) | within_block_offset
+
+def split_virtual_offset(virtual_offset):
+    return (virtual_offset >> 16, virtual_offset & 0xffff)
+
+class BgzfWriter:
+    '''
+    Text-mode writer of block-gzip files. Blocks can be compressed in several threads.
+    If `index_contigs` is set, the first column of each line is treated as a contig name
+    and virtual offset of the first line of each contig is stored into an index file.
+    '''
+    def __init__(self, filename, index_contigs=False, compresslevel=6, encoding='utf-8', num_threads=1):
+        self.filename = filename
+        self.index_contigs = index_contigs
+        self.compresslevel = compresslevel
+        self.encoding = encoding
+        self._file = open(filename, 'wb')
+        self._buffer = bytearray()
+        self._executor = ThreadPoolExecutor(max_workers=num_threads) if num_threads > 1 else None
+        self.max_blocks_in_flight = 4 * num_threads
+        self._compressed_blocks = collections.deque()
+        # Compressed offsets of blocks aren't known until blocks are compressed,
+        # so line positions are stored as (block number, offset inside block) pairs
+        self._num_blocks = 0
+        self._block_offsets = [0]
+        self._contig_positions = {}
+        self._last_contig = None
+        # first field of a line which is being written (None when it's already registered)
+        self._line_head = bytearray()
+        self._line_start = (0, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excinfo):
+        self.close()
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        data = text.encode(self.encoding)
+        pos = 0
+        while pos < len(data):
+            piece = data[pos:(pos + MAX_BLOCK_SIZE - len(self._buffer))]
+            if self.index_contigs:
+                self._scan_line_starts(piece)
+            self._buffer += piece
+            pos += len(piece)
+            if len(self._buffer) >= MAX_BLOCK_SIZE:
+                self._submit_block()
+        return len(text)
+
+    def _scan_line_starts(self, piece):
+        pos = 0
+        while pos < len(piece):
+            if self._line_head is not None:
+                field_end = _find_first(piece, (b'\t', b'\n'), pos)
+                self._line_head += piece[pos:field_end]
+                if field_end == len(piece):
+                    return
+                self._register_contig(self._line_head.decode(self.encoding), self._line_start)
+                self._line_head = None
+                pos = field_end
+            newline_pos = piece.find(b'\n', pos)
+            if newline_pos == -1:
+                return
+            pos = newline_pos + 1
+            self._line_head = bytearray()
+            self._line_start = (self._num_blocks, len(self._buffer) + pos)
+
+    def _register_contig(self, contig, line_position):
+        if contig != self._last_contig:
+            self._last_contig = contig
+            if contig not in self._contig_positions:
+                self._contig_positions[contig] = line_position
+
+    def _submit_block(self):
+        data = bytes(self._buffer)
+        self._buffer = bytearray()
+        self._num_blocks += 1
+        if self._executor:
+            # zlib releases GIL during compression, so blocks are really compressed in parallel
+            self._compressed_blocks.append(self._executor.submit(compress_block, data, compresslevel=self.compresslevel))
+            while len(self._compressed_blocks) > self.max_blocks_in_flight:
+                self._write_block(self._compressed_blocks.popleft().result())
+        else:
+            self._write_block(compress_block(data, compresslevel=self.compresslevel))
+
+    def _write_block(self, block):
+        self._file.write(block)
+        self._block_offsets.append(self._block_offsets[-1] + len(block))
+
+    @property
+    def contig_offsets(self):
+        '''Virtual offsets of contigs (available after file is closed)'''
+        return {contig: make_virtual_offset(self._block_offsets[block_idx], within_block_offset)
+                for (contig, (block_idx, within_block_offset)) in self._contig_positions.items()}
+
+    def flush(self):
+        # flushing an incomplete block would make blocks smaller, so we flush only underlying file
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self._buffer:
+            self._submit_block()
+        while self._compressed_blocks:
+            self._write_block(self._compressed_blocks.popleft().result())
+        if self._executor:
+            self._executor.shutdown()
+        self._file.write(_EOF_BLOCK)
+        self._file.close()
+        if self.index_contigs:
+            store_index(index_filename(self.filename), self.contig_offsets)
+
+def _find_first(data, patterns, start):
+    positions = [data.find(pattern, start) for pattern in patterns]
+    positions = [pos for pos in positions if pos != -1]
+    return min(positions) if positions else len(data)
+
+def store_index(filename, contig_offsets):
+    with open(filename, 'w') as f:
+        print('contig\tvirtual_offset', file=f)
+        for (contig, virtual_offset) in contig_offsets.items():
+            print(f'{contig}\t{virtual_offset}', file=f)
+
+def load_index(filename):
+    contig_offsets = {}
+    with open(filename) as f:
+        f.readline() # skip header
+        for line in f:
+            contig, virtual_offset = line.rstrip('\n').split('\t')
+            contig_offsets[contig] = int(virtual_offset)
+    return contig_offsets
+
+def has_index(filename):
+    '''Checks that file has an index which is not older than the file itself'''
+    if not (filename and os.path.exists(filename) and os.path.exists(index_filename(filename))):
+        return False
+    return os.path.getmtime(index_filename(filename)) >= os.path.getmtime(filename)
+
+def _read_block_header(f, block_offset):
+    '''
+    Reads a header of a block at a given offset.
+    Returns a pair: total size of a block and size of its header (or None at the end of file)
+    '''
+    f.seek(block_offset)
+    header = f.read(12)
+    if len(header) == 0:
+        return None
+    if len(header) < 12 or header[0:4] != b'\x1f\x8b\x08\x04':
+        raise ValueError(f'Not a BGZF block at offset {block_offset}')
+    extra_length = struct.unpack('<H', header[10:12])[0]
+    extra = f.read(extra_length)
+    pos = 0
+    while pos < extra_length:
+        subfield_id, subfield_length = extra[pos:(pos + 2)], struct.unpack('<H', extra[(pos + 2):(pos + 4)])[0]
+        if subfield_id == b'BC':
+            block_size = struct.unpack('<H', extra[(pos + 4):(pos + 6)])[0] + 1
+            return (block_size, 12 + extra_length)
+        pos += 4 + subfield_length
+    raise ValueError(f'Not a BGZF block at offset {block_offset} (no block size subfield)')
+
+def is_bgzf(filename):
+    '''Checks whether a file is block-gzipped (by the header of the first block)'''
+    with open(filename, 'rb') as f:
+        try:
+            return _read_block_header(f, 0) is not None
+        except ValueError:
+            return False
+
+def block_offsets(filename):
+    '''Compressed offsets of all blocks of a file (only block headers are read, blocks are not decompressed)'''
+    offsets = []
+    with open(filename, 'rb') as f:
+        block_offset = 0
+        block_header = _read_block_header(f, block_offset)
+        while block_header is not None:
+            offsets.append(block_offset)
+            block_offset += block_header[0]
+            block_header = _read_block_header(f, block_offset)
+    return offsets
+
+class BgzfReader:
+    def __init__(self, filename, encoding='utf-8'):
+        self.encoding = encoding
+        self._file = open(filename, 'rb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excinfo):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def read_block(self, block_offset):
+        '''Returns a pair: decompressed data of a block and offset of the next block'''
+        block_header = _read_block_header(self._file, block_offset)
+        if block_header is None:
+            return (b'', None)
+        block_size, header_size = block_header
+        compressed_size = block_size - header_size - _BLOCK_FOOTER.size
+        data = zlib.decompress(self._file.read(compressed_size), -15)
+        self._file.read(_BLOCK_FOOTER.size)
+        return (data, block_offset + block_size)
+
+    def each_line(self, virtual_offset=0):
+        '''Yields text lines starting from a given virtual offset'''
+        block_offset, within_block_offset = split_virtual_offset(virtual_offset)
+        remainder = b''
+        while block_offset is not None:
+            data, block_offset = self.read_block(block_offset)
+            if not data:
+                continue
+            data = remainder + data[within_block_offset:]
+            within_block_offset = 0
+            lines = data.split(b'\n')
+            remainder = lines.pop()
+            for line in lines:
+                yield line.decode(self.encoding) + '\n'
+        if remainder:
+            yield remainder.decode(self.encoding)
+
+    def each_line_in_blocks(self, start_offset, stop_offset, previous_block_offset=None):
+        '''
+        Yields text lines which start in blocks at compressed offsets [start_offset, stop_offset).
+        A line which starts in these blocks is read till its end (even if it continues in the following blocks).
+        `previous_block_offset` is an offset of a (non-empty) block preceding `start_offset` or None for the first block of a file.
+        It's used to recognize that the first block starts with a continuation of a line (which is skipped).
+        '''
+        skip_partial_line = False
+        if previous_block_offset is not None:
+            previous_data, _ = self.read_block(previous_block_offset)
+            skip_partial_line = not previous_data.endswith(b'\n')
+        remainder = b''
+        block_offset = start_offset
+        while block_offset is not None:
+            in_range = (block_offset < stop_offset)
+            data, block_offset = self.read_block(block_offset)
+            if not in_range and (skip_partial_line or not remainder):
+                return
+            if skip_partial_line:
+                newline_pos = data.find(b'\n')
+                if newline_pos == -1:
+                    continue
+                data = data[(newline_pos + 1):]
+                skip_partial_line = False
+            if not in_range:
+                # finish the last line which started in range
+                newline_pos = data.find(b'\n')
+                if newline_pos == -1:
+                    remainder += data
+                    continue
+                yield (remainder + data[:(newline_pos + 1)]).decode(self.encoding)
+                return
+            lines = (remainder + data).split(b'\n')
+            remainder = lines.pop()
+            for line in lines:
+                yield line.decode(self.encoding) + '\n'
+        if remainder and not skip_partial_line:
+            yield remainder.decode(self.encoding)
+
+    def each_contig_line(self, contig, virtual_offset):
+        '''Yields consecutive lines of a contig which starts at a given virtual offset'''
+        prefix = contig + '\t'
+        for line in self.each_line(virtual_offset):
+            if not line.startswith(prefix):
+                break
+            yield line
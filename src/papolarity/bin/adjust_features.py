@@ -1,9 +1,12 @@
 import argparse
 import numpy as np
-from ..gzip_utils import open_for_write
+from ..gzip_utils import open_for_write, add_threads_argument, apply_threads_argument
 from ..tsv_reader import each_in_tsv
 from .. import utils
 
+# Number of rows read at once in `--presorted` mode
+CHUNK_SIZE = 4096
+
 def window_around_idx(arr, idx, window_size, drop_none=False):
     if drop_none:
         left_part = utils.drop_none(arr[:idx])
@@ -24,18 +27,99 @@ def window_around_idx(arr, idx, window_size, drop_none=False):
     else:
         return arr[-window_size:]
 
+def window_bounds(indices, window_size, num_values):
+    '''
+    Bounds `[start, stop)` of windows around elements with `indices` in an array of `num_values` elements.
+    Windows near array ends are shifted so that they fit an array (the same windows as in `window_around_idx`)
+    '''
+    starts = np.clip(indices - window_size // 2, 0, max(num_values - window_size, 0))
+    stops = np.minimum(starts + window_size, num_values)
+    return (starts, stops)
+
+def windowed_mean_stddev(values, starts, stops):
+    '''Means and standard deviations of `values[start:stop]` for each window, computed with running sums'''
+    # values are centered and summed in extended precision to reduce rounding errors of running sums
+    center = np.mean(values) if len(values) > 0 else 0.0
+    centered_values = (values - center).astype(np.longdouble)
+    sums = np.concatenate(([0], np.cumsum(centered_values)))
+    square_sums = np.concatenate(([0], np.cumsum(centered_values ** 2)))
+    counts = stops - starts
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centered_means = (sums[stops] - sums[starts]) / counts
+        variances = (square_sums[stops] - square_sums[starts]) / counts - centered_means ** 2
+    means = (centered_means + center).astype(float)
+    stddevs = np.sqrt(np.maximum(variances, 0)).astype(float)
+    # windows of equal values get exact mean and zero deviation
+    num_changes = np.concatenate(([0], np.cumsum(values[1:] != values[:-1])))
+    is_constant = (counts > 0) & (num_changes[np.maximum(stops - 1, starts)] == num_changes[starts])
+    means[is_constant] = values[starts[is_constant]]
+    stddevs[is_constant] = 0.0
+    return (means, stddevs)
+
 def standardize_values(values, standardization, window_size, drop_none=True):
-    standardized_values = []
-    for (idx, val) in enumerate(values):
-        window_values = window_around_idx(values, idx, window_size, drop_none=drop_none)
-        mean = np.mean(window_values)
-        stddev = np.std(window_values)
-        if val is not None:
-            standardized_value = standardization(val, val_mean=mean, val_stddev=stddev)
-            standardized_values.append(standardized_value)
+    is_present = np.array([val is not None for val in values], dtype=bool)
+    if not drop_none and not is_present.all():
+        raise ValueError('Values should not contain None unless `drop_none` is set')
+    present_values = np.array([val for val in values if val is not None], dtype=float)
+    starts, stops = window_bounds(np.arange(len(present_values)), window_size, len(present_values))
+    means, stddevs = windowed_mean_stddev(present_values, starts, stops)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        standardized_present_values = iter(standardization(present_values, val_mean=means, val_stddev=stddevs).tolist())
+    return [next(standardized_present_values) if present else None for present in is_present]
+
+class StreamingStandardizer:
+    '''
+    Standardizes values of a field in a stream of rows sorted by another field.
+    Only non-empty values which can fall into windows of rows not yet standardized are stored.
+    '''
+    def __init__(self, standardization, window_size):
+        self.standardization = standardization
+        self.window_size = window_size
+        self.history = np.zeros(0) # values preceding pending values
+        self.history_offset = 0 # index (among all non-empty values) of the first value in history
+        self.pending = [] # values of rows which weren't standardized yet (including None)
+
+    def add(self, values):
+        self.pending.extend(values)
+
+    def num_ready(self, finished=False):
+        '''Number of leading pending values whose windows are known'''
+        if finished:
+            return len(self.pending)
+        is_present = np.array([val is not None for val in self.pending], dtype=bool)
+        num_values = self.history_offset + len(self.history) + np.count_nonzero(is_present)
+        indices = self.history_offset + len(self.history) + np.cumsum(is_present) - 1
+        window_stops = np.maximum(indices - self.window_size // 2, 0) + self.window_size
+        is_ready = ~is_present | (window_stops <= num_values)
+        return len(is_ready) if is_ready.all() else int(np.argmin(is_ready))
+
+    def pop_standardized(self, num_values, finished=False):
+        '''Standardizes `num_values` leading pending values (they should be ready)'''
+        is_present = np.array([val is not None for val in self.pending], dtype=bool)
+        values = np.concatenate((self.history, np.array([val for val in self.pending if val is not None], dtype=float)))
+        total_count = (self.history_offset + len(values)) if finished else np.inf
+        local_indices = len(self.history) + np.cumsum(is_present[:num_values]) - 1
+        standardized_present = is_present[:num_values]
+        local_indices = local_indices[standardized_present]
+        if finished:
+            starts, stops = window_bounds(self.history_offset + local_indices, self.window_size, total_count)
         else:
-            standardized_values.append(None)
-    return standardized_values
+            starts = np.maximum(self.history_offset + local_indices - self.window_size // 2, 0)
+            stops = starts + self.window_size
+        means, stddevs = windowed_mean_stddev(values, starts - self.history_offset, stops - self.history_offset)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            standardized_values = iter(self.standardization(values[local_indices], val_mean=means, val_stddev=stddevs).tolist())
+        result = [next(standardized_values) if present else None for present in standardized_present]
+
+        # keep values which can fall into windows of remaining values
+        num_consumed = len(self.history) + np.count_nonzero(standardized_present)
+        num_seen = self.history_offset + len(values)
+        next_index = self.history_offset + num_consumed
+        keep_from = max(0, min(next_index - self.window_size // 2, num_seen - self.window_size))
+        self.history = values[(keep_from - self.history_offset):num_consumed]
+        self.history_offset = keep_from
+        self.pending = self.pending[num_values:]
+        return result
 
 # stddev --> 1
 def standardize_stddev(val, val_mean, val_stddev):
@@ -60,12 +144,14 @@ def configure_argparser(argparser=None):
     argparser.add_argument('--prefix', default='adjusted_', help='Prefix for corrected column name')
     argparser.add_argument('--window', metavar='SIZE', dest='window_size', type=int, default=100, help='Size of sliding window (default: %(default)s)')
     argparser.add_argument('--mode', choices=['zero_mean', 'unit_stddev', 'z-score'], default='z-score', help='How to standardize statistics (default: %(default)s)')
+    argparser.add_argument('--presorted', action='store_true', help="Table is already sorted by sort-field. Rows are processed in a streaming manner, only rows within a window are kept in memory")
     argparser.add_argument('--output-file', '-o', dest='output_file', help="Store results at this path")
     return argparser
 
 def main():
-    argparser = configure_argparser(argparser)
+    argparser = add_threads_argument(configure_argparser())
     args = argparser.parse_args()
+    apply_threads_argument(args)
     invoke(args)
 
 def invoke(args):
@@ -78,31 +164,56 @@ def invoke(args):
     else:
         raise ValueError(f'Unknown mode `{args.mode}`')
 
-    dtype = lambda x: float(x) if x != '' else None
-    data = list(each_in_tsv(args.table))
-
-    fields = list(data[0].keys())
-    TRANSFORMED_FIELDS_KEY = object() # unique object not to clash with column name
-    for row in data:
-        row[TRANSFORMED_FIELDS_KEY] = {}
-        for field in [args.sorting_field, *args.fields_to_correct]:
-            # we don't want to modify original values because type conversion can screw integer values during output
-            row[TRANSFORMED_FIELDS_KEY][field] = dtype(row[field])
-    data.sort(key=lambda info: dtype(info[args.sorting_field]))
-
-    modified_data = [row.copy() for row in data]
-    output_field_names = fields[:]
-
-    for field in args.fields_to_correct:
-        output_field_name = f'{args.prefix}{field}'
-        output_field_names.append(output_field_name)
-        field_values = [dtype(row[field]) for row in data]
-        standardized_field_values = standardize_values(field_values, standardization, args.window_size, drop_none=True)
-        for idx in range(len(data)):
-            modified_data[idx][output_field_name] = standardized_field_values[idx]
+    rows = each_in_tsv(args.table)
+    if args.presorted:
+        adjusted_rows = each_adjusted_row_presorted(rows, args.sorting_field, args.fields_to_correct, args.prefix, standardization, args.window_size)
+    else:
+        adjusted_rows = adjusted_rows_sorted(rows, args.sorting_field, args.fields_to_correct, args.prefix, standardization, args.window_size)
 
     with open_for_write(args.output_file) as output_stream:
-        print('\t'.join(output_field_names), file=output_stream)
-        for row in modified_data:
+        output_field_names = None
+        for row in adjusted_rows:
+            if output_field_names is None:
+                output_field_names = list(row.keys())
+                print('\t'.join(output_field_names), file=output_stream)
             output_values = [row[field] for field in output_field_names]
             print(utils.tsv_string_empty_none(output_values), file=output_stream)
+
+def value_or_none(x):
+    return float(x) if x != '' else None
+
+def adjusted_rows_sorted(rows, sorting_field, fields_to_correct, prefix, standardization, window_size):
+    '''Sorts rows and adds standardized values of each field (original values are kept as is)'''
+    data = sorted(rows, key=lambda row: value_or_none(row[sorting_field]))
+    for field in fields_to_correct:
+        field_values = [value_or_none(row[field]) for row in data]
+        standardized_field_values = standardize_values(field_values, standardization, window_size, drop_none=True)
+        for (row, standardized_value) in zip(data, standardized_field_values):
+            row[f'{prefix}{field}'] = standardized_value
+    return data
+
+def each_adjusted_row_presorted(rows, sorting_field, fields_to_correct, prefix, standardization, window_size):
+    '''Adds standardized values of each field to rows which are already sorted by `sorting_field`'''
+    standardizers = [StreamingStandardizer(standardization, window_size) for _ in fields_to_correct]
+    pending_rows = []
+    previous_key = None
+    for chunk in utils.each_batch(rows, CHUNK_SIZE):
+        for row in chunk:
+            key = value_or_none(row[sorting_field])
+            if (previous_key is not None) and (key < previous_key):
+                raise ValueError(f'Table is not sorted by `{sorting_field}`: {key} follows {previous_key}')
+            previous_key = key
+        pending_rows.extend(chunk)
+        for (field, standardizer) in zip(fields_to_correct, standardizers):
+            standardizer.add([value_or_none(row[field]) for row in chunk])
+        num_ready = min((standardizer.num_ready() for standardizer in standardizers), default=len(pending_rows))
+        yield from _pop_adjusted_rows(pending_rows, num_ready, fields_to_correct, prefix, standardizers)
+        pending_rows = pending_rows[num_ready:]
+    yield from _pop_adjusted_rows(pending_rows, len(pending_rows), fields_to_correct, prefix, standardizers, finished=True)
+
+def _pop_adjusted_rows(pending_rows, num_rows, fields_to_correct, prefix, standardizers, finished=False):
+    standardized_field_values = [standardizer.pop_standardized(num_rows, finished=finished) for standardizer in standardizers]
+    for (row_idx, row) in enumerate(pending_rows[:num_rows]):
+        for (field, standardized_values) in zip(fields_to_correct, standardized_field_values):
+            row[f'{prefix}{field}'] = standardized_values[row_idx]
+        yield row
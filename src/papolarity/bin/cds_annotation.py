@@ -1,8 +1,17 @@
+import sys
+import shutil
 import argparse
-from ..gzip_utils import open_for_write
-from ..annotation import Annotation
+import tempfile
+from ..gzip_utils import open_for_write, add_threads_argument, apply_threads_argument
+from ..annotation import Annotation, UngroupedAnnotationError
 from ..dto.coding_transcript_info import CodingTranscriptInfo
-from ..annotation_filter import parse_condition, create_record_filter
+from ..annotation_filter import create_filters, DEFAULT_MULTIVALUE_KEYS
+
+# Only these records are necessary to get CDS annotation, other records are skipped
+FEATURE_TYPES = frozenset({'transcript', 'exon', 'CDS'})
+
+# Size of results kept in memory in `--streaming` mode, larger results are spooled into a temporary file
+SPOOL_SIZE = 64 * 1024 * 1024
 
 def configure_argparser(argparser=None):
     if not argparser:
@@ -12,30 +21,61 @@ def configure_argparser(argparser=None):
     argparser.add_argument('--attr-filter', action='append', dest='filters', default=[], 
                                             help="Filter records so that attributes has one of specified values.\n"
                                                  "Format: `attribute=value_1,value_2,...`")
-    # Known issue: Right now all multivalue keys are ignored, so filters won't work with them
-    # ToDo: add ability to specify multivalue keys and add filters like `--filter-has tag value`
+    argparser.add_argument('--multivalue-key', action='append', dest='multivalue_keys', default=None,
+                                               help="Attribute which can occur several times in a record (e.g. `tag`). "
+                                                    "Filter by such attribute accepts a record if any of its values is acceptable. "
+                                                    f"Default: {', '.join(sorted(DEFAULT_MULTIVALUE_KEYS))}")
+    argparser.add_argument('--cache-dir', help="Folder to store a binary snapshot of parsed annotation. "
+                                               "Snapshot is not filtered, so subsequent runs on the same (unchanged) GTF file load it instead of parsing GTF "
+                                               "with any filters by gene/transcript types, tags and levels (filters by other attributes use their own snapshot)")
+    argparser.add_argument('--streaming', action='store_true', help="Load annotation gene by gene, so that only a chunk of genes is kept in memory. "
+                                                                    "Records of each gene should go contiguously (as in GENCODE and Ensembl), "
+                                                                    "otherwise the whole annotation is loaded. Ignored when `--cache-dir` is specified")
+    argparser.add_argument('--temp-dir', help="Folder for temporary files in `--streaming` mode (default: system temporary folder)")
+    argparser.add_argument('--jobs', '-j', metavar='N', type=int, default=1, help="Number of worker processes to parse GTF (not used in `--streaming` mode). "
+                                                                                 "Only plain or block-gzipped GTF can be parsed in parallel (default: %(default)s)")
     return argparser
 
 def main():
-    argparser = configure_argparser(argparser)
+    argparser = add_threads_argument(configure_argparser())
     args = argparser.parse_args()
+    apply_threads_argument(args)
     invoke(args)
 
 def invoke(args):
-    condition_configs = [parse_condition(condition_str) for condition_str in args.filters]
-    filters = [create_record_filter(condition_config) for condition_config in condition_configs]
-    filter_conjuction = lambda rec: all(f(rec) for f in filters)
-    relevant_attributes = {k for (k,v) in condition_configs}
-
-    annotation = Annotation.load(
-        args.gtf_annotation,
-        relevant_attributes=relevant_attributes,
-        multivalue_keys=set(),
-        ignore_unknown_multivalues=True,
-        condition=filter_conjuction,
-    )
+    record_filter, line_prefilter, relevant_attributes = create_filters(args.filters)
+    multivalue_keys = DEFAULT_MULTIVALUE_KEYS if args.multivalue_keys is None else set(args.multivalue_keys)
+    load_options = {
+        'relevant_attributes': relevant_attributes,
+        'multivalue_keys': multivalue_keys,
+        'ignore_unknown_multivalues': True,
+        'condition': record_filter,
+        'line_filter': line_prefilter,
+        'feature_types': FEATURE_TYPES,
+    }
+
     with open_for_write(args.output_file) as output_stream:
         print(CodingTranscriptInfo.header(), file=output_stream)
-        for transcript_id in annotation.transcript_by_id:
-            cds_info = annotation.coding_transcript_info(transcript_id)
+        if args.streaming and (args.cache_dir is None):
+            try:
+                write_cds_infos_streaming(args.gtf_annotation, output_stream, temp_dir=args.temp_dir, **load_options)
+                return
+            except UngroupedAnnotationError as e:
+                print(f'{e}. Loading the whole annotation', file=sys.stderr)
+
+        annotation = Annotation.load(args.gtf_annotation, cache_dir=args.cache_dir, jobs=args.jobs, **load_options)
+        for cds_info in annotation.coding_transcript_infos():
             print(cds_info, file=output_stream)
+
+def write_cds_infos_streaming(filename, output_stream, temp_dir=None, **load_options):
+    '''
+    Writes CDS infos of annotation loaded chunk by chunk.
+    Results are spooled and written only when the whole annotation is processed,
+    so nothing is written if annotation turns out not to be grouped by genes.
+    '''
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode='w+', dir=temp_dir) as spool:
+        for annotation in Annotation.each_chunk_in_file(filename, **load_options):
+            for cds_info in annotation.coding_transcript_infos():
+                print(cds_info, file=spool)
+        spool.seek(0)
+        shutil.copyfileobj(spool, output_stream)
@@ -1,7 +1,15 @@
 import argparse
-from ..gzip_utils import open_for_write
+from ..gzip_utils import open_for_write, add_threads_argument, apply_threads_argument
 from ..annotation import Annotation
-from ..annotation_filter import parse_condition, create_record_filter
+from ..annotation_filter import create_filters, DEFAULT_MULTIVALUE_KEYS
+
+# Records necessary to extract sequence of each region type, other records are skipped
+FEATURE_TYPES_BY_REGION_TYPE = {
+    'cds': frozenset({'transcript', 'CDS'}),
+    'cds_with_stop': frozenset({'transcript', 'CDS', 'stop_codon'}),
+    'exons': frozenset({'transcript', 'exon'}),
+    'full': frozenset({'transcript'}),
+}
 
 def clip_sequence(sequence, drop_5_flank, drop_3_flank):
     return sequence[drop_5_flank : (len(sequence) - drop_3_flank)]
@@ -23,29 +31,39 @@ def configure_argparser(argparser=None):
     argparser.add_argument('--attr-filter', action='append', dest='filters', default=[], 
                                             help="Filter records so that attributes has one of specified values.\n"
                                                  "Format: `attribute=value_1,value_2,...`")
-    # Known issue: Right now all multivalue keys are ignored, so filters won't work with them
-    # ToDo: add ability to specify multivalue keys and add filters like `--filter-has tag value`
+    argparser.add_argument('--multivalue-key', action='append', dest='multivalue_keys', default=None,
+                                               help="Attribute which can occur several times in a record (e.g. `tag`). "
+                                                    "Filter by such attribute accepts a record if any of its values is acceptable. "
+                                                    f"Default: {', '.join(sorted(DEFAULT_MULTIVALUE_KEYS))}")
+    argparser.add_argument('--cache-dir', help="Folder to store a binary snapshot of parsed annotation. "
+                                               "Snapshot is not filtered, so subsequent runs on the same (unchanged) GTF file load it instead of parsing GTF "
+                                               "with any filters by gene/transcript types, tags and levels (filters by other attributes use their own snapshot)")
+    argparser.add_argument('--jobs', '-j', metavar='N', type=int, default=1, help="Number of worker processes to parse GTF. "
+                                                                                 "Only plain or block-gzipped GTF can be parsed in parallel (default: %(default)s)")
     return argparser
 
 def main():
-    argparser = configure_argparser()
+    argparser = add_threads_argument(configure_argparser())
     args = argparser.parse_args()
+    apply_threads_argument(args)
     invoke(args)
 
 def invoke(args):
-    condition_configs = [parse_condition(condition_str) for condition_str in args.filters]
-    filters = [create_record_filter(condition_config) for condition_config in condition_configs]
-    filter_conjuction = lambda rec: all(f(rec) for f in filters)
-    relevant_attributes = {k for (k,v) in condition_configs}
+    record_filter, line_prefilter, relevant_attributes = create_filters(args.filters)
+    multivalue_keys = DEFAULT_MULTIVALUE_KEYS if args.multivalue_keys is None else set(args.multivalue_keys)
 
     annotation = Annotation.load(
         args.gtf_annotation,
         relevant_attributes=relevant_attributes,
-        multivalue_keys=set(),
+        multivalue_keys=multivalue_keys,
         ignore_unknown_multivalues=True,
-        condition=filter_conjuction,
+        condition=record_filter,
+        line_filter=line_prefilter,
+        cache_dir=args.cache_dir,
+        jobs=args.jobs,
+        feature_types=FEATURE_TYPES_BY_REGION_TYPE[args.region_type],
     )
-    transcript_ids_list = annotation.transcript_by_id.keys()
+    transcript_ids_list = annotation.transcript_ids
 
     with open_for_write(args.output_file) as output_stream:
         for transcript_id, sequence in annotation.transcript_sequences(transcript_ids_list, args.assembly, feature_type=args.region_type):
@@ -1,6 +1,6 @@
 import argparse
 import itertools
-from ..gzip_utils import open_for_write
+from ..gzip_utils import open_for_write, add_threads_argument, apply_threads_argument
 from ..tsv_reader import stream_table_column_highlighted
 
 def configure_argparser(argparser=None):
@@ -22,8 +22,9 @@ def configure_argparser(argparser=None):
     return argparser
 
 def main():
-    argparser = configure_argparser()
+    argparser = add_threads_argument(configure_argparser())
     args = argparser.parse_args()
+    apply_threads_argument(args)
     invoke(args)
 
 def invoke(args):
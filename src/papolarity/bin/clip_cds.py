@@ -1,9 +1,18 @@
 import sys
 import argparse
-from ..gzip_utils import open_for_write
+import functools
+import itertools
+from ..gzip_utils import open_for_write, add_threads_argument, apply_threads_argument
+from ..coverage_store import CoverageStore, is_coverage_store
 from ..dto.interval import Interval
+from ..dto.transcript_coverage import TranscriptCoverage
 from ..dto.coding_transcript_info import CodingTranscriptInfo
 from ..clipping import Clipper
+from ..utils import each_batch
+from ..parallel import ordered_map
+
+# Number of transcripts processed by a worker at once
+CHUNK_SIZE = 256
 
 def configure_argparser(argparser=None):
     if not argparser:
@@ -12,7 +21,7 @@ def configure_argparser(argparser=None):
             description = "Clip any bed file in transcriptomic coordinates to CDS-region",
         )
     argparser.add_argument('cds_annotation', metavar='cds_annotation.tsv', help='CDS annotation') # 'gencode.vM22.cds_features.tsv'
-    argparser.add_argument('bedfile', metavar='bedfile.bed', help = 'Coverage or segmentation file in bed format (3 standard columns + any number of non-standard)')
+    argparser.add_argument('bedfile', metavar='bedfile.bed', help = 'Coverage or segmentation file in bed format (3 standard columns + any number of non-standard) or a coverage store')
 
     # start and stop codon can have piles of reads, so we usually want to drop them
     # flank lengths to drop are of 15nt ~= half-ribosome (~half of riboseq footprint length)
@@ -20,13 +29,26 @@ def configure_argparser(argparser=None):
     argparser.add_argument('--drop-3-flank', metavar='N', type=int, default=0, help="Clip N additional nucleotides from transcript end (3'-end)")
 
     argparser.add_argument('--output-file', '-o', dest='output_file', help="Store results at this path")
+    argparser.add_argument('--block-gzip', action='store_true', help="Write output in block-gzip format with an index of transcripts. It allows fast random access to a single transcript")
     argparser.add_argument('--allow-non-matching', action='store_true', help="Allow transcripts which are not present in CDS-annotation (they are not clipped)")
+    argparser.add_argument('--jobs', '-j', metavar='N', type=int, default=1, help="Number of worker processes (default: %(default)s)")
     argparser.add_argument('--contig-naming', dest='contig_naming_mode', choices=['original', 'window'], default='window', help="Use original (chr1) or modified (chr1:23-45) contig name for resulting intervals")
     return argparser
 
+def each_interval_in_file(filename):
+    if is_coverage_store(filename):
+        # values keep store dtype, so that they are formatted the same way as in a bedgraph written from the store
+        store = CoverageStore(filename)
+        for transcript_coverage in TranscriptCoverage.each_in_store(store, dtype=store.dtype, run_length=True):
+            for (start, stop, value) in zip(*(arr.tolist() for arr in transcript_coverage.coverage.merged_runs())):
+                yield Interval(transcript_coverage.transcript_id, start, stop, [value])
+    else:
+        yield from Interval.each_in_file(filename)
+
 def main():
-    argparser = configure_argparser()
+    argparser = add_threads_argument(configure_argparser())
     args = argparser.parse_args()
+    apply_threads_argument(args)
     invoke(args)
 
 def invoke(args):
@@ -34,10 +56,26 @@ def invoke(args):
         print('Attention! When `--allow-non-matching` is set, only `--contig-naming original` will give consistent contig names', file=sys.stderr)
 
     cds_info_by_transcript = CodingTranscriptInfo.load_transcript_cds_info(args.cds_annotation)
-    bed_stream = Interval.each_in_file(args.bedfile)
+    bed_stream = each_interval_in_file(args.bedfile)
     clipper = Clipper(contig_naming_mode=args.contig_naming_mode,
                       drop_5_flank=args.drop_5_flank,
                       drop_3_flank=args.drop_3_flank)
-    with open_for_write(args.output_file) as output_stream:
-        for interval in clipper.bedfile_clipped_to_cds(bed_stream, cds_info_by_transcript, allow_non_matching=args.allow_non_matching):
-            print(interval, file=output_stream)
+    with open_for_write(args.output_file, block_gzip=args.block_gzip) as output_stream:
+        if args.jobs == 1:
+            for interval in clipper.bedfile_clipped_to_cds(bed_stream, cds_info_by_transcript, allow_non_matching=args.allow_non_matching):
+                print(interval, file=output_stream)
+        else:
+            # chunks contain whole transcripts and only their CDS annotation
+            transcript_intervals = (list(intervals) for (_, intervals) in itertools.groupby(bed_stream, lambda interval: interval.chrom))
+            chunks = ((chunk, {intervals[0].chrom: cds_info_by_transcript[intervals[0].chrom] for intervals in chunk if intervals[0].chrom in cds_info_by_transcript})
+                      for chunk in each_batch(transcript_intervals, CHUNK_SIZE))
+            clip_chunk_fn = functools.partial(clip_chunk, clipper, allow_non_matching=args.allow_non_matching)
+            for text in ordered_map(clip_chunk_fn, chunks, jobs=args.jobs):
+                output_stream.write(text)
+
+def clip_chunk(clipper, chunk, allow_non_matching=False):
+    '''Clips a chunk `(list of transcript intervals, cds_info_by_transcript)`, returns formatted text'''
+    (transcript_intervals, cds_info_by_transcript) = chunk
+    bed_stream = itertools.chain.from_iterable(transcript_intervals)
+    clipped_intervals = clipper.bedfile_clipped_to_cds(bed_stream, cds_info_by_transcript, allow_non_matching=allow_non_matching)
+    return ''.join(f'{interval}\n' for interval in clipped_intervals)
@@ -1,9 +1,13 @@
+import os
 import argparse
-from ..utils import tsv_string_empty_none
-from ..gzip_utils import open_for_write
+import itertools
+import contextlib
+from ..utils import tsv_string_empty_none, sample_name_by_filename
+from ..gzip_utils import open_for_write, add_threads_argument, apply_threads_argument
 from ..dto.transcript_coverage import TranscriptCoverage
 from ..segmentation import Segmentation
-from ..profile_comparison import compare_coverage_streams
+from ..binning import Binning
+from ..profile_comparison import compare_multiple_coverage_streams
 
 def configure_argparser(argparser=None):
     if not argparser:
@@ -11,38 +15,102 @@ def configure_argparser(argparser=None):
             prog = "compare_coverage",
             description = "Coverage profile comparison",
         )
-    argparser.add_argument('segmentation', metavar='segmentation.bed', help='Segmentation')
-    argparser.add_argument('coverage_control', metavar='control.bedgraph', help='Coverage for control data')
-    argparser.add_argument('coverage_experiment', metavar='experiment.bedgraph', help='Coverage for experiment data')
+    argparser.add_argument('segmentation', metavar='segmentation.bed', help='Segmentation or a binning strategy computed on the fly from profiles pooled over all samples: '
+                                                                            '`fixed:N` (N bins of equal length), `equal-coverage:N` (N bins of equal coverage) '
+                                                                            'or `min-count:N` (bins with coverage at least N)')
+    argparser.add_argument('coverage_control', metavar='control.bedgraph', help='Coverage for control data (bedgraph or coverage store)')
+    argparser.add_argument('coverage_experiments', metavar='experiment.bedgraph', nargs='+', help='Coverage for experiment data (bedgraph or coverage store). Several experiments can be compared to the same control')
+    argparser.add_argument('--all-pairs', action='store_true', help='Compare all pairs of samples (control and experiments) instead of comparing each experiment to control. The first sample of a pair is used as a control')
     argparser.add_argument('--segment-coverage-quantile', nargs=2, metavar=('<quantile>', '<threshold>'), default=['0.5', '0'],
                            help='Filter transcripts with too low value of quantile over segments.\n'
                                 'E.g. `--segment-coverage-quantile  0.5  1.0` filters out all transcripts with median '
                                 'segment coverage less than 1.0')
-    argparser.add_argument('--prefix', default='', help='Prefix of feature columns (to distinguish samples)')
-    argparser.add_argument('--output-file', '-o', dest='output_file', help="Store results at this path")
+    argparser.add_argument('--prefix', nargs='+', help='Prefix of feature columns (to distinguish samples), one per comparison. '
+                                                       'Default: no prefix for a single experiment (unless `--output-dir` is specified), `<experiment>_` for several experiments and `<experiment>_vs_<control>_` in all-pairs mode '
+                                                       '(sample names are file names unless `--sample-names` are specified)')
+    argparser.add_argument('--sample-names', nargs='+', help='Names of samples (control and experiments) used in default prefixes and output file names')
+    argparser.add_argument('--output-file', '-o', dest='output_file', help="Store results (of all comparisons in a single table) at this path")
+    argparser.add_argument('--output-dir', help="Store results of each comparison in a separate file `<output-dir>/<prefix>.tsv` (prefix without trailing `_`)")
     argparser.add_argument('--check-sorted', choices=['no', 'case-sensitive', 'case-insensitive'], default='case-insensitive', help="Check if transcript intervals are properly ordered, i.e. contig names are sorted")
+    argparser.add_argument('--unsorted', action='store_true', help="Inputs can be ordered arbitrarily (not necessarily sorted by transcript). Bedgraph and segmentation files are spilled into temporary files, coverage stores and indexed block-gzipped files are accessed randomly")
+    argparser.add_argument('--jobs', '-j', metavar='N', type=int, default=1, help="Number of worker processes (default: %(default)s)")
+    argparser.add_argument('--temp-dir', help="Folder for temporary files in `--unsorted` mode (default: system temporary folder)")
     return argparser
 
 def main():
-    argparser = configure_argparser()
+    argparser = add_threads_argument(configure_argparser())
     args = argparser.parse_args()
+    apply_threads_argument(args)
     invoke(args)
 
 def invoke(args):
     check_sorted = args.check_sorted
-    segmentation_stream = Segmentation.each_in_file(args.segmentation, header=False)
+    coverage_filenames = [args.coverage_control, *args.coverage_experiments]
+    if args.sample_names is None:
+        sample_names = [sample_name_by_filename(filename) for filename in coverage_filenames]
+    elif len(args.sample_names) == len(coverage_filenames):
+        sample_names = args.sample_names
+    else:
+        raise ValueError(f'Number of sample names ({len(args.sample_names)}) should match number of coverage files ({len(coverage_filenames)})')
 
-    control_coverage_profiles = TranscriptCoverage.each_in_file(args.coverage_control, header=False, dtype=int)
-    experiment_coverage_profiles = TranscriptCoverage.each_in_file(args.coverage_experiment, header=False, dtype=int)
+    if args.all_pairs:
+        pairs = list(itertools.combinations(range(len(coverage_filenames)), 2))
+        default_prefixes = [f'{sample_names[experiment_idx]}_vs_{sample_names[control_idx]}_' for (control_idx, experiment_idx) in pairs]
+    else:
+        pairs = [(0, experiment_idx) for experiment_idx in range(1, len(coverage_filenames))]
+        if (len(pairs) == 1) and not args.output_dir:
+            default_prefixes = ['']
+        else:
+            default_prefixes = [f'{sample_names[experiment_idx]}_' for (_, experiment_idx) in pairs]
+
+    if args.prefix is None:
+        prefixes = default_prefixes
+    elif len(args.prefix) == len(pairs):
+        prefixes = args.prefix
+    else:
+        raise ValueError(f'Number of prefixes ({len(args.prefix)}) should match number of comparisons ({len(pairs)})')
+
+    if Binning.is_binning_spec(args.segmentation):
+        binning = Binning.from_string(args.segmentation)
+        segmentation_stream = None
+    else:
+        binning = None
+        segmentation_stream = Segmentation.each_in_file(args.segmentation, header=False)
+
+    if args.unsorted:
+        coverage_profile_streams = [TranscriptCoverage.join_source(filename, header=False, dtype=int, run_length=True) for filename in coverage_filenames]
+    else:
+        coverage_profile_streams = [TranscriptCoverage.each_in_file(filename, header=False, dtype=int, run_length=True) for filename in coverage_filenames]
 
     quantile_q, quantile_threshold = [float(x) for x in args.segment_coverage_quantile]
 
-    with open_for_write(args.output_file) as output_stream:
-        feature_names = ['slope', 'slopelog', 'l1_distance', 'polarity_diff']
-        prefixed_feature_names = [f'{args.prefix}{name}' for name in feature_names]
-        header = ['transcript_id', *prefixed_feature_names]
-        print('\t'.join(header), file=output_stream)
-        for rec in compare_coverage_streams(segmentation_stream, control_coverage_profiles, experiment_coverage_profiles, check_sorted=check_sorted,
-                                            quantile_q=quantile_q, quantile_threshold=quantile_threshold):
-            info = [rec[field] for field in ['transcript_id', *feature_names]]
-            print(tsv_string_empty_none(info), file=output_stream)
+    feature_names = ['slope', 'slopelog', 'l1_distance', 'polarity_diff']
+    with contextlib.ExitStack() as stack:
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            if len(set(prefixes)) < len(prefixes) or '' in prefixes:
+                raise ValueError('Prefixes should be distinct and non-empty to name output files')
+            output_streams = [stack.enter_context(open_for_write(os.path.join(args.output_dir, f'{prefix.rstrip("_")}.tsv'))) for prefix in prefixes]
+            for (prefix, output_stream) in zip(prefixes, output_streams):
+                header = ['transcript_id', *[f'{prefix}{name}' for name in feature_names]]
+                print('\t'.join(header), file=output_stream)
+        else:
+            output_stream = stack.enter_context(open_for_write(args.output_file))
+            header = ['transcript_id']
+            for prefix in prefixes:
+                header.extend(f'{prefix}{name}' for name in feature_names)
+            print('\t'.join(header), file=output_stream)
+
+        comparisons = compare_multiple_coverage_streams(segmentation_stream, coverage_profile_streams, pairs,
+                                                        check_sorted=check_sorted, unsorted=args.unsorted, temp_dir=args.temp_dir, jobs=args.jobs, binning=binning,
+                                                        quantile_q=quantile_q, quantile_threshold=quantile_threshold)
+        for (transcript_id, infos) in comparisons:
+            if args.output_dir:
+                for (rec, output_stream) in zip(infos, output_streams):
+                    info = [rec[field] for field in ['transcript_id', *feature_names]]
+                    print(tsv_string_empty_none(info), file=output_stream)
+            else:
+                info = [transcript_id]
+                for rec in infos:
+                    info.extend(rec[field] for field in feature_names)
+                print(tsv_string_empty_none(info), file=output_stream)
@@ -0,0 +1,43 @@
+import argparse
+from ..gzip_utils import open_for_write, add_threads_argument, apply_threads_argument
+from ..coverage_store import CoverageStore
+from ..bedgraph_writer import BedgraphWriter
+from ..dto.transcript_coverage import TranscriptCoverage
+
+def configure_argparser(argparser=None):
+    if not argparser:
+        argparser = argparse.ArgumentParser(
+            prog = "convert_coverage",
+            description = "Convert coverage between bedgraph format and binary coverage store",
+        )
+    argparser.add_argument('coverage', help='Coverage in bedgraph format or a coverage store')
+    argparser.add_argument('--output-file', '-o', dest='output_file', required=True, help="Store results at this path (coverage store is a folder)")
+    argparser.add_argument('--output-format', choices=['store', 'bedgraph'], default='store', help="Format of resulting coverage (default: %(default)s)")
+    argparser.add_argument('--block-gzip', action='store_true', help="Write output in block-gzip format with an index of transcripts. It allows fast random access to a single transcript (only for bedgraph output)")
+    argparser.add_argument('--dtype', choices=['int', 'float'], default='int', help="Make int or float-valued coverage (default: %(default)s)")
+    return argparser
+
+def main():
+    argparser = add_threads_argument(configure_argparser())
+    args = argparser.parse_args()
+    apply_threads_argument(args)
+    invoke(args)
+
+def invoke(args):
+    if args.dtype == 'int':
+        dtype = int
+    elif args.dtype == 'float':
+        dtype = float
+    else:
+        raise ValueError('dtype should be either int or float')
+
+    if args.output_format == 'store':
+        transcript_coverage_stream = TranscriptCoverage.each_in_file(args.coverage, header=False, dtype=dtype)
+        profiles = ((transcript_coverage.transcript_id, transcript_coverage.coverage) for transcript_coverage in transcript_coverage_stream)
+        CoverageStore.create(args.output_file, profiles, dtype=dtype)
+    elif args.output_format == 'bedgraph':
+        transcript_coverage_stream = TranscriptCoverage.each_in_file(args.coverage, header=False, dtype=dtype, run_length=True)
+        with open_for_write(args.output_file, block_gzip=args.block_gzip) as output_stream, BedgraphWriter(output_stream, dtype=dtype) as bedgraph_writer:
+            bedgraph_writer.write_transcript_coverages(transcript_coverage_stream)
+    else:
+        raise ValueError(f'Unknown output format `{args.output_format}`')
@@ -1,44 +1,96 @@
 import argparse
-import numpy as np
-from ..gzip_utils import open_for_write
-from ..utils import tsv_string_empty_none
+from ..gzip_utils import open_for_write, add_threads_argument, apply_threads_argument
+from ..utils import tsv_string_empty_none, each_batch, sample_name_by_filename
 from ..dto.transcript_coverage import TranscriptCoverage
-from ..polarity_score import polarity_score
+from ..profile_features import RunLengthBatch
+from ..profile_comparison import align_profile_streams
+from ..parallel import ordered_map
+
+# Number of transcripts which features are computed at once
+BATCH_SIZE = 4096
+
+FEATURE_NAMES = ['mean_coverage', 'coverage_q25', 'coverage_q50', 'coverage_q75', 'total_coverage', 'polarity']
 
 def configure_argparser(argparser=None):
     if not argparser:
         argparser = argparse.ArgumentParser(prog="coverage_features", description="Calculate coverage profile features")
-    argparser.add_argument('coverage', metavar='coverage.bedgraph', help='Coverage data')
-    argparser.add_argument('--prefix', default='', help='Prefix of feature columns (to distinguish samples)')
+    argparser.add_argument('coverage', metavar='coverage.bedgraph', nargs='+', help='Coverage data (bedgraph or coverage store). Several samples can be specified, their features are written into a single table')
+    argparser.add_argument('--prefix', nargs='+', help='Prefix of feature columns (to distinguish samples), one per sample. Default: no prefix for a single sample, file name with `_` for several samples')
     argparser.add_argument('--output-file', '-o', dest='output_file', help="Store results at this path")
+    argparser.add_argument('--jobs', '-j', metavar='N', type=int, default=1, help="Number of worker processes which compute features for batches of transcripts (default: %(default)s)")
+    argparser.add_argument('--check-sorted', choices=['no', 'case-sensitive', 'case-insensitive'], default='case-insensitive', help="Check if transcripts of several samples are properly ordered, i.e. transcript names are sorted")
     return argparser
 
 def main():
-    argparser = configure_argparser()
+    argparser = add_threads_argument(configure_argparser())
     args = argparser.parse_args()
+    apply_threads_argument(args)
     invoke(args)
 
 def invoke(args):
-    coverage_profiles = TranscriptCoverage.each_in_file(args.coverage, header=False, dtype=int)
+    if args.prefix is None:
+        prefixes = [''] if len(args.coverage) == 1 else [f'{sample_name_by_filename(filename)}_' for filename in args.coverage]
+    elif len(args.prefix) == len(args.coverage):
+        prefixes = args.prefix
+    else:
+        raise ValueError(f'Number of prefixes ({len(args.prefix)}) should match number of coverage files ({len(args.coverage)})')
+
     with open_for_write(args.output_file) as output_stream:
         # Note: 'q50' etc goes as the last part of name because csvtk-0.19.1
         # filter2 function had some problems with column names containing digits in the middle of the name.
         # The problem was resolved in 0.19.2 version.
         # (see https://github.com/shenwei356/csvtk/issues/44 for details)
-        feature_names = ['mean_coverage', 'coverage_q25', 'coverage_q50', 'coverage_q75', 'total_coverage', 'polarity']
-        prefixed_feature_names = [f'{args.prefix}{name}' for name in feature_names]
-        header = ['transcript_id', *prefixed_feature_names]
+        header = ['transcript_id']
+        for prefix in prefixes:
+            header.extend(f'{prefix}{name}' for name in FEATURE_NAMES)
         print('\t'.join(header), file=output_stream)
-        for transcript_coverage in coverage_profiles:
-            coverage = transcript_coverage.coverage
-
-            transcript_id = transcript_coverage.transcript_id
-            mean_coverage = np.mean(coverage)
-            coverage_q25 = np.quantile(coverage, 0.25)
-            coverage_q50 = np.quantile(coverage, 0.5)
-            coverage_q75 = np.quantile(coverage, 0.75)
-            total_coverage = np.sum(coverage)
-            polarity = polarity_score(coverage)
-
-            info = [transcript_id, mean_coverage, coverage_q25, coverage_q50, coverage_q75, total_coverage, polarity]
-            print(tsv_string_empty_none(info), file=output_stream)
+        if len(args.coverage) == 1:
+            for info in each_feature_row(args.coverage[0], jobs=args.jobs):
+                print(tsv_string_empty_none(info), file=output_stream)
+        else:
+            for info in each_aligned_feature_row(args.coverage, check_sorted=args.check_sorted, jobs=args.jobs):
+                print(tsv_string_empty_none(info), file=output_stream)
+
+def each_feature_row(coverage_filename, jobs=1):
+    coverage_profiles = TranscriptCoverage.each_in_file(coverage_filename, header=False, dtype=int, run_length=True)
+    # features are computed for batches of transcripts at once
+    for rows in ordered_map(batch_features, each_batch(coverage_profiles, BATCH_SIZE), jobs=jobs):
+        yield from rows
+
+def each_aligned_feature_row(coverage_filenames, check_sorted=False, jobs=1):
+    '''Feature rows `[transcript_id, *sample_1_features, *sample_2_features, ...]` for transcripts present in all samples'''
+    coverage_profile_streams = [TranscriptCoverage.each_in_file(filename, header=False, dtype=int, run_length=True) for filename in coverage_filenames]
+    aligned_stream = align_profile_streams(coverage_profile_streams, check_sorted=check_sorted)
+    for rows in ordered_map(aligned_batch_features, each_batch(aligned_stream, BATCH_SIZE), jobs=jobs):
+        yield from rows
+
+def aligned_batch_features(aligned_profiles):
+    '''Joined feature rows for a batch of `(transcript_id, profiles)` tuples (profiles of the same transcript in each sample)'''
+    rows = [[transcript_id] for (transcript_id, _) in aligned_profiles]
+    for sample_coverages in zip(*[coverages for (_, coverages) in aligned_profiles]):
+        for (row, sample_row) in zip(rows, batch_features(sample_coverages)):
+            row.extend(sample_row[1:])
+    return rows
+
+def batch_features(transcript_coverages):
+    '''Feature rows `[transcript_id, *features]` for a batch of run-length encoded profiles'''
+    batch = RunLengthBatch.from_profiles([transcript_coverage.coverage for transcript_coverage in transcript_coverages])
+    is_empty = (batch.profile_lengths == 0).tolist()
+    total_coverages = batch.sums()
+    has_coverage = (total_coverages != 0).tolist()
+    features = zip(
+        batch.means().tolist(),
+        batch.quantiles(0.25).tolist(),
+        batch.quantiles(0.5).tolist(),
+        batch.quantiles(0.75).tolist(),
+        total_coverages.tolist(),
+        batch.polarity_scores().tolist(),
+    )
+    rows = []
+    for (transcript_coverage, empty, covered, (mean_coverage, coverage_q25, coverage_q50, coverage_q75, total_coverage, polarity)) in zip(transcript_coverages, is_empty, has_coverage, features):
+        if empty:
+            mean_coverage, coverage_q25, coverage_q50, coverage_q75 = None, None, None, None
+        if not covered:
+            polarity = None
+        rows.append([transcript_coverage.transcript_id, mean_coverage, coverage_q25, coverage_q50, coverage_q75, total_coverage, polarity])
+    return rows
@@ -1,11 +1,16 @@
 import argparse
 import math
-from ..utils import align_iterators, get_constant_intervals
-from ..gzip_utils import open_for_write
-from ..dto.coverage_interval import CoverageInterval
+from ..utils import align_iterators, dense_aligned_objects, each_batch
+from ..parallel import ordered_map
+from ..unsorted_join import align_unsorted
+from ..gzip_utils import open_for_write, add_threads_argument, apply_threads_argument
+from ..bedgraph_writer import BedgraphWriter
 from ..dto.transcript_coverage import TranscriptCoverage
 from ..segmentation import Segmentation
 
+# Number of transcripts processed by a worker at once
+CHUNK_SIZE = 256
+
 def configure_argparser(argparser=None):
     if not argparser:
         argparser = argparse.ArgumentParser(
@@ -13,16 +18,21 @@ def configure_argparser(argparser=None):
             description = "Flatten coverage profiles by averaging data through given segments",
         )
     argparser.add_argument('segmentation', help='Segmentation of contigs in bed format')
-    argparser.add_argument('coverage', help='Coverage in bedgraph format')
+    argparser.add_argument('coverage', help='Coverage in bedgraph format or a coverage store')
     argparser.add_argument('--only-matching', action='store_true', help="Don't pool coverage profiles of transcripts which are present not in all files")
     argparser.add_argument('--output-file', '-o', dest='output_file', help="Store results at this path")
+    argparser.add_argument('--block-gzip', action='store_true', help="Write output in block-gzip format with an index of transcripts. It allows fast random access to a single transcript")
     argparser.add_argument('--rounding', choices=['no', 'round', 'ceil', 'floor'], default='none', help="Rounding of float values (default: no rounding)")
     argparser.add_argument('--check-sorted', choices=['no', 'case-sensitive', 'case-insensitive'], default='case-insensitive', help="Check if transcript intervals are properly ordered, i.e. contig names are sorted")
+    argparser.add_argument('--unsorted', action='store_true', help="Inputs can be ordered arbitrarily (not necessarily sorted by transcript). Bedgraph and segmentation files are spilled into temporary files, coverage stores and indexed block-gzipped files are accessed randomly")
+    argparser.add_argument('--jobs', '-j', metavar='N', type=int, default=1, help="Number of worker processes (default: %(default)s)")
+    argparser.add_argument('--temp-dir', help="Folder for temporary files in `--unsorted` mode (default: system temporary folder)")
     return argparser
 
 def main():
-    argparser = configure_argparser(argparser)
+    argparser = add_threads_argument(configure_argparser())
     args = argparser.parse_args()
+    apply_threads_argument(args)
     invoke(args)
 
 def invoke(args):
@@ -39,19 +49,39 @@ def invoke(args):
     else:
         raise ValueError('rounding should be either int or float')
 
-    transcript_coverage_stream = TranscriptCoverage.each_in_file(args.coverage, header=False, dtype=float)
+    if args.unsorted:
+        transcript_coverage_stream = TranscriptCoverage.join_source(args.coverage, header=False, dtype=float, run_length=True)
+    else:
+        transcript_coverage_stream = TranscriptCoverage.each_in_file(args.coverage, header=False, dtype=float, run_length=True)
 
     segmentation_stream = Segmentation.each_in_file(args.segmentation, header=False)
 
-    with open_for_write(args.output_file) as output_stream:
-        aligned_transcripts = align_iterators([segmentation_stream, transcript_coverage_stream], key=[lambda segment: segment.chrom, lambda transcript_coverage: transcript_coverage.transcript_id], check_sorted=check_sorted)
-        for (transcript_id, (segmentation, transcript_coverage)) in aligned_transcripts:
-            if transcript_coverage is None:
-                continue
-            if (segmentation is None) and args.only_matching:
-                continue
-            if segmentation is not None:
-                transcript_coverage = segmentation.stabilize_profile(transcript_coverage.coverage)
-            coverage_intervals = get_constant_intervals(transcript_coverage)
-            bedgraph = (CoverageInterval(transcript_id, *interval, dtype=float) for interval in coverage_intervals)
-            CoverageInterval.print_tsv(bedgraph, header=False, file=output_stream)
+    with open_for_write(args.output_file, block_gzip=args.block_gzip) as output_stream, BedgraphWriter(output_stream, dtype=float) as bedgraph_writer:
+        streams = [segmentation_stream, transcript_coverage_stream]
+        keys = [lambda segment: segment.chrom, lambda transcript_coverage: transcript_coverage.transcript_id]
+        if args.unsorted:
+            aligned_transcripts = align_unsorted(streams, key=keys, temp_dir=args.temp_dir)
+            aligned_transcripts = ((transcript_id, dense_aligned_objects(matching_objects, len(streams))) for (transcript_id, matching_objects) in aligned_transcripts)
+        else:
+            aligned_transcripts = align_iterators(streams, key=keys, check_sorted=check_sorted)
+        aligned_transcripts = ((transcript_id, segmentation, transcript_coverage.coverage)
+                               for (transcript_id, (segmentation, transcript_coverage)) in aligned_transcripts
+                               if (transcript_coverage is not None) and not ((segmentation is None) and args.only_matching))
+        # run-length encoded profiles are sent to workers, so that chunks are compact;
+        # profiles are flattened segment-wise, dense profiles are never allocated
+        for flattened_chunk in ordered_map(flatten_chunk, each_batch(aligned_transcripts, CHUNK_SIZE), jobs=args.jobs):
+            for (transcript_id, starts, stops, values) in flattened_chunk:
+                bedgraph_writer.write_intervals(transcript_id, starts, stops, values)
+
+def flatten_chunk(chunk):
+    '''
+    Takes a list of tuples `(transcript_id, segmentation, profile)`, returns a list of
+    `(transcript_id, starts, stops, values)` with constant intervals of flattened profiles
+    '''
+    result = []
+    for (transcript_id, segmentation, profile) in chunk:
+        if segmentation is not None:
+            profile = segmentation.stabilize_profile(profile)
+        # adjacent segments with equal means are merged
+        result.append((transcript_id, *profile.merged_runs()))
+    return result
@@ -1,7 +1,10 @@
 import argparse
-from pybedtools import BedTool
-from ..coverage_profile import make_coverage, coverage_intervals_from_bedgraph
-from ..dto.coverage_interval import CoverageInterval
+from ..gzip_utils import open_for_write, add_threads_argument, apply_threads_argument
+from ..coverage_store import CoverageStore
+from ..coverage_profile import alignment_coverage, start_codon_read_ends, PsiteCoverage
+from ..psite_offsets import load_psite_offsets, infer_psite_offsets, store_read_length_histogram
+from ..bedgraph_writer import BedgraphWriter
+from ..dto.coding_transcript_info import CodingTranscriptInfo
 
 def configure_argparser(argparser=None):
     if not argparser:
@@ -9,12 +12,28 @@ def configure_argparser(argparser=None):
     argparser.add_argument('alignment', help='alignment in BAM format')
     argparser.add_argument('--sort', choices=['no', 'case-sensitive', 'case-insensitive'], default='case-insensitive', help="Sort resulting alignments by transcript name (default: case-insensitive sorting)")
     argparser.add_argument('--output-file', '-o', dest='output_file', help="Store results at this path")
+    argparser.add_argument('--block-gzip', action='store_true', help="Write output in block-gzip format with an index of transcripts. It allows fast random access to a single transcript")
+    argparser.add_argument('--output-format', choices=['bedgraph', 'store'], default='bedgraph', help="Write coverage in bedgraph format or into a coverage store (default: %(default)s)")
     argparser.add_argument('--dtype', choices=['int', 'float'], default='int', help="Make int or float-valued coverage (default: int)")
+
+    # Ribo-seq specific options
+    psite_group = argparser.add_mutually_exclusive_group()
+    psite_group.add_argument('--psite-offsets', metavar='offsets.tsv',
+                             help="Count each read once at its P-site instead of its whole span.\n"
+                                  "Table with `read_length` and `offset` columns specifies distance from read 5'-end to P-site. "
+                                  "Reads of other lengths are skipped")
+    psite_group.add_argument('--infer-psite-offsets', metavar='cds_annotation.tsv', dest='cds_annotation',
+                             help="Count each read once at its P-site. Offsets are inferred from reads around annotated start codons "
+                                  "(CDS annotation is generated by `papolarity cds_annotation`). Alignment is read twice then")
+    argparser.add_argument('--max-psite-offset', metavar='N', type=int, default=25, help="Max offset to consider during P-site offsets inference (default: %(default)s)")
+    argparser.add_argument('--min-reads-for-offset', metavar='N', type=int, default=10, help="Min number of reads near start codons to infer an offset for a read length (default: %(default)s)")
+    argparser.add_argument('--read-lengths-output', metavar='FILE', help="Store read length histogram (and P-site offsets) at this path. Works only with P-site offsets")
     return argparser
 
 def main():
-    argparser = configure_argparser(argparser)
+    argparser = add_threads_argument(configure_argparser())
     args = argparser.parse_args()
+    apply_threads_argument(args)
     invoke(args)
 
 def invoke(args):
@@ -25,11 +44,31 @@ def invoke(args):
     else:
         raise ValueError('dtype should be either int or float')
 
-    alignment = BedTool(args.alignment)
-    bedgraph = make_coverage(alignment, sort_transcripts=args.sort, stream=True, dtype=dtype)
+    if args.psite_offsets or args.cds_annotation:
+        if args.psite_offsets:
+            psite_offsets = load_psite_offsets(args.psite_offsets)
+        else:
+            # offsets are inferred in a separate pass over alignment which keeps only reads near start codons
+            cds_info_by_transcript = CodingTranscriptInfo.load_transcript_cds_info(args.cds_annotation)
+            start_codon_reads = start_codon_read_ends(args.alignment, cds_info_by_transcript, max_offset=args.max_psite_offset)
+            psite_offsets = infer_psite_offsets(start_codon_reads, cds_info_by_transcript,
+                                                max_offset=args.max_psite_offset, min_reads=args.min_reads_for_offset)
+        psite_coverage = PsiteCoverage(args.alignment, psite_offsets)
+        if args.read_lengths_output:
+            store_read_length_histogram(args.read_lengths_output, psite_coverage.read_length_counts, psite_offsets=psite_offsets)
+        transcript_coverage_stream = psite_coverage.transcript_coverages(sort_transcripts=args.sort, dtype=dtype)
+    else:
+        if args.read_lengths_output:
+            raise ValueError('Read length histogram can be generated only when P-site offsets are specified or inferred')
+        transcript_coverage_stream = alignment_coverage(args.alignment, sort_transcripts=args.sort, dtype=dtype)
 
-    if args.output_file:
-        bedgraph.saveas(args.output_file)
+    if args.output_format == 'store':
+        if not args.output_file:
+            raise ValueError('Coverage store can be written only into a folder specified by `--output-file`')
+        profiles = ((transcript_coverage.transcript_id, transcript_coverage.coverage) for transcript_coverage in transcript_coverage_stream)
+        CoverageStore.create(args.output_file, profiles, dtype=dtype)
+    elif args.output_format == 'bedgraph':
+        with open_for_write(args.output_file, block_gzip=args.block_gzip) as output_stream, BedgraphWriter(output_stream, dtype=dtype) as bedgraph_writer:
+            bedgraph_writer.write_transcript_coverages(transcript_coverage_stream)
     else:
-        intervals = coverage_intervals_from_bedgraph(bedgraph, dtype=dtype)
-        CoverageInterval.print_tsv(intervals, header=False)
+        raise ValueError(f'Unknown output format `{args.output_format}`')
@@ -3,6 +3,7 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 from ..tsv_reader import each_in_tsv
 from ..utils import drop_none
+from ..gzip_utils import add_threads_argument, apply_threads_argument
 
 def configure_argparser(argparser=None):
     if not argparser:
@@ -24,8 +25,9 @@ def configure_argparser(argparser=None):
     return argparser
 
 def main():
-    argparser = configure_argparser()
+    argparser = add_threads_argument(configure_argparser())
     args = argparser.parse_args()
+    apply_threads_argument(args)
     invoke(args)
 
 def invoke(args):
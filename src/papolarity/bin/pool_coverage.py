@@ -1,24 +1,29 @@
 import argparse
-import numpy as np
-from ..utils import align_iterators, get_constant_intervals
-from ..dto.coverage_interval import CoverageInterval
+from ..utils import align_iterators_sparse
+from ..unsorted_join import align_unsorted
+from ..run_length_profile import RunLengthProfile
+from ..bedgraph_writer import BedgraphWriter
 from ..dto.transcript_coverage import TranscriptCoverage
-from ..gzip_utils import open_for_write
+from ..gzip_utils import open_for_write, add_threads_argument, apply_threads_argument
 
 def configure_argparser(argparser=None):
     if not argparser:
         argparser = argparse.ArgumentParser(prog="pool_coverage", description="Pool coverage profiles")
-    argparser.add_argument('coverage_profiles', nargs='*', help='Coverage profiles in bedgraph format')
+    argparser.add_argument('coverage_profiles', nargs='*', help='Coverage profiles in bedgraph format or coverage stores')
     argparser.add_argument('--only-matching', action='store_true', help="Don't pool coverage profiles of transcripts which are present not in all files")
     argparser.add_argument('--output-file', '-o', dest='output_file', help="Store results at this path")
+    argparser.add_argument('--block-gzip', action='store_true', help="Write output in block-gzip format with an index of transcripts. It allows fast random access to a single transcript")
     argparser.add_argument('--output-mode', choices=['sum', 'mean'], default='sum', help="What to report")
     argparser.add_argument('--dtype', choices=['int', 'float'], default='int', help="Make int or float-valued coverage (default: %(default)s)")
     argparser.add_argument('--check-sorted', choices=['no', 'case-sensitive', 'case-insensitive'], default='case-insensitive', help="Check if transcript intervals are properly ordered, i.e. contig names are sorted")
+    argparser.add_argument('--unsorted', action='store_true', help="Inputs can be ordered arbitrarily (not necessarily sorted by transcript). Bedgraph files are spilled into temporary files, coverage stores and indexed block-gzipped files are accessed randomly")
+    argparser.add_argument('--temp-dir', help="Folder for temporary files in `--unsorted` mode (default: system temporary folder)")
     return argparser
 
 def main():
-    argparser = configure_argparser(argparser)
+    argparser = add_threads_argument(configure_argparser())
     args = argparser.parse_args()
+    apply_threads_argument(args)
     invoke(args)
 
 def invoke(args):
@@ -31,21 +36,20 @@ def invoke(args):
     else:
         raise ValueError('dtype should be either int or float')
 
-    coverage_streams = [TranscriptCoverage.each_in_file(coverage_fn, header=False, dtype=dtype) for coverage_fn in args.coverage_profiles]
+    if args.unsorted:
+        coverage_streams = [TranscriptCoverage.join_source(coverage_fn, header=False, dtype=dtype, run_length=True) for coverage_fn in args.coverage_profiles]
+    else:
+        coverage_streams = [TranscriptCoverage.each_in_file(coverage_fn, header=False, dtype=dtype, run_length=True) for coverage_fn in args.coverage_profiles]
 
-    with open_for_write(args.output_file) as output_stream:
-        aligned_transcripts = align_iterators(coverage_streams, key=lambda transcript_coverage: transcript_coverage.transcript_id, check_sorted=check_sorted)
+    with open_for_write(args.output_file, block_gzip=args.block_gzip) as output_stream, BedgraphWriter(output_stream, dtype=dtype) as bedgraph_writer:
+        key = lambda transcript_coverage: transcript_coverage.transcript_id
+        if args.unsorted:
+            aligned_transcripts = align_unsorted(coverage_streams, key=key, temp_dir=args.temp_dir)
+        else:
+            aligned_transcripts = align_iterators_sparse(coverage_streams, key=key, check_sorted=check_sorted)
         for (transcript_id, transcript_coverage_profiles) in aligned_transcripts:
-            if args.only_matching and not all(transcript_coverage_profiles):
+            if args.only_matching and (len(transcript_coverage_profiles) < len(coverage_streams)):
                 continue
-            transcript_coverage_profiles = filter(lambda x: x, transcript_coverage_profiles)
-            coverage_values = [transcript_coverage.coverage for transcript_coverage in transcript_coverage_profiles]
-            if args.output_mode == 'sum':
-                pooled_coverage_profile = np.sum(coverage_values, axis=0)
-            elif args.output_mode == 'mean':
-                pooled_coverage_profile = np.mean(coverage_values, axis=0)
-            else:
-                raise ValueError(f'Unknown output_mode `{args.output_mode}`')
-            pooled_coverage_intervals = get_constant_intervals(pooled_coverage_profile)
-            pooled_bedgraph = (CoverageInterval(transcript_id, *interval, dtype=dtype) for interval in pooled_coverage_intervals)
-            CoverageInterval.print_tsv(pooled_bedgraph, header=False, file=output_stream)
+            coverage_values = [transcript_coverage.coverage for (_, transcript_coverage) in transcript_coverage_profiles]
+            pooled_coverage_profile = RunLengthProfile.pooled(coverage_values, mode=args.output_mode)
+            bedgraph_writer.write_profile(transcript_id, pooled_coverage_profile)
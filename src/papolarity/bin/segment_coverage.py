@@ -0,0 +1,47 @@
+import argparse
+import functools
+from ..utils import each_batch
+from ..parallel import ordered_map
+from ..gzip_utils import open_for_write, add_threads_argument, apply_threads_argument
+from ..dto.transcript_coverage import TranscriptCoverage
+from ..poisson_segmentation import PoissonSegmenter
+
+# Number of transcripts processed by a worker at once
+CHUNK_SIZE = 256
+
+def configure_argparser(argparser=None):
+    if not argparser:
+        argparser = argparse.ArgumentParser(
+            prog = "segment_coverage",
+            description = "Segment coverage profiles into regions of constant Poisson rate (Gamma prior on rate)",
+        )
+    argparser.add_argument('coverage', help='Coverage in bedgraph format or a coverage store (e.g. pooled coverage of all samples)')
+    argparser.add_argument('--alpha', type=float, default=1.0, help="Shape parameter of Gamma prior on coverage rate (default: %(default)s)")
+    argparser.add_argument('--beta', type=float, default=1.0, help="Rate parameter of Gamma prior on coverage rate (default: %(default)s)")
+    argparser.add_argument('--output-file', '-o', dest='output_file', help="Store results at this path")
+    argparser.add_argument('--block-gzip', action='store_true', help="Write output in block-gzip format with an index of transcripts. It allows fast random access to a single transcript")
+    argparser.add_argument('--jobs', '-j', metavar='N', type=int, default=1, help="Number of worker processes (default: %(default)s)")
+    return argparser
+
+def main():
+    argparser = add_threads_argument(configure_argparser())
+    args = argparser.parse_args()
+    apply_threads_argument(args)
+    invoke(args)
+
+def invoke(args):
+    segmenter = PoissonSegmenter(alpha=args.alpha, beta=args.beta)
+    transcript_coverages = TranscriptCoverage.each_in_file(args.coverage, header=False, dtype=float, run_length=True)
+    segment_chunk_fn = functools.partial(segment_chunk, segmenter)
+    with open_for_write(args.output_file, block_gzip=args.block_gzip) as output_stream:
+        for text in ordered_map(segment_chunk_fn, each_batch(transcript_coverages, CHUNK_SIZE), jobs=args.jobs):
+            output_stream.write(text)
+
+def segment_chunk(segmenter, transcript_coverages):
+    '''Segments a chunk of transcript coverages, returns segments formatted as bed lines'''
+    lines = []
+    for transcript_coverage in transcript_coverages:
+        transcript_id = transcript_coverage.transcript_id
+        boundaries = segmenter.boundaries(transcript_coverage.coverage).tolist()
+        lines.extend(f'{transcript_id}\t{start}\t{stop}\n' for (start, stop) in zip(boundaries[:-1], boundaries[1:]))
+    return ''.join(lines)
@@ -0,0 +1,92 @@
+import os
+import re
+import math
+import bisect
+import numpy as np
+from .run_length_profile import RunLengthProfile
+from .segmentation import Segmentation
+
+BINNING_MODES = ['fixed', 'equal-coverage', 'min-count']
+
+class Binning:
+    '''
+    On-the-fly segmentation of transcripts into bins, a fast alternative to a precomputed segmentation.
+    Modes:
+      `fixed:N` - N bins of (almost) equal length;
+      `equal-coverage:N` - N bins with (almost) equal coverage of pooled profile;
+      `min-count:N` - consecutive bins with pooled coverage at least N each (the last bin is merged into previous one if it's not enough covered).
+    Bins are computed from a profile pooled over all compared samples.
+    '''
+    def __init__(self, mode, value):
+        if mode not in BINNING_MODES:
+            raise ValueError(f'Unknown binning mode `{mode}`, should be one of {BINNING_MODES}')
+        if value <= 0:
+            raise ValueError(f'Binning parameter should be positive but was {value}')
+        self.mode = mode
+        self.value = value
+
+    @classmethod
+    def from_string(cls, spec):
+        '''Binning by a specification like `fixed:10`'''
+        match = re.fullmatch(r'([a-z-]+):(\d+(?:\.\d+)?)', spec)
+        if not match:
+            raise ValueError(f'Binning specification should be in format `<mode>:<number>` but was `{spec}`')
+        mode, value = match.groups()
+        if mode in ['fixed', 'equal-coverage']:
+            return cls(mode, int(value))
+        return cls(mode, float(value))
+
+    @classmethod
+    def is_binning_spec(cls, spec):
+        '''Whether a string specifies binning rather than a segmentation file'''
+        match = re.fullmatch(r'([a-z-]+):\d+(?:\.\d+)?', spec)
+        return bool(match) and (match.group(1) in BINNING_MODES) and not os.path.exists(spec)
+
+    def __repr__(self):
+        return f'Binning({self.mode!r}, {self.value!r})'
+
+    def boundaries(self, profile):
+        '''Boundaries of bins of a `RunLengthProfile`'''
+        profile_len = len(profile)
+        if profile_len == 0:
+            return np.zeros(0, dtype=np.int64)
+        if self.mode == 'fixed':
+            return np.unique(np.round(np.linspace(0, profile_len, self.value + 1)).astype(np.int64))
+        total_coverage = profile.sum()
+        if total_coverage <= 0:
+            return np.array([0, profile_len], dtype=np.int64)
+        if self.mode == 'equal-coverage':
+            targets = total_coverage * np.arange(1, self.value) / self.value
+            inner_boundaries = profile.positions_by_cumulative_sums(targets)
+        elif self.mode == 'min-count':
+            inner_boundaries = self._min_count_boundaries(profile, total_coverage, profile_len)
+        return np.unique(np.concatenate(([0], inner_boundaries, [profile_len])))
+
+    def _min_count_boundaries(self, profile, total_coverage, profile_len):
+        # each bin ends at the first position where it has accumulated enough coverage;
+        # a single greedy pass over cumulative sums of runs (they are computed once per profile)
+        run_stops = profile.stops.tolist()
+        run_values = profile.values.tolist()
+        run_cumsums = np.cumsum(profile.values * profile.lengths).tolist()
+        inner_boundaries = []
+        bin_start_coverage = 0
+        while bin_start_coverage + self.value <= total_coverage:
+            target = bin_start_coverage + self.value
+            # the first run which reaches a target (it has positive value)
+            run_idx = min(bisect.bisect_left(run_cumsums, target), len(run_cumsums) - 1)
+            previous_cumsum = run_cumsums[run_idx - 1] if run_idx > 0 else 0
+            run_start = run_stops[run_idx - 1] if run_idx > 0 else 0
+            offset = math.ceil((target - previous_cumsum) / run_values[run_idx]) if target > previous_cumsum else 0
+            bin_stop = min(run_start + offset, profile_len)
+            inner_boundaries.append(bin_stop)
+            bin_start_coverage = previous_cumsum + run_values[run_idx] * (bin_stop - run_start)
+        # the rest of a profile doesn't have enough coverage for a bin, so it's merged into the last bin
+        if inner_boundaries and (inner_boundaries[-1] < profile_len):
+            inner_boundaries.pop()
+        return np.array(inner_boundaries, dtype=np.int64)
+
+    def segmentation(self, transcript_id, profiles):
+        '''Segmentation of a transcript by its profiles (dense arrays or `RunLengthProfile`s) pooled together'''
+        profiles = [profile if isinstance(profile, RunLengthProfile) else RunLengthProfile.from_dense(profile) for profile in profiles]
+        pooled_profile = RunLengthProfile.pooled(profiles)
+        return Segmentation(transcript_id, self.boundaries(pooled_profile))
@@ -1,10 +1,12 @@
 import argparse
 from .version import __version__
+from . import gzip_utils
 from .bin import get_coverage, pool_coverage, cds_annotation, clip_cds, \
                  coverage_features, choose_best, \
                  compare_coverage, \
                  adjust_features, plot_distribution, \
-                 flatten_coverage, cds_sequence
+                 flatten_coverage, cds_sequence, convert_coverage, \
+                 segment_coverage
 
 def configure_argparser(argparser=None):
     if not argparser:
@@ -24,6 +26,8 @@ def configure_argparser(argparser=None):
         {'cmd': 'adjust_features', 'namespace': adjust_features, 'help': 'Make length-dependend adjustment of features'},
         {'cmd': 'flatten_coverage', 'namespace': flatten_coverage, 'help': 'Flatten coverage profiles by averaging data through given segments'},
         {'cmd': 'cds_sequence', 'namespace': cds_sequence, 'help': 'Extract CDS sequences from GTF annotation and genome assembly'},
+        {'cmd': 'convert_coverage', 'namespace': convert_coverage, 'help': 'Convert coverage between bedgraph format and binary coverage store'},
+        {'cmd': 'segment_coverage', 'namespace': segment_coverage, 'help': 'Segment coverage profiles into regions of constant Poisson rate'},
     ]
     for subparser_config in subparser_configs:
         invocation_fn = subparser_config['namespace'].invoke
@@ -31,11 +35,13 @@ def configure_argparser(argparser=None):
         subparser = subparsers.add_parser(subparser_config['cmd'], help=subparser_config['help'])
         subparser.set_defaults(invocation_fn=invocation_fn)
         configurator(subparser)
+        gzip_utils.add_threads_argument(subparser)
     return argparser
 
 def main():
     argparser = configure_argparser()
     args = argparser.parse_args()
+    gzip_utils.apply_threads_argument(args)
     args.invocation_fn(args)
 
 if __name__ == '__main__':
@@ -1,21 +1,125 @@
-from . import coreutils_sort
+from array import array
+import numpy as np
+import pysam
 from .dto.transcript_coverage import TranscriptCoverage
-from .dto.coverage_interval import CoverageInterval
 
-def make_coverage(alignment, sort_transcripts='no', stream=True, dtype=float):
+def sorted_transcripts(transcript_ids, sort_transcripts='no'):
+    '''
+    Orders transcripts the same way as `LC_ALL=C sort` (with or without `--ignore-case`) does.
+    Transcripts are kept in original order in `no` mode.
+    '''
     if sort_transcripts == 'case-sensitive':
-        # sort by chromosome (transcript_id in case of transcriptomic alignments)
-        opts = {'key': ['1,1', '2,2n'], 'ignore-case': False}
-        bedgraph = alignment.genome_coverage(bga=True).coreutils_sort(**opts, stream=stream)
+        return sorted(transcript_ids)
     elif sort_transcripts == 'case-insensitive':
-        opts = {'key': ['1,1', '2,2n'], 'ignore-case': True}
-        bedgraph = alignment.genome_coverage(bga=True).coreutils_sort(**opts, stream=stream)
+        # It's necessary to use upcase, not lowercase
+        # to be consistent with GNU coreutils `sort --ignore-case`
+        return sorted(transcript_ids, key=lambda transcript_id: (transcript_id.upper(), transcript_id))
     elif sort_transcripts == 'no':
-        bedgraph = alignment.genome_coverage(bga=True, stream=stream)
+        return list(transcript_ids)
     else:
         raise ValueError('sort_transcripts should be one of no/case-sensitive/case-insensitive.')
-    return bedgraph
 
-def coverage_intervals_from_bedgraph(bedgraph, dtype=float):
-    for interval in bedgraph:
-        yield CoverageInterval(*interval[0:4], dtype=dtype)
+def alignment_coverage(alignment_filename, sort_transcripts='no', dtype=int):
+    '''
+    Yields `TranscriptCoverage` for each reference (transcript) of a transcriptomic alignment
+    in the same manner as `bedtools genomecov -bga` does: each mapped read covers
+    the whole span of its alignment, transcripts without reads get zero profiles.
+    The alignment is read once, transcript lengths are taken from its header.
+    '''
+    with pysam.AlignmentFile(alignment_filename) as alignment:
+        transcript_ids = alignment.references
+        transcript_lengths = alignment.lengths
+        # read covering [start, stop) adds +1 at start and -1 at stop of a difference array (allocated for transcripts with reads only)
+        deltas = [None] * len(transcript_ids)
+        for read in alignment.fetch(until_eof=True):
+            if read.is_unmapped or (read.reference_end is None):
+                continue
+            idx = read.reference_id
+            if deltas[idx] is None:
+                deltas[idx] = np.zeros(transcript_lengths[idx] + 1, dtype=np.int32)
+            deltas[idx][read.reference_start] += 1
+            deltas[idx][read.reference_end] -= 1
+
+    transcript_index = {transcript_id: idx for (idx, transcript_id) in enumerate(transcript_ids)}
+    for transcript_id in sorted_transcripts(transcript_ids, sort_transcripts=sort_transcripts):
+        idx = transcript_index[transcript_id]
+        if deltas[idx] is None:
+            profile = np.zeros(transcript_lengths[idx], dtype=np.int64)
+        else:
+            profile = np.cumsum(deltas[idx][:-1], dtype=np.int64)
+        deltas[idx] = None # free memory
+        yield TranscriptCoverage(transcript_id, profile.astype(dtype))
+
+def start_codon_read_ends(alignment_filename, cds_info_by_transcript, max_offset=25):
+    '''
+    5'-ends and lengths of forward-strand reads which start no farther than `max_offset` upstream of an annotated start codon.
+    Only these reads are needed to infer P-site offsets (see `psite_offsets.infer_psite_offsets`), other reads are skipped.
+    Returns a dictionary {transcript_id: (five_prime_ends, read_lengths)}
+    '''
+    with pysam.AlignmentFile(alignment_filename) as alignment:
+        transcript_ids = alignment.references
+        cds_starts = []
+        for transcript_id in transcript_ids:
+            cds_info = cds_info_by_transcript.get(transcript_id)
+            cds_starts.append(cds_info.cds_start if (cds_info is not None) and cds_info.is_coding else None)
+        five_prime_ends = {}
+        read_lengths = {}
+        for read in alignment.fetch(until_eof=True):
+            if read.is_unmapped or read.is_reverse or (read.reference_end is None):
+                continue
+            idx = read.reference_id
+            cds_start = cds_starts[idx]
+            if (cds_start is None) or not (0 <= cds_start - read.reference_start <= max_offset):
+                continue
+            five_prime_ends.setdefault(idx, array('q')).append(read.reference_start)
+            read_lengths.setdefault(idx, array('i')).append(read.infer_query_length())
+    return {transcript_ids[idx]: (np.frombuffer(five_prime_ends[idx], dtype=np.int64), np.frombuffer(read_lengths[idx], dtype=np.int32))
+            for idx in five_prime_ends}
+
+class PsiteCoverage:
+    '''
+    Coverage of reads from a transcriptomic alignment where each read is counted once at its P-site.
+    The alignment is read once at construction: P-sites are counted into per-transcript arrays
+    and read lengths into a histogram, nothing is kept per read.
+    Reads of lengths without a known offset and reads with a P-site out of transcript are not counted in coverage
+    (but they are counted in the histogram).
+    '''
+    def __init__(self, alignment_filename, psite_offsets):
+        read_length_counts = {}
+        with pysam.AlignmentFile(alignment_filename) as alignment:
+            self.transcript_ids = alignment.references
+            self.transcript_lengths = alignment.lengths
+            self._psite_counts = [None] * len(self.transcript_ids)
+            for read in alignment.fetch(until_eof=True):
+                if read.is_unmapped or (read.reference_end is None):
+                    continue
+                read_length = read.infer_query_length()
+                read_length_counts[read_length] = read_length_counts.get(read_length, 0) + 1
+                offset = psite_offsets.get(read_length, -1)
+                if offset < 0:
+                    continue
+                idx = read.reference_id
+                if read.is_reverse:
+                    psite = read.reference_end - 1 - offset
+                else:
+                    psite = read.reference_start + offset
+                transcript_length = self.transcript_lengths[idx]
+                if not (0 <= psite < transcript_length):
+                    continue
+                if self._psite_counts[idx] is None:
+                    self._psite_counts[idx] = np.zeros(transcript_length, dtype=np.int64)
+                self._psite_counts[idx][psite] += 1
+        self.read_length_counts = np.zeros(max(read_length_counts, default=0) + 1, dtype=np.int64)
+        for (read_length, count) in read_length_counts.items():
+            self.read_length_counts[read_length] = count
+
+    def transcript_coverages(self, sort_transcripts='no', dtype=int):
+        '''Yields `TranscriptCoverage` for each transcript (transcripts without counted reads get zero profiles)'''
+        transcript_index = {transcript_id: idx for (idx, transcript_id) in enumerate(self.transcript_ids)}
+        for transcript_id in sorted_transcripts(self.transcript_ids, sort_transcripts=sort_transcripts):
+            idx = transcript_index[transcript_id]
+            profile = self._psite_counts[idx]
+            if profile is None:
+                profile = np.zeros(self.transcript_lengths[idx], dtype=np.int64)
+            self._psite_counts[idx] = None # free memory
+            yield TranscriptCoverage(transcript_id, profile.astype(dtype))
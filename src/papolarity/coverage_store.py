@@ -0,0 +1,112 @@
+import os
+import json
+import numpy as np
+
+# Coverage store is a directory with three files:
+# * values file: coverage profiles of all transcripts concatenated into a single raw array
+# * index file: `transcript_id, offset, length` for each transcript (offsets and lengths are in elements, not bytes)
+# * format file: json with store format version, layout and dtype of values
+# Profiles are loaded through `np.memmap`, so they are neither copied nor parsed.
+# Only `dense` layout (a value per position) is supported: a memory-mapped slice of it is a ready profile,
+# while run-length profiles are built on loading when they are requested (see `TranscriptCoverage.from_profile`).
+# `layout` field is reserved for other layouts (e.g. run-length encoded values), stores of unknown layouts are rejected.
+FORMAT_NAME = 'papolarity-coverage-store'
+FORMAT_VERSION = 1
+FORMAT_FILENAME = 'format.json'
+INDEX_FILENAME = 'index.tsv'
+VALUES_FILENAME = 'values.bin'
+
+def is_coverage_store(filename):
+    return bool(filename) and os.path.isdir(filename) and os.path.exists(os.path.join(filename, FORMAT_FILENAME))
+
+class CoverageStore:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, FORMAT_FILENAME)) as f:
+            store_format = json.load(f)
+        if store_format.get('format') != FORMAT_NAME:
+            raise ValueError(f'`{path}` is not a coverage store')
+        if store_format.get('version') != FORMAT_VERSION:
+            raise ValueError(f'Unsupported coverage store version `{store_format.get("version")}`')
+        if store_format.get('layout') != 'dense':
+            raise ValueError(f'Unsupported coverage store layout `{store_format.get("layout")}`')
+        self.dtype = np.dtype(store_format['dtype'])
+        self.index = self.load_index(os.path.join(path, INDEX_FILENAME))
+        values_filename = os.path.join(path, VALUES_FILENAME)
+        if os.path.getsize(values_filename) > 0:
+            self.values = np.memmap(values_filename, dtype=self.dtype, mode='r')
+        else:
+            # np.memmap can't map an empty file
+            self.values = np.empty(0, dtype=self.dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excinfo):
+        self.close()
+
+    def close(self):
+        '''Unmaps values file (profiles fetched earlier keep it mapped until they are released)'''
+        self.values = np.empty(0, dtype=self.dtype)
+        self.index = {}
+
+    @classmethod
+    def load_index(cls, filename):
+        index = {}
+        with open(filename) as f:
+            f.readline() # skip header
+            for line in f:
+                transcript_id, offset, length = line.rstrip('\n').split('\t')
+                index[transcript_id] = (int(offset), int(length))
+        return index
+
+    @property
+    def transcript_ids(self):
+        return list(self.index.keys())
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, transcript_id):
+        return transcript_id in self.index
+
+    def fetch(self, transcript_id):
+        '''Returns a (read-only) profile of the transcript. Raises KeyError for unknown transcripts'''
+        offset, length = self.index[transcript_id]
+        return self.values[offset:(offset + length)]
+
+    def get(self, transcript_id, default=None):
+        if transcript_id not in self.index:
+            return default
+        return self.fetch(transcript_id)
+
+    def __iter__(self):
+        '''Yields pairs (transcript_id, profile) in the order they were stored'''
+        for transcript_id in self.index:
+            yield (transcript_id, self.fetch(transcript_id))
+
+    @classmethod
+    def create(cls, path, profiles, dtype=float):
+        '''
+        Stores a stream of pairs (transcript_id, profile) into a new coverage store at `path`.
+        Order of transcripts is preserved.
+        '''
+        dtype = np.dtype(dtype)
+        os.makedirs(path, exist_ok=True)
+        format_filename = os.path.join(path, FORMAT_FILENAME)
+        if os.path.exists(format_filename):
+            os.remove(format_filename)
+        offset = 0
+        with open(os.path.join(path, VALUES_FILENAME), 'wb') as values_file, \
+             open(os.path.join(path, INDEX_FILENAME), 'w') as index_file:
+            print('transcript_id\toffset\tlength', file=index_file)
+            for (transcript_id, profile) in profiles:
+                profile = np.ascontiguousarray(profile, dtype=dtype)
+                values_file.write(profile.tobytes())
+                print(f'{transcript_id}\t{offset}\t{len(profile)}', file=index_file)
+                offset += len(profile)
+        # format file is written the last so that an incomplete store isn't recognized as a store
+        with open(format_filename, 'w') as format_file:
+            store_format = {'format': FORMAT_NAME, 'version': FORMAT_VERSION, 'layout': 'dense', 'dtype': dtype.str}
+            json.dump(store_format, format_file)
+        return cls(path)
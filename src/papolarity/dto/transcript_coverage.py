@@ -1,17 +1,125 @@
 import dataclasses
 import itertools
 import numpy as np
-from .coverage_interval import CoverageInterval
+from .. import bgzf
+from ..bedgraph_reader import each_transcript_intervals, parse_bedgraph_block
+from ..coverage_store import CoverageStore, is_coverage_store
+from ..unsorted_join import RandomAccessSource
+from ..run_length_profile import RunLengthProfile
 
 @dataclasses.dataclass
 class TranscriptCoverage:
     transcript_id: str
-    coverage: np.array
+    coverage: np.array # or RunLengthProfile
 
     @classmethod
-    def each_in_file(cls, filename, header=False, dtype=float):
-        bedgraph_stream = CoverageInterval.each_in_file(filename, header=False)
-        yield from cls.each_in_bedgraph(bedgraph_stream, dtype=dtype)
+    def each_in_file(cls, filename, header=False, dtype=float, run_length=False):
+        '''
+        Yields coverage profiles from a bedgraph file or from a coverage store.
+        Profiles from a coverage store are memory-mapped (not copied) unless
+        store dtype differs from requested one.
+        If `run_length` is True, profiles are `RunLengthProfile`s instead of dense arrays.
+        '''
+        if is_coverage_store(filename):
+            yield from cls.each_in_store(CoverageStore(filename), dtype=dtype, run_length=run_length)
+            return
+        for (transcript_id, starts, stops, values) in each_transcript_intervals(filename, header=header, dtype=dtype):
+            yield cls.from_intervals(transcript_id, starts, stops, values, dtype=dtype, run_length=run_length)
+
+    @classmethod
+    def fetch(cls, filename, transcript_id, dtype=float, run_length=False):
+        '''Loads coverage profile of a single transcript. Raises KeyError if transcript is absent'''
+        for transcript_coverage in cls.fetch_many(filename, [transcript_id], dtype=dtype, run_length=run_length):
+            return transcript_coverage
+        raise KeyError(transcript_id)
+
+    @classmethod
+    def fetch_many(cls, filename, transcript_ids, dtype=float, run_length=False):
+        '''
+        Yields coverage profiles of specified transcripts in the specified order.
+        Transcripts absent in a file are skipped.
+        Coverage stores and block-gzipped bedgraphs with an index are accessed randomly,
+        other bedgraph files are scanned entirely.
+        '''
+        if is_coverage_store(filename):
+            store = CoverageStore(filename)
+            for transcript_id in transcript_ids:
+                if transcript_id in store:
+                    yield cls.from_profile(transcript_id, store.fetch(transcript_id), dtype=dtype, run_length=run_length)
+        elif bgzf.has_index(filename):
+            contig_offsets = bgzf.load_index(bgzf.index_filename(filename))
+            with bgzf.BgzfReader(filename) as reader:
+                for transcript_id in transcript_ids:
+                    if transcript_id not in contig_offsets:
+                        continue
+                    yield cls.from_bgzf(reader, transcript_id, contig_offsets[transcript_id], dtype=dtype, run_length=run_length)
+        else:
+            transcript_ids = list(transcript_ids)
+            requested_ids = set(transcript_ids)
+            found = {}
+            for (transcript_id, starts, stops, values) in each_transcript_intervals(filename, dtype=dtype):
+                if transcript_id in requested_ids:
+                    found[transcript_id] = cls.from_intervals(transcript_id, starts, stops, values, dtype=dtype, run_length=run_length)
+            for transcript_id in transcript_ids:
+                if transcript_id in found:
+                    yield found[transcript_id]
+
+    @classmethod
+    def from_bgzf(cls, reader, transcript_id, virtual_offset, dtype=float, run_length=False):
+        text = ''.join(reader.each_contig_line(transcript_id, virtual_offset))
+        _, starts, stops, values = parse_bedgraph_block(text, dtype=dtype)
+        return cls.from_intervals(transcript_id, starts, stops, values, dtype=dtype, run_length=run_length)
+
+    @classmethod
+    def join_source(cls, filename, header=False, dtype=float, run_length=False):
+        '''
+        Source of profiles for `unsorted_join.align_unsorted`.
+        Coverage stores and indexed block-gzipped bedgraphs are accessed randomly,
+        other files are streamed.
+        '''
+        if is_coverage_store(filename):
+            store = CoverageStore(filename)
+            fetch = lambda transcript_id: cls.from_profile(transcript_id, store.fetch(transcript_id), dtype=dtype, run_length=run_length)
+            return RandomAccessSource(store.transcript_ids, fetch, close=store.close)
+        elif bgzf.has_index(filename):
+            contig_offsets = bgzf.load_index(bgzf.index_filename(filename))
+            reader = bgzf.BgzfReader(filename)
+            fetch = lambda transcript_id: cls.from_bgzf(reader, transcript_id, contig_offsets[transcript_id], dtype=dtype, run_length=run_length)
+            return RandomAccessSource(contig_offsets.keys(), fetch, close=reader.close)
+        else:
+            return cls.each_in_file(filename, header=header, dtype=dtype, run_length=run_length)
+
+    @classmethod
+    def each_in_store(cls, store, dtype=float, run_length=False):
+        for (transcript_id, profile) in store:
+            yield cls.from_profile(transcript_id, profile, dtype=dtype, run_length=run_length)
+
+    @classmethod
+    def from_profile(cls, transcript_id, profile, dtype=float, run_length=False):
+        profile = profile.astype(dtype, copy=False)
+        if run_length:
+            profile = RunLengthProfile.from_dense(profile)
+        return cls(transcript_id, profile)
+
+    @classmethod
+    def from_intervals(cls, transcript_id, starts, stops, values, dtype=float, run_length=False):
+        '''
+        Builds a profile from arrays of interval starts, stops and coverage values.
+        Positions not covered by any interval get zero coverage.
+        '''
+        if run_length:
+            return cls(transcript_id, RunLengthProfile.from_intervals(starts, stops, values, dtype=dtype))
+        lengths = stops - starts
+        if (starts[0] == 0) and np.array_equal(starts[1:], stops[:-1]):
+            # zero-padded bedgraph (such as generated by `bedtools genomecov -bga`) covers the whole transcript
+            profile = np.repeat(values, lengths).astype(dtype, copy=False)
+        else:
+            transcript_length = stops.max()
+            profile = np.zeros(transcript_length, dtype=dtype)
+            interval_offsets = np.cumsum(lengths) - lengths
+            positions = np.arange(lengths.sum()) + np.repeat(starts - interval_offsets, lengths)
+            profile[positions] = np.repeat(values, lengths)
+        return cls(transcript_id, profile)
 
     @classmethod
     def each_in_bedgraph(cls, bedgraph_stream, dtype=float):
@@ -0,0 +1,68 @@
+import os
+import bisect
+import dataclasses
+from typing import Optional
+from . import bgzf
+
+@dataclasses.dataclass(frozen=True)
+class FileChunk:
+    '''
+    A part of a text file which can be read independently of other parts.
+    Chunk owns lines which start at positions [start, stop): byte offsets in a plain file
+    or compressed offsets of blocks in a block-gzipped file.
+    A line which starts in a chunk is read till its end (even if it goes beyond the chunk).
+    '''
+    filename: str
+    start: int
+    stop: int
+    block_gzip: bool = False
+    previous_block: Optional[int] = None # offset of a block preceding the chunk (block-gzip only)
+
+    def each_line(self, encoding='utf-8'):
+        if self.block_gzip:
+            with bgzf.BgzfReader(self.filename, encoding=encoding) as reader:
+                yield from reader.each_line_in_blocks(self.start, self.stop, self.previous_block)
+        else:
+            yield from each_line_in_byte_range(self.filename, self.start, self.stop, encoding=encoding)
+
+def each_line_in_byte_range(filename, start, stop, encoding='utf-8'):
+    '''Yields lines of a plain text file which start at byte offsets [start, stop)'''
+    with open(filename, 'rb') as f:
+        if start > 0:
+            # the rest of a line which starts before the range belongs to a previous range
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        for line in f:
+            if position >= stop:
+                break
+            yield line.decode(encoding)
+            position += len(line)
+
+def is_gzip(filename):
+    with open(filename, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+def split_file(filename, num_chunks):
+    '''
+    Splits a plain or a block-gzipped text file into at most `num_chunks` chunks of almost equal (compressed) size.
+    Returns None when a file can't be split (e.g. an ordinary gzip file or a stream).
+    '''
+    if (not filename) or (filename == '-') or not os.path.isfile(filename):
+        return None
+    file_size = os.path.getsize(filename)
+    targets = [file_size * idx // num_chunks for idx in range(num_chunks + 1)]
+    if not is_gzip(filename):
+        boundaries = sorted(set(targets))
+        return [FileChunk(filename, start, stop) for (start, stop) in zip(boundaries[:-1], boundaries[1:])]
+    if not bgzf.is_bgzf(filename):
+        return None
+    offsets = bgzf.block_offsets(filename)
+    # chunks start at blocks nearest to target offsets
+    boundary_indices = sorted({bisect.bisect_left(offsets, target) for target in targets[:-1]} | {len(offsets)})
+    chunks = []
+    for (start_idx, stop_idx) in zip(boundary_indices[:-1], boundary_indices[1:]):
+        previous_block = offsets[start_idx - 1] if start_idx > 0 else None
+        stop = offsets[stop_idx] if stop_idx < len(offsets) else file_size
+        chunks.append(FileChunk(filename, offsets[start_idx], stop, block_gzip=True, previous_block=previous_block))
+    return chunks
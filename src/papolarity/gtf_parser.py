@@ -2,6 +2,7 @@
 
 from collections import namedtuple
 import json
+import re
 from .gzip_utils import open_for_read
 
 _gff_info_fields = ["contig", "source", "type", "start", "stop", "score", "strand", "phase", "attributes"]
@@ -50,48 +51,73 @@ class GTFRecord(namedtuple("GTFRecord", _gff_info_fields)):
         return ' '.join(attr_strings)
 
     @classmethod
-    def each_in_file(cls, filename, multivalue_keys=None, ignore_unknown_multivalues=False):
+    def each_in_file(cls, filename, multivalue_keys=None, ignore_unknown_multivalues=False, relevant_attributes=None, feature_types=None, line_filter=None):
         """
         A minimalistic GTF format parser.
         Yields objects that contain info about a single GTF feature.
+        If `relevant_attributes` are specified, only these attributes are decoded.
+        Records of types not in `feature_types` (if specified) are skipped.
+        `line_filter` is a predicate on raw lines, it's applied before a line is parsed
+        (it's a fast prefilter, so it can accept records to be rejected later).
 
         Supports transparent gzip decompression.
         """
         with open_for_read(filename, encoding='utf-8') as infile:
-            for line in infile:
-                if line.startswith("#"): continue
-                parts = line.strip().split("\t")
-                # If this fails, the file format is not standard-compatible
-                assert len(parts) == len(_gff_info_fields)
-                assert parts[0] != '.'  # contig
-                assert parts[2] != '.'  # type
-                assert parts[3] != '.'  # start
-                assert parts[4] != '.'  # stop
-                assert parts[6] in {'+', '-'}
-
-                # Normalize data
-                normalized_info = {
-                    "contig": parts[0],
-                    "source": None if parts[1] == "." else parts[1],
-                    "type":   parts[2],
-                    "start":  int(parts[3]) - 1, # 0-based, included
-                    "stop":   int(parts[4]),     # 0-based, excluded
-                    "score": None if parts[5] == "." else float(parts[5]),
-                    "strand": parts[6],
-                    "phase": None if parts[7] == "." else parts[7],
-                    "attributes": cls.parse_gtf_attributes(parts[8], multivalue_keys=multivalue_keys, ignore_unknown_multivalues=ignore_unknown_multivalues),
-                }
-                yield GTFRecord(**normalized_info)
+            yield from cls.each_in_lines(infile, multivalue_keys=multivalue_keys, ignore_unknown_multivalues=ignore_unknown_multivalues,
+                                         relevant_attributes=relevant_attributes, feature_types=feature_types, line_filter=line_filter)
 
     @classmethod
-    def parse_gtf_attributes(cls, attribute_string, multivalue_keys=None, ignore_unknown_multivalues=False):
-        """Parse the GTF attribute column and return a dict"""
+    def each_in_lines(cls, lines, multivalue_keys=None, ignore_unknown_multivalues=False, relevant_attributes=None, feature_types=None, line_filter=None):
+        '''Parses GTF records from text lines (e.g. from a chunk of a file), options are the same as in `each_in_file`'''
+        if multivalue_keys is None:
+            multivalue_keys = set()
+        attributes_pattern = _attributes_pattern(relevant_attributes) if relevant_attributes is not None else None
+        for line in lines:
+            if line.startswith("#"): continue
+            if (line_filter is not None) and not line_filter(line): continue
+            parts = line.strip().split("\t")
+            # If this fails, the file format is not standard-compatible
+            assert len(parts) == len(_gff_info_fields)
+            if (feature_types is not None) and (parts[2] not in feature_types): continue
+            assert parts[0] != '.'  # contig
+            assert parts[2] != '.'  # type
+            assert parts[3] != '.'  # start
+            assert parts[4] != '.'  # stop
+            assert parts[6] in {'+', '-'}
+
+            yield GTFRecord(
+                parts[0], # contig
+                None if parts[1] == "." else parts[1], # source
+                parts[2], # type
+                int(parts[3]) - 1, # start: 0-based, included
+                int(parts[4]),     # stop: 0-based, excluded
+                None if parts[5] == "." else float(parts[5]), # score
+                parts[6], # strand
+                None if parts[7] == "." else parts[7], # phase
+                cls._parse_gtf_attributes(parts[8], multivalue_keys, ignore_unknown_multivalues, attributes_pattern),
+            )
+
+    @classmethod
+    def parse_gtf_attributes(cls, attribute_string, multivalue_keys=None, ignore_unknown_multivalues=False, relevant_attributes=None):
+        """
+        Parse the GTF attribute column and return a dict.
+        If `relevant_attributes` are specified, other attributes are skipped without decoding.
+        """
+        if multivalue_keys is None:
+            multivalue_keys = set()
+        attributes_pattern = _attributes_pattern(relevant_attributes) if relevant_attributes is not None else None
+        return cls._parse_gtf_attributes(attribute_string, multivalue_keys, ignore_unknown_multivalues, attributes_pattern)
+
+    @classmethod
+    def _parse_gtf_attributes(cls, attribute_string, multivalue_keys, ignore_unknown_multivalues, attributes_pattern):
         if attribute_string == ".":
             return {}
+        if attributes_pattern is None:
+            key_value_pairs = (attribute.strip().split(" ", maxsplit=1) for attribute in attribute_string.strip().rstrip(";").split(";"))
+        else:
+            key_value_pairs = attributes_pattern.findall(attribute_string)
         ret = {}
-        for attribute in attribute_string.strip().rstrip(";").split(";"):
-            key, value = attribute.strip().split(" ", maxsplit=1)
-
+        for key, value in key_value_pairs:
             if value[0] == '"':
                 val = value[1:-1]
             else:
@@ -112,3 +138,16 @@ class GTFRecord(namedtuple("GTFRecord", _gff_info_fields)):
                     ret[key] = []
                 ret[key].append(val)
         return ret
+
+_attributes_patterns = {}
+
+def _attributes_pattern(attribute_keys):
+    '''Regexp which matches `key value` pairs of GTF attributes with specified keys only'''
+    attribute_keys = frozenset(attribute_keys)
+    if attribute_keys not in _attributes_patterns:
+        if attribute_keys:
+            keys_regexp = '|'.join(re.escape(key) for key in sorted(attribute_keys))
+        else:
+            keys_regexp = '(?!)' # never matches
+        _attributes_patterns[attribute_keys] = re.compile(f'(?:^|;)\\s*({keys_regexp}) ("[^"]*"|[^;\\s]+)')
+    return _attributes_patterns[attribute_keys]
@@ -1,6 +1,164 @@
 import gzip
+import io
 import sys
+import queue
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
 from .nullcontext import nullcontext
+from .bgzf import BgzfWriter
+
+# Number of threads used to (de)compress gzip files. See `set_num_threads`
+_num_threads = 1
+
+# Size of uncompressed data which is compressed as a separate gzip member by parallel writer
+CHUNK_SIZE = 1024 * 1024
+
+def set_num_threads(num_threads):
+    '''
+    Sets number of threads for compression of files opened by `open_for_write`.
+    When more than one thread is used, `open_for_read` also decompresses files in a separate thread.
+    '''
+    global _num_threads
+    if num_threads < 1:
+        raise ValueError('Number of threads should be positive')
+    _num_threads = num_threads
+
+def get_num_threads():
+    return _num_threads
+
+def add_threads_argument(argparser):
+    argparser.add_argument('--threads', metavar='N', type=int, default=1, help="Number of threads to compress/decompress gzipped files (default: %(default)s)")
+    return argparser
+
+def apply_threads_argument(args):
+    '''Applies `--threads` option (see `add_threads_argument`) of parsed command-line arguments'''
+    set_num_threads(getattr(args, 'threads', 1))
+
+def compress_member(data, compresslevel=9):
+    '''
+    Compresses data into a standalone gzip member with zero modification time, so that output doesn't depend on time.
+    (`gzip.compress` accepts `mtime` only since Python 3.8)
+    '''
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=compresslevel, mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+class ParallelGzipWriter:
+    '''
+    Text-mode gzip writer which compresses chunks of data in several threads.
+    Each chunk is a separate gzip member, so the result is a standard multi-member gzip file.
+    '''
+    def __init__(self, filename, num_threads, compresslevel=9, encoding='utf-8', chunk_size=CHUNK_SIZE):
+        self.encoding = encoding
+        self.compresslevel = compresslevel
+        self.chunk_size = chunk_size
+        self.max_chunks_in_flight = 2 * num_threads
+        self._file = open(filename, 'wb')
+        self._executor = ThreadPoolExecutor(max_workers=num_threads)
+        self._compressed_chunks = collections.deque()
+        self._buffer = []
+        self._buffer_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excinfo):
+        self.close()
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self._buffer.append(text)
+        self._buffer_size += len(text)
+        if self._buffer_size >= self.chunk_size:
+            self._submit_buffer()
+        return len(text)
+
+    def _submit_buffer(self):
+        data = ''.join(self._buffer).encode(self.encoding)
+        self._buffer = []
+        self._buffer_size = 0
+        # zlib releases GIL during compression, so chunks are really compressed in parallel
+        self._compressed_chunks.append(self._executor.submit(compress_member, data, compresslevel=self.compresslevel))
+        while len(self._compressed_chunks) > self.max_chunks_in_flight:
+            self._write_compressed_chunk()
+
+    def _write_compressed_chunk(self):
+        self._file.write(self._compressed_chunks.popleft().result())
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self._buffer_size > 0:
+            self._submit_buffer()
+        while self._compressed_chunks:
+            self._write_compressed_chunk()
+        self._executor.shutdown()
+        self._file.close()
+
+class _ReadAheadRawStream(io.RawIOBase):
+    '''Binary stream of data decompressed in a background thread'''
+    def __init__(self, filename, chunk_size=CHUNK_SIZE, max_chunks_in_flight=4):
+        self._chunks = queue.Queue(maxsize=max_chunks_in_flight)
+        self._current_chunk = b''
+        self._exhausted = False
+        self._stop_reading = threading.Event()
+        self._thread = threading.Thread(target=self._decompress, args=(filename, chunk_size), daemon=True)
+        self._thread.start()
+
+    def _decompress(self, filename, chunk_size):
+        try:
+            with gzip.open(filename, 'rb') as f:
+                while not self._stop_reading.is_set():
+                    chunk = f.read(chunk_size)
+                    self._put(chunk)
+                    if not chunk:
+                        break
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self._stop_reading.is_set():
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._current_chunk:
+            if self._exhausted:
+                return 0
+            chunk = self._chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                self._exhausted = True
+                return 0
+            self._current_chunk = chunk
+        size = min(len(buffer), len(self._current_chunk))
+        buffer[:size] = self._current_chunk[:size]
+        self._current_chunk = self._current_chunk[size:]
+        return size
+
+    def close(self):
+        self._stop_reading.set()
+        super().close()
+
+def open_read_ahead(filename, mode='rt', encoding=None, **kwargs):
+    raw_stream = _ReadAheadRawStream(filename)
+    if 'b' in mode:
+        return io.BufferedReader(raw_stream)
+    return io.TextIOWrapper(io.BufferedReader(raw_stream), encoding=encoding, **kwargs)
 
 def choose_open_function(filename, force_gzip=None):
     '''
@@ -14,9 +172,17 @@ def choose_open_function(filename, force_gzip=None):
     else:
         raise ValueError("`force_gzip` should be one of True/False/None")
 
-def open_for_write(filename, force_gzip=None, mode='wt', **kwargs):
+def open_for_write(filename, force_gzip=None, mode='wt', block_gzip=False, **kwargs):
+    '''
+    If `block_gzip` is True, output is written in block-gzip format
+    along with an index of its contigs (first column values)
+    '''
     if filename and (filename != '-'):
+        if block_gzip:
+            return BgzfWriter(filename, index_contigs=True, num_threads=_num_threads, **kwargs)
         open_func = choose_open_function(filename=filename, force_gzip=force_gzip)
+        if (open_func is gzip.open) and (_num_threads > 1) and ('b' not in mode):
+            return ParallelGzipWriter(filename, num_threads=_num_threads, **kwargs)
         return open_func(filename, mode, **kwargs)
     else:
         return nullcontext(sys.stdout)
@@ -24,6 +190,8 @@ def open_for_write(filename, force_gzip=None, mode='wt', **kwargs):
 def open_for_read(filename, force_gzip=None, mode='rt', **kwargs):
     if filename and (filename != '-'):
         open_func = choose_open_function(filename=filename, force_gzip=force_gzip)
+        if (open_func is gzip.open) and (_num_threads > 1):
+            return open_read_ahead(filename, mode, **kwargs)
         return open_func(filename, mode, **kwargs)
     else:
         return nullcontext(sys.stdin)
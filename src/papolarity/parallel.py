@@ -0,0 +1,30 @@
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+# Number of items (typically chunks of transcripts) submitted to a process pool
+# but not yet consumed, per worker. It bounds memory used by pending items and results.
+MAX_ITEMS_IN_FLIGHT_PER_JOB = 2
+
+def ordered_map(function, items, jobs=1, max_items_in_flight=None):
+    '''
+    Yields `function(item)` for each item in input order.
+    With several jobs items are processed by a pool of worker processes,
+    so both `function` and items should be picklable (a module-level function or its `functools.partial`).
+    Items are taken from an iterable lazily: at most `max_items_in_flight`
+    (by default `2 * jobs`) items are processed or wait for consumption at once.
+    '''
+    if jobs < 1:
+        raise ValueError('Number of jobs should be positive')
+    if jobs == 1:
+        yield from map(function, items)
+        return
+    if max_items_in_flight is None:
+        max_items_in_flight = MAX_ITEMS_IN_FLIGHT_PER_JOB * jobs
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending_results = collections.deque()
+        for item in items:
+            pending_results.append(executor.submit(function, item))
+            if len(pending_results) >= max_items_in_flight:
+                yield pending_results.popleft().result()
+        while pending_results:
+            yield pending_results.popleft().result()
@@ -0,0 +1,66 @@
+import numpy as np
+from scipy.special import gammaln, xlogy
+from .run_length_profile import RunLengthProfile
+from .segmentation import Segmentation
+
+class PoissonSegmenter:
+    '''
+    Bayesian segmentation of a coverage profile into segments of constant Poisson rate
+    with Gamma(alpha, beta) prior on the rate (the same model as in `pasio`).
+    Segmentation maximizes a sum of log-marginal likelihoods of segments.
+
+    Dynamic programming goes only over boundaries of constant runs of the profile
+    (an optimal segmentation never splits a constant run) and prunes candidate
+    boundaries which can't be the last split point of any optimal segmentation.
+    '''
+    def __init__(self, alpha=1.0, beta=1.0):
+        if (alpha <= 0) or (beta <= 0):
+            raise ValueError(f'Prior parameters should be positive but were alpha={alpha}, beta={beta}')
+        self.alpha = alpha
+        self.beta = beta
+        # contribution of a prior to log-marginal likelihood of each segment
+        self.segment_constant = alpha * np.log(beta) - gammaln(alpha)
+
+    def log_marginal_likelihoods(self, counts, lengths):
+        '''
+        Log-marginal likelihood of segments with total `counts` and `lengths`
+        (up to `sum(log(x!))` term which doesn't depend on segmentation)
+        '''
+        return self.segment_constant + gammaln(self.alpha + counts) - (self.alpha + counts) * np.log(self.beta + lengths)
+
+    def boundaries(self, profile):
+        '''Boundaries of an optimal segmentation of a profile (dense array or `RunLengthProfile`)'''
+        if not isinstance(profile, RunLengthProfile):
+            profile = RunLengthProfile.from_dense(np.asarray(profile))
+        (_, run_stops, run_values) = profile.merged_runs()
+        if len(run_stops) == 0:
+            return np.zeros(0, dtype=np.int64)
+        if np.any(run_values < 0):
+            raise ValueError('Coverage values should be non-negative')
+        candidate_positions = np.concatenate(([0], run_stops))
+        candidate_counts = profile.cumulative_sums(candidate_positions).astype(float)
+        num_candidates = len(candidate_positions)
+
+        best_scores = np.zeros(num_candidates)
+        previous_boundary = np.zeros(num_candidates, dtype=np.int64)
+        alive = np.zeros(1, dtype=np.int64)
+        for idx in range(1, num_candidates):
+            counts = candidate_counts[idx] - candidate_counts[alive]
+            lengths = candidate_positions[idx] - candidate_positions[alive]
+            scores = best_scores[alive] + self.log_marginal_likelihoods(counts, lengths)
+            best_idx = np.argmax(scores)
+            best_scores[idx] = scores[best_idx]
+            previous_boundary[idx] = alive[best_idx]
+            # Marginal likelihood of a segment glued to the last one can't exceed its maximal likelihood,
+            # so a candidate which loses to the best score even with maximal likelihood of the last segment
+            # would lose at any further position too.
+            max_log_likelihoods = xlogy(counts, counts / lengths) - counts
+            alive = np.append(alive[best_scores[alive] + max_log_likelihoods >= best_scores[idx]], idx)
+
+        boundary_indices = [num_candidates - 1]
+        while boundary_indices[-1] != 0:
+            boundary_indices.append(previous_boundary[boundary_indices[-1]])
+        return candidate_positions[boundary_indices[::-1]]
+
+    def segmentation(self, transcript_id, profile):
+        return Segmentation(transcript_id, self.boundaries(profile))
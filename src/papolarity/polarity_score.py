@@ -1,6 +1,9 @@
 import numpy as np
+from .run_length_profile import RunLengthProfile
 
 def polarity_score(coverage):
+    if isinstance(coverage, RunLengthProfile):
+        return coverage.polarity_score()
     coverage = np.array(coverage)
     total_coverage = coverage.sum()
     if total_coverage == 0:
@@ -1,43 +1,89 @@
-from sklearn.linear_model import LinearRegression
+import functools
 import numpy as np
-from math import log2
 from .polarity_score import polarity_score
-from .utils import common_subsequence
+from .profile_features import RunLengthBatch
+from .utils import common_subsequence, each_batch
+from .parallel import ordered_map
+from .unsorted_join import align_unsorted
+
+# Number of transcripts which are compared at once
+BATCH_SIZE = 1024
 
 def comparison_infos(transcript_id, control_profile, experiment_profile, segmentation, quantile_q=0.5, quantile_threshold=0):
-    assert len(control_profile) == len(experiment_profile) == segmentation.segmentation_length
-    control_sums = segmentwise_sums(segmentation, control_profile)
-    experiment_sums = segmentwise_sums(segmentation, experiment_profile)
-    info = {
-        'transcript_id': transcript_id,
-        'slope': slope_by_segment_counts(control_sums, experiment_sums, segmentation, log_mode=False,
-                                         quantile_q=quantile_q, quantile_threshold=quantile_threshold),
-        'slopelog': slope_by_segment_counts(control_sums, experiment_sums, segmentation, log_mode=True,
-                                            quantile_q=quantile_q, quantile_threshold=quantile_threshold),
-        'l1_distance': l1_distance_by_segment_counts(control_sums, experiment_sums),
-        'polarity_diff': polarity_diff(control_profile, experiment_profile),
-    }
-    return info
+    infos = comparison_infos_batch([(transcript_id, (segmentation, control_profile, experiment_profile))],
+                                   quantile_q=quantile_q, quantile_threshold=quantile_threshold)
+    return infos[0]
+
+def comparison_infos_batch(aligned_profiles, quantile_q=0.5, quantile_threshold=0):
+    '''
+    Compares profiles of a batch of transcripts at once.
+    `aligned_profiles` is a list of tuples `(transcript_id, (segmentation, control_profile, experiment_profile))`
+    '''
+    return comparison_infos_multiple_batch(aligned_profiles, [(0, 1)], quantile_q=quantile_q, quantile_threshold=quantile_threshold)[0]
+
+def comparison_infos_multiple_batch(aligned_profiles, pairs, quantile_q=0.5, quantile_threshold=0):
+    '''
+    Compares several pairs of samples for a batch of transcripts.
+    `aligned_profiles` is a list of tuples `(transcript_id, (segmentation, *profiles))`,
+    `pairs` is a list of `(control_index, experiment_index)` (indices of profiles).
+    Segment sums and polarity scores of each profile are computed once and reused for all pairs.
+    Returns a list of infos (one per transcript) for each pair.
+    '''
+    segmentations = []
+    transcript_ids = []
+    num_samples = None
+    for (transcript_id, (segmentation, *profiles)) in aligned_profiles:
+        if num_samples is None:
+            num_samples = len(profiles)
+        assert all(len(profile) == segmentation.segmentation_length for profile in profiles)
+        transcript_ids.append(transcript_id)
+        segmentations.append(segmentation)
+    if num_samples is None:
+        return [[] for _ in pairs]
+    sample_sums = [[segmentwise_sums(segmentation, profiles[sample_idx]) for (_, (segmentation, *profiles)) in aligned_profiles]
+                   for sample_idx in range(num_samples)]
+    sample_polarities = [[polarity_score(profiles[sample_idx]) for (_, (_, *profiles)) in aligned_profiles]
+                         for sample_idx in range(num_samples)]
+    results = []
+    for (control_idx, experiment_idx) in pairs:
+        batch = SegmentCountsBatch(sample_sums[control_idx], sample_sums[experiment_idx], segmentations)
+        slopes = batch.slopes(log_mode=False, quantile_q=quantile_q, quantile_threshold=quantile_threshold)
+        slopelogs = batch.slopes(log_mode=True, quantile_q=quantile_q, quantile_threshold=quantile_threshold)
+        l1_distances = batch.l1_distances()
+        polarity_diffs = [difference_unless_none(control_polarity, experiment_polarity)
+                          for (control_polarity, experiment_polarity) in zip(sample_polarities[control_idx], sample_polarities[experiment_idx])]
+        infos = []
+        for (transcript_id, slope, slopelog, l1_distance, polarity_difference) in zip(transcript_ids, slopes, slopelogs, l1_distances, polarity_diffs):
+            info = {
+                'transcript_id': transcript_id,
+                'slope': slope,
+                'slopelog': slopelog,
+                'l1_distance': l1_distance,
+                'polarity_diff': polarity_difference,
+            }
+            infos.append(info)
+        results.append(infos)
+    return results
+
+def comparison_infos_binned_batch(aligned_profiles, binning, pairs, quantile_q=0.5, quantile_threshold=0):
+    '''
+    The same as `comparison_infos_multiple_batch` but transcripts are segmented by binning on the fly.
+    `aligned_profiles` is a list of tuples `(transcript_id, profiles)`
+    '''
+    segmented_profiles = [(transcript_id, (binning.segmentation(transcript_id, profiles), *profiles))
+                          for (transcript_id, profiles) in aligned_profiles]
+    return comparison_infos_multiple_batch(segmented_profiles, pairs, quantile_q=quantile_q, quantile_threshold=quantile_threshold)
 
 def polarity_diff(control_profile, experiment_profile):
-    control_polarity = polarity_score(control_profile)
-    exp_polarity = polarity_score(experiment_profile)
+    return difference_unless_none(polarity_score(control_profile), polarity_score(experiment_profile))
+
+def difference_unless_none(control_polarity, exp_polarity):
     if (exp_polarity is None) or (control_polarity is None):
         return None
     return exp_polarity - control_polarity
 
-def segmentation_stops(segmentation):
-    stops = [s.start for s in segmentation.segments]
-    stops.append(segmentation.segments[-1].stop)
-    return stops
-
 def segmentwise_sums(segmentation, profile):
-    profile_cumsum = np.hstack([0, np.cumsum(profile)])
-    return np.diff(profile_cumsum[segmentation_stops(segmentation)])
-
-    control_sums = segmentwise_sums(segmentation, control_profile)
-    experiment_sums = segmentwise_sums(segmentation, experiment_profile)
-
+    return segmentation.segmentwise_sums(profile)
 
 def slope_by_profiles(control_profile, experiment_profile, segmentation, log_mode=False, quantile_q=0.5, quantile_threshold=0):
     control_sums = segmentwise_sums(segmentation, control_profile)
@@ -46,57 +92,113 @@ def slope_by_profiles(control_profile, experiment_profile, segmentation, log_mod
                                    quantile_q=quantile_q, quantile_threshold=quantile_threshold)
 
 def slope_by_segment_counts(control_sums, experiment_sums, segmentation, log_mode=False, quantile_q=0.5, quantile_threshold=0):
-    assert len(segmentation.segments) == len(control_sums) == len(experiment_sums)
-    profile_len = segmentation.segmentation_length
-    num_segments = segmentation.num_segments
+    assert segmentation.num_segments == len(control_sums) == len(experiment_sums)
+    batch = SegmentCountsBatch([control_sums], [experiment_sums], [segmentation])
+    return batch.slopes(log_mode=log_mode, quantile_q=quantile_q, quantile_threshold=quantile_threshold)[0]
 
-    total_coverage_control = np.sum(control_sums)
-    total_coverage_experiment = np.sum(experiment_sums)
-    if (total_coverage_control == 0) or (total_coverage_experiment ==0):
-        return None
-    if (np.quantile(control_sums, quantile_q) < quantile_threshold) or (np.quantile(experiment_sums, quantile_q) < quantile_threshold):
+def slope_by_points(xs, ys, weights=None):
+    '''Slope of (weighted) least squares line'''
+    if len(xs) < 2:
         return None
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    weights = np.ones_like(xs) if weights is None else np.asarray(weights, dtype=float)
+    slopes = least_squares_slopes(xs, ys, weights, np.zeros(len(xs), dtype=np.int64), num_groups=1)
+    return slopes[0]
 
-    if log_mode:
-        rate_transform = log2
-    else:
-        rate_transform = lambda x: x
+def least_squares_slopes(xs, ys, weights, group_index, num_groups):
+    '''
+    Slopes of weighted least squares lines for several groups of points at once:
+    slope = sum(w * (x - mean_x) * (y - mean_y)) / sum(w * (x - mean_x)^2)
+    Points with zero weight don't affect result. Slope is zero when all xs in a group are equal.
+    '''
+    group_sum = lambda values: np.bincount(group_index, weights=values, minlength=num_groups)
+    total_weights = group_sum(weights)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_xs = group_sum(weights * xs) / total_weights
+        mean_ys = group_sum(weights * ys) / total_weights
+        dxs = xs - mean_xs[group_index]
+        dys = ys - mean_ys[group_index]
+        covariances = group_sum(weights * dxs * dys)
+        variances = group_sum(weights * dxs * dxs)
+        return np.where(variances > 0, covariances / variances, 0.0)
 
-    xs, ys, ws  = [], [], []
-    for (segment, control_segment_sum, experiment_segment_sum) in zip(segmentation.segments, control_sums, experiment_sums):
-        if (control_segment_sum == 0) and (experiment_segment_sum == 0):
-            continue
+class SegmentCountsBatch:
+    '''
+    Segment coverage sums of control and experiment profiles for a batch of transcripts,
+    concatenated into single arrays (segments of transcript `i` are `segment_offsets[i]:segment_offsets[i+1]`).
+    '''
+    def __init__(self, control_sums, experiment_sums, segmentations):
+        self.num_transcripts = len(segmentations)
+        num_segments = np.array([segmentation.num_segments for segmentation in segmentations], dtype=np.int64)
+        self.num_segments = num_segments
+        self.segment_offsets = np.concatenate(([0], np.cumsum(num_segments)))
+        self.transcript_index = np.repeat(np.arange(self.num_transcripts), num_segments)
+        if self.num_transcripts > 0:
+            self.control_sums = np.concatenate([np.asarray(sums) for sums in control_sums])
+            self.experiment_sums = np.concatenate([np.asarray(sums) for sums in experiment_sums])
+            starts = np.concatenate([segmentation.starts for segmentation in segmentations])
+            stops = np.concatenate([segmentation.stops for segmentation in segmentations])
+        else:
+            self.control_sums = self.experiment_sums = np.zeros(0)
+            starts = stops = np.zeros(0, dtype=np.int64)
+        profile_lengths = np.array([segmentation.segmentation_length for segmentation in segmentations], dtype=np.int64)
+        # segment center relative to profile length
+        self.rel_coords = ((starts + stops - 1) / 2) / profile_lengths[self.transcript_index]
 
-        # We add pseudocount of 1 to each total coverage of each segment
-        mean_control = (control_segment_sum + 1) / (total_coverage_control + num_segments)
-        mean_experiment = (experiment_segment_sum + 1) / (total_coverage_experiment + num_segments)
-        detrended_profile = mean_experiment / mean_control
+    def transcript_sums(self, values):
+        return np.bincount(self.transcript_index, weights=values, minlength=self.num_transcripts)
 
-        value = rate_transform(detrended_profile)
+    def segment_quantiles(self, segment_sums, q):
+        return RunLengthBatch.from_values(segment_sums, self.segment_offsets).quantiles(q)
 
-        coord = (segment.start + segment.stop - 1) / 2
-        rel_coord = coord / profile_len
+    def slopes(self, log_mode=False, quantile_q=0.5, quantile_threshold=0, weighted=False):
+        '''
+        Slope of a line fitted to ratios of normalized segment coverages (or to their logarithms)
+        against relative segment positions. Segments which have no coverage in both profiles are ignored.
+        If `weighted` is True, segments are weighted by total coverage in both profiles.
+        Returns a list with None for transcripts which have no coverage, don't pass quantile filter
+        or have less than two informative segments.
+        '''
+        total_coverage_control = self.transcript_sums(self.control_sums)
+        total_coverage_experiment = self.transcript_sums(self.experiment_sums)
+        is_valid = (total_coverage_control != 0) & (total_coverage_experiment != 0)
+        is_valid &= (self.segment_quantiles(self.control_sums, quantile_q) >= quantile_threshold)
+        is_valid &= (self.segment_quantiles(self.experiment_sums, quantile_q) >= quantile_threshold)
 
-        # mode: 'center'
-        xs.append(rel_coord)
-        ys.append(value)
-        ws.append(control_segment_sum + experiment_segment_sum)
+        has_coverage = (self.control_sums != 0) | (self.experiment_sums != 0)
+        is_valid &= (self.transcript_sums(has_coverage) >= 2)
 
-    return slope_by_points(xs, ys, weights=None)
-    # return slope_by_points(xs, ys, weights=ws)
+        # We add pseudocount of 1 to each total coverage of each segment
+        num_segments = self.num_segments[self.transcript_index]
+        mean_control = (self.control_sums + 1) / (total_coverage_control[self.transcript_index] + num_segments)
+        mean_experiment = (self.experiment_sums + 1) / (total_coverage_experiment[self.transcript_index] + num_segments)
+        detrended_profile = mean_experiment / mean_control
+        values = np.log2(detrended_profile) if log_mode else detrended_profile
 
-def slope_by_points(xs, ys, weights=None):
-    if len(xs) < 2:
-        return None
-    xs = np.array(xs)
-    model = LinearRegression()
-    model.fit(xs.reshape(-1, 1), ys, sample_weight=weights)
-    return model.coef_[0]
+        # mode: 'center'
+        if weighted:
+            weights = np.where(has_coverage, self.control_sums + self.experiment_sums, 0).astype(float)
+        else:
+            weights = has_coverage.astype(float)
+        slopes = least_squares_slopes(self.rel_coords, values, weights, self.transcript_index, self.num_transcripts)
+        return [(slope if valid else None) for (slope, valid) in zip(slopes.tolist(), is_valid.tolist())]
+
+    def l1_distances(self):
+        '''L1-distance between normalized segment coverages (None for transcripts without coverage)'''
+        control_profile_sum = self.transcript_sums(self.control_sums)
+        experiment_profile_sum = self.transcript_sums(self.experiment_sums)
+        is_valid = (control_profile_sum != 0) & (experiment_profile_sum != 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            control_normed = self.control_sums / control_profile_sum[self.transcript_index]
+            experiment_normed = self.experiment_sums / experiment_profile_sum[self.transcript_index]
+        distances = self.transcript_sums(np.abs(control_normed - experiment_normed))
+        return [(distance if valid else None) for (distance, valid) in zip(distances.tolist(), is_valid.tolist())]
 
 def l1_distance(control_profile, experiment_profile, segmentation):
     control_sums = segmentwise_sums(segmentation, control_profile)
     experiment_sums = segmentwise_sums(segmentation, experiment_profile)
-    assert len(control_sums) == len(experiment_sums) == len(segmentation.segments)
+    assert len(control_sums) == len(experiment_sums) == segmentation.num_segments
     return l1_distance_by_segment_counts(control_sums, experiment_sums)
 
 def l1_distance_by_segment_counts(control_sums, experiment_sums):
@@ -115,29 +217,63 @@ def _coverage_contig_fn(transcript_coverage):
 def _segmentation_contig_fn(segment):
     return segment.chrom
 
-def align_profile_streams(profile_streams, check_sorted=False):
+def _common_subsequence(streams, keys, check_sorted=False, unsorted=False, temp_dir=None):
+    if not unsorted:
+        yield from common_subsequence(streams, key=keys, check_sorted=check_sorted)
+        return
+    for (key, matching_objects) in align_unsorted(streams, key=keys, temp_dir=temp_dir):
+        if len(matching_objects) == len(streams):
+            yield (key, [obj for (idx, obj) in matching_objects])
+
+def align_profile_streams(profile_streams, check_sorted=False, unsorted=False, temp_dir=None):
     '''
     yields tuples: (transcript_id, profiles)
+    If `unsorted` is True, streams can be ordered arbitrarily (see `unsorted_join.align_unsorted`)
     '''
     keys = [_coverage_contig_fn] * len(profile_streams)
-    yield from common_subsequence(profile_streams, key=keys, check_sorted=check_sorted)
+    yield from _common_subsequence(profile_streams, keys, check_sorted=check_sorted, unsorted=unsorted, temp_dir=temp_dir)
 
-def align_profile_streams_to_segmentation(segmentation_stream, profile_streams, check_sorted=False):
+def align_profile_streams_to_segmentation(segmentation_stream, profile_streams, check_sorted=False, unsorted=False, temp_dir=None):
     '''
     yields tuples: (transcript_id, (segmentation, *profiles))
+    If `unsorted` is True, streams can be ordered arbitrarily (see `unsorted_join.align_unsorted`)
     '''
     streams = [segmentation_stream, *profile_streams]
     keys = [_segmentation_contig_fn] + [_coverage_contig_fn] * len(profile_streams)
-    yield from common_subsequence(streams, key=keys, check_sorted=check_sorted)
-
-def compare_coverage_streams(segmentation_stream, control_coverage_profiles, experiment_coverage_profiles, check_sorted=False, **options):
-    aligned_stream = align_profile_streams_to_segmentation(
-        segmentation_stream,
-        [control_coverage_profiles, experiment_coverage_profiles],
-        check_sorted=check_sorted
-    )
-    for (transcript_id, (segmentation, control_coverage, experiment_coverage)) in aligned_stream:
-        yield comparison_infos(transcript_id,
-                               control_coverage.coverage,
-                               experiment_coverage.coverage,
-                               segmentation, **options)
+    yield from _common_subsequence(streams, keys, check_sorted=check_sorted, unsorted=unsorted, temp_dir=temp_dir)
+
+def compare_coverage_streams(segmentation_stream, control_coverage_profiles, experiment_coverage_profiles, check_sorted=False, unsorted=False, temp_dir=None, jobs=1, binning=None, **options):
+    for (transcript_id, (info,)) in compare_multiple_coverage_streams(segmentation_stream, [control_coverage_profiles, experiment_coverage_profiles], [(0, 1)],
+                                                                     check_sorted=check_sorted, unsorted=unsorted, temp_dir=temp_dir, jobs=jobs, binning=binning, **options):
+        yield info
+
+def compare_multiple_coverage_streams(segmentation_stream, coverage_profile_streams, pairs, check_sorted=False, unsorted=False, temp_dir=None, jobs=1, binning=None, **options):
+    '''
+    Compares several pairs `(control_index, experiment_index)` of coverage streams.
+    Only transcripts present in segmentation and in all streams are compared.
+    If `binning` is specified, segmentation stream should be None: transcripts are segmented by binning of their profiles.
+    Batches of transcripts are compared by `jobs` worker processes.
+    yields tuples: (transcript_id, infos) with an info for each pair
+    '''
+    if binning is None:
+        aligned_stream = align_profile_streams_to_segmentation(
+            segmentation_stream,
+            coverage_profile_streams,
+            check_sorted=check_sorted, unsorted=unsorted, temp_dir=temp_dir
+        )
+        batches = ([(transcript_id, (segmentation, *[transcript_coverage.coverage for transcript_coverage in coverages]))
+                    for (transcript_id, (segmentation, *coverages)) in batch]
+                   for batch in each_batch(aligned_stream, BATCH_SIZE))
+        compare_batch = functools.partial(comparison_infos_multiple_batch, pairs=pairs, **options)
+    else:
+        if segmentation_stream is not None:
+            raise ValueError('Either segmentation or binning should be specified, not both')
+        aligned_stream = align_profile_streams(coverage_profile_streams, check_sorted=check_sorted, unsorted=unsorted, temp_dir=temp_dir)
+        # bins are computed by workers together with comparison
+        batches = ([(transcript_id, [transcript_coverage.coverage for transcript_coverage in coverages])
+                    for (transcript_id, coverages) in batch]
+                   for batch in each_batch(aligned_stream, BATCH_SIZE))
+        compare_batch = functools.partial(comparison_infos_binned_batch, binning=binning, pairs=pairs, **options)
+    for infos_by_pair in ordered_map(compare_batch, batches, jobs=jobs):
+        for infos in zip(*infos_by_pair):
+            yield (infos[0]['transcript_id'], list(infos))
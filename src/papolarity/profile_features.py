@@ -0,0 +1,80 @@
+import numpy as np
+from .run_length_profile import quantile_interpolation, lerp, polarity_by_sums
+
+class RunLengthBatch:
+    '''
+    Run-length encoded profiles of several transcripts concatenated into single arrays.
+    Runs of profile `i` are `run_offsets[i]:run_offsets[i+1]`.
+    Features of all profiles are computed at once with segmented reductions
+    (results are identical to the ones of corresponding `RunLengthProfile` methods).
+    '''
+    def __init__(self, values, stops, run_offsets):
+        self.values = values
+        self.stops = np.asarray(stops, dtype=np.int64)
+        self.run_offsets = np.asarray(run_offsets, dtype=np.int64)
+        num_runs = np.diff(self.run_offsets)
+        self.num_profiles = len(num_runs)
+        self.profile_index = np.repeat(np.arange(self.num_profiles), num_runs)
+        # run stops are relative to their profile, so the first run of each profile starts at zero
+        self.starts = np.concatenate(([0], self.stops[:-1])).astype(np.int64)
+        is_first_run = np.zeros(len(self.stops), dtype=bool)
+        is_first_run[self.run_offsets[:-1][num_runs > 0]] = True
+        self.starts[is_first_run] = 0
+        self.lengths = self.stops - self.starts
+        self.profile_lengths = self.segment_sums(self.lengths)
+
+    @classmethod
+    def from_profiles(cls, profiles):
+        '''Batch of `RunLengthProfile`s'''
+        num_runs = np.array([profile.num_runs for profile in profiles], dtype=np.int64)
+        run_offsets = np.concatenate(([0], np.cumsum(num_runs)))
+        if len(profiles) > 0:
+            values = np.concatenate([profile.values for profile in profiles])
+            stops = np.concatenate([profile.stops for profile in profiles])
+        else:
+            values = np.zeros(0)
+            stops = np.zeros(0, dtype=np.int64)
+        return cls(values, stops, run_offsets)
+
+    @classmethod
+    def from_values(cls, values, offsets):
+        '''Batch of dense arrays concatenated into `values`, array `i` is `values[offsets[i]:offsets[i+1]]`'''
+        offsets = np.asarray(offsets, dtype=np.int64)
+        positions = np.arange(len(values)) - np.repeat(offsets[:-1], np.diff(offsets))
+        return cls(np.asarray(values), positions + 1, offsets)
+
+    def segment_sums(self, run_values):
+        '''Sums of per-run values over runs of each profile'''
+        cumulative_sums = np.concatenate(([0], np.cumsum(run_values)))
+        return np.diff(cumulative_sums[self.run_offsets])
+
+    def sums(self):
+        return self.segment_sums(self.values * self.lengths)
+
+    def means(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.sums() / self.profile_lengths
+
+    def quantiles(self, q):
+        '''Quantile `q` of values of each profile (for empty profiles result is meaningless)'''
+        # the only sort per batch: runs are ordered by profile, then by value
+        order = np.lexsort((self.values, self.profile_index))
+        sorted_values = self.values[order]
+        sorted_stops = np.cumsum(self.lengths[order])
+        profile_position_offsets = np.concatenate(([0], np.cumsum(self.profile_lengths)[:-1]))
+        previous_rank, next_rank, gamma = quantile_interpolation(self.profile_lengths, q)
+        max_run_index = max(len(sorted_values) - 1, 0)
+        previous_run = np.minimum(np.searchsorted(sorted_stops, profile_position_offsets + previous_rank, side='right'), max_run_index)
+        next_run = np.minimum(np.searchsorted(sorted_stops, profile_position_offsets + next_rank, side='right'), max_run_index)
+        if len(sorted_values) == 0:
+            return np.zeros(self.num_profiles)
+        return lerp(sorted_values[previous_run], sorted_values[next_run], gamma)
+
+    def polarity_scores(self):
+        '''Polarity scores (NaN for profiles with zero coverage)'''
+        index_weighted_sums = self.segment_sums(self.values * ((self.starts + self.stops - 1) * self.lengths))
+        total_coverages = self.sums()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = polarity_by_sums(index_weighted_sums, total_coverages, self.profile_lengths)
+        scores = np.where(self.profile_lengths == 1, -1.0, scores)
+        return np.where(total_coverages == 0, np.nan, scores)
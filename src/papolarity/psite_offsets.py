@@ -0,0 +1,57 @@
+import numpy as np
+from .tsv_reader import each_in_tsv
+from .gzip_utils import open_for_write
+
+# Ribo-seq footprints are assigned to a single nucleotide (P-site) which is shifted
+# by a read-length specific offset from the 5'-end of a read.
+# Offsets are given as a dictionary {read_length: offset}.
+
+def load_psite_offsets(filename):
+    '''
+    Loads a table with `read_length` and `offset` columns.
+    Rows with an empty offset are ignored (reads of such length are not counted).
+    '''
+    offsets = {}
+    for row in each_in_tsv(filename):
+        if row['offset'] != '':
+            offsets[int(row['read_length'])] = int(row['offset'])
+    return offsets
+
+def infer_psite_offsets(five_prime_ends_by_transcript, cds_info_by_transcript, max_offset=25, min_reads=10):
+    '''
+    For each read length takes the most frequent distance between a read 5'-end
+    and an annotated start codon (for reads starting no farther than `max_offset` upstream of it).
+    `five_prime_ends_by_transcript` is a dictionary {transcript_id: (five_prime_ends, read_lengths)}
+    with forward-strand reads only.
+    Read lengths supported by less than `min_reads` reads get no offset.
+    '''
+    distances, lengths = [], []
+    for (transcript_id, (five_prime_ends, read_lengths)) in five_prime_ends_by_transcript.items():
+        cds_info = cds_info_by_transcript.get(transcript_id)
+        if (cds_info is None) or not cds_info.is_coding:
+            continue
+        distance = cds_info.cds_start - five_prime_ends
+        near_start_codon = (distance >= 0) & (distance <= max_offset)
+        distances.append(distance[near_start_codon])
+        lengths.append(read_lengths[near_start_codon])
+    if not distances:
+        return {}
+    distances = np.concatenate(distances)
+    lengths = np.concatenate(lengths)
+    offsets = {}
+    for read_length in np.unique(lengths):
+        distance_counts = np.bincount(distances[lengths == read_length], minlength=max_offset + 1)
+        if distance_counts.sum() >= min_reads:
+            offsets[int(read_length)] = int(np.argmax(distance_counts))
+    return offsets
+
+def store_read_length_histogram(filename, read_length_counts, psite_offsets=None):
+    '''Stores number of reads of each length (and a P-site offset if it's known)'''
+    psite_offsets = psite_offsets or {}
+    with open_for_write(filename) as output_stream:
+        print('read_length\tnum_reads\toffset', file=output_stream)
+        for (read_length, num_reads) in enumerate(read_length_counts):
+            if num_reads == 0:
+                continue
+            offset = psite_offsets.get(read_length, '')
+            print(f'{read_length}\t{num_reads}\t{offset}', file=output_stream)
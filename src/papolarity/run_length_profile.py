@@ -0,0 +1,212 @@
+import dataclasses
+import numpy as np
+
+def quantile_interpolation(n, q):
+    '''
+    Ranks of elements in a sorted array of length `n` between which a quantile value
+    is interpolated and an interpolation weight (same as in `np.quantile` with linear interpolation).
+    Both `n` and `q` can be arrays (they are broadcasted).
+    '''
+    virtual_index = (np.asarray(n) - 1) * np.asarray(q)
+    shape = virtual_index.shape
+    virtual_index = np.array(virtual_index, dtype=float, ndmin=1)
+    previous_rank = np.floor(virtual_index)
+    next_rank = previous_rank + 1
+    # when a quantile is out of bounds, the last (or the first) element is taken
+    above_bounds = (virtual_index >= n - 1)
+    previous_rank[above_bounds] = -1
+    next_rank[above_bounds] = -1
+    below_bounds = (virtual_index < 0)
+    previous_rank[below_bounds] = 0
+    next_rank[below_bounds] = 0
+    gamma = virtual_index - previous_rank
+    previous_rank = np.where(previous_rank < 0, n - 1, previous_rank).astype(np.int64)
+    next_rank = np.where(next_rank < 0, n - 1, next_rank).astype(np.int64)
+    return (previous_rank.reshape(shape), next_rank.reshape(shape), gamma.reshape(shape))
+
+def lerp(a, b, t):
+    '''Linear interpolation computed the same way as in `np.quantile` (to get identical results)'''
+    diff_b_a = b - a
+    result = np.asarray(a + diff_b_a * t, dtype=float)
+    np.subtract(b, diff_b_a * (1 - t), out=result, where=(t >= 0.5), casting='unsafe')
+    return result
+
+def polarity_by_sums(index_weighted_sum, total_coverage, profile_len):
+    '''
+    Polarity score by doubled sum of `position * value` and by sum of values.
+    Positions are evenly spaced on [-1, 1]: position(i) = -1 + 2 * i / (profile_len - 1)
+    '''
+    return (index_weighted_sum / (profile_len - 1) - total_coverage) / total_coverage
+
+@dataclasses.dataclass(frozen=True)
+class RunLengthProfile:
+    '''
+    Piecewise-constant coverage profile.
+    Run `i` covers positions [stops[i-1], stops[i]) (the first run starts at zero) and has value `values[i]`.
+    Statistics are computed in time proportional to the number of runs, not to the profile length.
+    '''
+    stops: np.ndarray
+    values: np.ndarray
+
+    @classmethod
+    def from_intervals(cls, starts, stops, values, dtype=float):
+        '''
+        Builds a profile from sorted non-overlapping intervals.
+        Gaps between intervals get zero values.
+        '''
+        previous_stops = np.concatenate(([0], stops[:-1]))
+        if np.any(starts < previous_stops) or np.any(starts >= stops):
+            raise ValueError('Intervals should be non-empty, sorted and non-overlapping')
+        values = values.astype(dtype, copy=False)
+        has_gap = (starts > previous_stops)
+        if not has_gap.any():
+            return cls(stops, values)
+        # zero-valued gap `[previous_stop, start)` is a run which stops at the start of the next interval
+        all_stops = np.concatenate((stops, starts[has_gap]))
+        all_values = np.concatenate((values, np.zeros(np.count_nonzero(has_gap), dtype=values.dtype)))
+        order = np.argsort(all_stops, kind='stable')
+        return cls(all_stops[order], all_values[order])
+
+    @classmethod
+    def from_dense(cls, profile):
+        profile = np.asarray(profile)
+        if len(profile) == 0:
+            return cls(np.zeros(0, dtype=np.int64), profile.copy())
+        run_stops = np.concatenate((np.flatnonzero(np.diff(profile)) + 1, [len(profile)]))
+        return cls(run_stops, profile[run_stops - 1])
+
+    @property
+    def starts(self):
+        return np.concatenate(([0], self.stops[:-1])).astype(np.int64)
+
+    @property
+    def lengths(self):
+        return np.diff(self.stops, prepend=0)
+
+    @property
+    def num_runs(self):
+        return len(self.stops)
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    def __len__(self):
+        return int(self.stops[-1]) if len(self.stops) > 0 else 0
+
+    def astype(self, dtype, copy=True):
+        return RunLengthProfile(self.stops, self.values.astype(dtype, copy=copy))
+
+    def to_dense(self):
+        return np.repeat(self.values, self.lengths)
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.to_dense()
+        return dense if dtype is None else dense.astype(dtype, copy=False)
+
+    def merged_runs(self):
+        '''
+        Arrays `(starts, stops, values)` of maximal constant runs, adjacent runs with equal values are merged.
+        (the same as `utils.constant_interval_arrays` does for a dense profile)
+        '''
+        if self.num_runs == 0:
+            return (self.stops, self.stops, self.values)
+        value_changes = np.flatnonzero(np.diff(self.values)) + 1
+        run_stops = np.concatenate((self.stops[value_changes - 1], [self.stops[-1]]))
+        run_starts = np.concatenate(([0], run_stops[:-1]))
+        run_values = self.values[np.concatenate(([0], value_changes))]
+        return (run_starts, run_stops, run_values)
+
+    def runs(self):
+        '''Yields maximal constant runs `(start, stop, value)`'''
+        yield from zip(*self.merged_runs())
+
+    def sum(self):
+        return np.dot(self.values, self.lengths)
+
+    def mean(self):
+        return self.sum() / len(self)
+
+    def quantile(self, q):
+        '''Quantile of profile values (identical to np.quantile of a dense profile)'''
+        order = np.argsort(self.values, kind='stable')
+        sorted_values = self.values[order]
+        sorted_stops = np.cumsum(self.lengths[order])
+        previous_rank, next_rank, gamma = quantile_interpolation(len(self), q)
+        previous_value = sorted_values[np.searchsorted(sorted_stops, previous_rank, side='right')]
+        next_value = sorted_values[np.searchsorted(sorted_stops, next_rank, side='right')]
+        return lerp(previous_value, next_value, gamma)[()]
+
+    def cumulative_sums(self, positions):
+        '''Sums of profile values on [0, position) for each position'''
+        positions = np.asarray(positions)
+        run_cumsums = np.concatenate(([0], np.cumsum(self.values * self.lengths)))
+        run_idx = np.searchsorted(self.stops, positions, side='right')
+        run_starts = np.concatenate(([0], self.stops))
+        # a run which contains a position contributes partially
+        partial_values = np.concatenate((self.values, [0]))[run_idx]
+        return run_cumsums[run_idx] + partial_values * (positions - run_starts[run_idx])
+
+    def positions_by_cumulative_sums(self, targets):
+        '''
+        Smallest positions `p` such that sum of profile values on [0, p) reaches target (positions are clipped to profile length).
+        It's an inverse of `cumulative_sums` for profiles with non-negative values.
+        '''
+        targets = np.asarray(targets)
+        if self.num_runs == 0:
+            return np.zeros(targets.shape, dtype=np.int64)
+        run_cumsums = np.cumsum(self.values * self.lengths)
+        run_idx = np.minimum(np.searchsorted(run_cumsums, targets, side='left'), self.num_runs - 1)
+        previous_cumsums = np.concatenate(([0], run_cumsums))[run_idx]
+        run_values = self.values[run_idx]
+        # a run which reaches a target has positive value (unless target is reached before the run)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            offsets = np.where(targets <= previous_cumsums, 0, np.ceil((targets - previous_cumsums) / run_values))
+        return np.minimum(self.starts[run_idx] + offsets, len(self)).astype(np.int64)
+
+    def segmentwise_sums(self, boundaries):
+        '''Sums of values in segments [boundaries[i], boundaries[i+1])'''
+        return np.diff(self.cumulative_sums(boundaries))
+
+    def clip(self, start, stop):
+        '''Profile of a window [start, stop) with coordinates relative to window start'''
+        start = max(0, start)
+        stop = min(len(self), stop)
+        if start >= stop:
+            return RunLengthProfile(np.zeros(0, dtype=np.int64), self.values[:0])
+        first_run = np.searchsorted(self.stops, start, side='right')
+        last_run = np.searchsorted(self.stops, stop, side='left')
+        clipped_stops = np.minimum(self.stops[first_run:(last_run + 1)], stop) - start
+        return RunLengthProfile(clipped_stops, self.values[first_run:(last_run + 1)])
+
+    def polarity_score(self):
+        '''Same as `polarity_score` of a dense profile (up to rounding errors)'''
+        total_coverage = self.sum()
+        if total_coverage == 0:
+            return None
+        profile_len = len(self)
+        if profile_len == 1:
+            return -1.0
+        return polarity_by_sums(self.index_weighted_sum(), total_coverage, profile_len)
+
+    def index_weighted_sum(self):
+        '''Doubled sum of `position * value` (an exact integer for integer-valued profiles)'''
+        starts = self.starts
+        stops = self.stops
+        # sum of positions in a run [start, stop) is (start + stop - 1) * length / 2
+        return np.sum(self.values * ((starts + stops - 1) * (stops - starts)))
+
+    @classmethod
+    def pooled(cls, profiles, mode='sum'):
+        '''Sum or mean of several profiles of the same length'''
+        lengths = {len(profile) for profile in profiles}
+        if len(lengths) > 1:
+            raise ValueError(f'Pooled profiles should have the same length but have lengths {sorted(lengths)}')
+        pooled_stops = np.unique(np.concatenate([profile.stops for profile in profiles]))
+        pooled_values = sum(profile.values[np.searchsorted(profile.stops, pooled_stops, side='left')] for profile in profiles)
+        if mode == 'sum':
+            return cls(pooled_stops, pooled_values)
+        elif mode == 'mean':
+            return cls(pooled_stops, pooled_values / len(profiles))
+        else:
+            raise ValueError(f'Unknown pooling mode `{mode}`')
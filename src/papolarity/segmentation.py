@@ -1,45 +1,108 @@
-import itertools
-import dataclasses
-from typing import List
 import numpy as np
 from .dto.interval import Interval
+from .bedgraph_reader import each_bed_intervals
+from .run_length_profile import RunLengthProfile
 
-def stabilize_profile(profile, segments):
-    stable_profile = np.zeros_like(profile)
-    for segment in segments:
-        start = segment.start
-        stop = segment.stop
-        stable_profile[start:stop] = np.mean(profile[start:stop])
-    return stable_profile
-
-@dataclasses.dataclass(frozen=True)
 class Segmentation:
-    chrom: str
-    segments: List[Interval] # bed-coordinates [a, b)
-
-    def __post_init__(self):
-        object.__setattr__(self, 'segments', sorted(self.segments)) # assign frozen attribute.
-        if any(self.chrom != segment.chrom for segment in self.segments):
-            raise ValueError(f"Segmentation intervals all should be on specified chromosome/contig `{self.chrom}`")
-        if len(self.segments) > 0 and self.segments[0].start != 0:
-            raise ValueError(f"Segmentation should cover entire interval (but first segment {self.segments[0]} doesn't start from zero)")
-        if any(self.segments[i].stop != self.segments[i + 1].start for i in range(len(self.segments) - 1)):
-            raise ValueError(f"Segments should be contigious but weren't: {self.segments}")
+    '''
+    Segmentation of a contig into contiguous segments.
+    Segment `i` is [boundaries[i], boundaries[i+1]) in bed-coordinates, the first segment starts at zero.
+    '''
+    def __init__(self, chrom, boundaries):
+        self.chrom = chrom
+        self.boundaries = np.asarray(boundaries, dtype=np.int64)
+        if len(self.boundaries) > 0:
+            if self.boundaries[0] != 0:
+                raise ValueError(f"Segmentation should cover entire interval (but first segment doesn't start from zero but from {self.boundaries[0]})")
+            if np.any(self.boundaries[1:] <= self.boundaries[:-1]):
+                raise ValueError(f"Segments should be non-empty, but segmentation boundaries are not increasing: {self.boundaries}")
+
+    @classmethod
+    def from_segments(cls, chrom, segments):
+        '''Segmentation by a list of `Interval`s (in any order)'''
+        if any(chrom != segment.chrom for segment in segments):
+            raise ValueError(f"Segmentation intervals all should be on specified chromosome/contig `{chrom}`")
+        starts = np.array([segment.start for segment in segments], dtype=np.int64)
+        stops = np.array([segment.stop for segment in segments], dtype=np.int64)
+        return cls.from_arrays(chrom, starts, stops)
+
+    @classmethod
+    def from_arrays(cls, chrom, starts, stops):
+        '''Segmentation by arrays of segment starts and stops (in any order)'''
+        if len(starts) == 0:
+            return cls(chrom, np.zeros(0, dtype=np.int64))
+        order = np.argsort(starts, kind='stable')
+        starts = starts[order]
+        stops = stops[order]
+        if starts[0] != 0:
+            raise ValueError(f"Segmentation should cover entire interval (but first segment {Interval(chrom, int(starts[0]), int(stops[0]))} doesn't start from zero)")
+        if np.any(stops[:-1] != starts[1:]):
+            raise ValueError(f"Segments should be contigious but weren't: {list(zip(starts.tolist(), stops.tolist()))}")
+        return cls(chrom, np.concatenate(([0], stops)))
+
+    @property
+    def segments(self):
+        return [Interval(self.chrom, start, stop) for (start, stop) in zip(self.starts.tolist(), self.stops.tolist())]
+
+    @property
+    def starts(self):
+        return self.boundaries[:-1]
+
+    @property
+    def stops(self):
+        return self.boundaries[1:]
+
+    @property
+    def lengths(self):
+        return np.diff(self.boundaries)
 
     @property
     def segmentation_length(self):
-        return self.segments[-1].stop
+        return int(self.boundaries[-1]) if len(self.boundaries) > 0 else 0
 
     @property
     def num_segments(self):
-        return len(self.segments)
+        return max(len(self.boundaries) - 1, 0)
+
+    def __eq__(self, other):
+        if not isinstance(other, Segmentation):
+            return NotImplemented
+        return (self.chrom == other.chrom) and np.array_equal(self.boundaries, other.boundaries)
+
+    def __repr__(self):
+        return f'Segmentation(chrom={self.chrom!r}, boundaries={self.boundaries.tolist()})'
+
+    def segmentwise_sums(self, profile):
+        '''Sums of profile values in each segment (profile is a dense array or a `RunLengthProfile`)'''
+        if isinstance(profile, RunLengthProfile):
+            return profile.segmentwise_sums(self.boundaries)
+        profile_cumsum = np.concatenate(([0], np.cumsum(profile)))
+        return np.diff(profile_cumsum[np.minimum(self.boundaries, len(profile))])
+
+    def segmentwise_means(self, profile):
+        lengths = np.diff(np.minimum(self.boundaries, len(profile)))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.segmentwise_sums(profile) / lengths
 
     def stabilize_profile(self, profile):
+        '''
+        Replaces profile values in each segment with their mean.
+        Result has the same type as the profile (dense array or `RunLengthProfile`)
+        '''
+        means = self.segmentwise_means(profile)
+        if isinstance(profile, RunLengthProfile):
+            # segments are clipped to profile length, the rest of a profile (if any) gets zero values
+            stops = np.minimum(self.stops, len(profile))
+            is_nonempty = (np.diff(np.minimum(self.boundaries, len(profile))) > 0)
+            stops = stops[is_nonempty]
+            means = means[is_nonempty].astype(profile.dtype, copy=False)
+            if len(profile) > self.segmentation_length:
+                stops = np.append(stops, len(profile))
+                means = np.append(means, np.zeros(1, dtype=means.dtype))
+            return RunLengthProfile(stops, means)
         stable_profile = np.zeros_like(profile)
-        for segment in self.segments:
-            start = segment.start
-            stop = segment.stop
-            stable_profile[start:stop] = np.mean(profile[start:stop])
+        stable_length = min(self.segmentation_length, len(profile)) if self.num_segments > 0 else 0
+        stable_profile[:stable_length] = np.repeat(means, self.lengths)[:stable_length]
         return stable_profile
 
     # clip flanks so that region is in specified window
@@ -49,19 +112,16 @@ class Segmentation:
     # clip flanks of specified length
     def clip_flanks(self, flank_5, flank_3):
         clip_len = self.segmentation_length - flank_3 - flank_5
-        clipped_segments = []
-        for segment in self.segments:
-            segment_start = max(0, segment.start - flank_5)
-            segment_stop = min(clip_len, segment.stop - flank_5)
-            if (segment_stop <= 0) or (clip_len <= segment_start):
-                continue
-            clipped_segment = Interval(self.chrom, segment_start, segment_stop)
-            clipped_segments.append(clipped_segment)
-        return Segmentation(self.chrom, clipped_segments)
+        if clip_len <= 0:
+            return Segmentation(self.chrom, np.zeros(0, dtype=np.int64))
+        # boundaries out of window are moved to its ends, segments which became empty are dropped
+        clipped_boundaries = np.unique(np.clip(self.boundaries - flank_5, 0, clip_len))
+        return Segmentation(self.chrom, clipped_boundaries)
 
     @classmethod
     def each_in_file(cls, filename, force_gzip=None, header=False):
-        segment_stream = Interval.each_in_file(filename, header=header, force_gzip=force_gzip)
-        for (chrom, segments_iter) in itertools.groupby(segment_stream, key=lambda segment: segment.chrom):
-            segments = list(segments_iter)
-            yield cls(chrom, segments)
+        '''Segmentations of each contig in a bed file (segments of a contig should go consecutively)'''
+        for (chrom, starts, stops) in each_bed_intervals(filename, header=header, force_gzip=force_gzip):
+            if np.any(starts >= stops):
+                raise ValueError(f'Interval start should be less than stop (contig `{chrom}`)')
+            yield cls.from_arrays(chrom, starts, stops)
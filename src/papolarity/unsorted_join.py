@@ -0,0 +1,129 @@
+import os
+import zlib
+import pickle
+import tempfile
+
+# Join of streams which are not sorted by key.
+# Streams are hash-partitioned by key into spill files, so that only a single partition
+# is kept in memory at once. Sources which support random access (such as coverage stores
+# or indexed block-gzipped bedgraphs) are not spilled, their objects are fetched by key.
+NUM_PARTITIONS = 64
+
+class RandomAccessSource:
+    '''
+    Source of objects which are fetched by key: `fetch(key)`. `keys` are listed in source order.
+    `close` (if specified) releases resources (e.g. files) used by `fetch`.
+    '''
+    def __init__(self, keys, fetch, close=None):
+        self.keys = list(keys)
+        self.key_set = set(self.keys)
+        self.fetch = fetch
+        self._close = close
+
+    def __contains__(self, key):
+        return key in self.key_set
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excinfo):
+        self.close()
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+def partition_index(key, num_partitions):
+    # crc32 (unlike `hash`) doesn't depend on interpreter run
+    return zlib.crc32(key.encode('utf-8')) % num_partitions
+
+def align_unsorted(sources, key=lambda x: x, num_partitions=NUM_PARTITIONS, temp_dir=None):
+    '''
+    The same as `utils.align_iterators_sparse` but sources can be ordered arbitrarily.
+    Yields pairs `(key, [(source_index, object), ...])`.
+    Each source is either an iterable or a `RandomAccessSource`. Keys should be unique within each source.
+    `key` (a callable or a list of callables) is applied to objects of iterables only.
+    If there is at most one iterable, it's not spilled and defines order of keys
+    (keys absent in it go afterwards). Otherwise order of keys is arbitrary (but deterministic).
+    Random access sources are closed when the join is finished (or abandoned).
+    '''
+    sources = list(sources)
+    if callable(key):
+        key = [key for _ in sources]
+    else:
+        assert len(sources) == len(key)
+    stream_idxs = [idx for (idx, source) in enumerate(sources) if not isinstance(source, RandomAccessSource)]
+    random_access_idxs = [idx for (idx, source) in enumerate(sources) if isinstance(source, RandomAccessSource)]
+    try:
+        if len(stream_idxs) <= 1:
+            yield from _align_to_stream(sources, key, stream_idxs, random_access_idxs)
+        else:
+            yield from _align_spilled(sources, key, stream_idxs, random_access_idxs, num_partitions, temp_dir)
+    finally:
+        for idx in random_access_idxs:
+            sources[idx].close()
+
+def _fetch_matching(sources, random_access_idxs, key_value, matching_objects):
+    for idx in random_access_idxs:
+        if key_value in sources[idx]:
+            matching_objects.append((idx, sources[idx].fetch(key_value)))
+    matching_objects.sort(key=lambda idx_and_obj: idx_and_obj[0])
+    return matching_objects
+
+def _align_to_stream(sources, key, stream_idxs, random_access_idxs):
+    seen_keys = set()
+    for stream_idx in stream_idxs:
+        for obj in sources[stream_idx]:
+            key_value = key[stream_idx](obj)
+            if key_value in seen_keys:
+                raise ValueError(f'Key `{key_value}` occurs several times in source at index `{stream_idx}`')
+            seen_keys.add(key_value)
+            yield (key_value, _fetch_matching(sources, random_access_idxs, key_value, [(stream_idx, obj)]))
+    for idx in random_access_idxs:
+        for key_value in sources[idx].keys:
+            if key_value in seen_keys:
+                continue
+            seen_keys.add(key_value)
+            yield (key_value, _fetch_matching(sources, random_access_idxs, key_value, []))
+
+def _align_spilled(sources, key, stream_idxs, random_access_idxs, num_partitions, temp_dir):
+    with tempfile.TemporaryDirectory(prefix='papolarity_join_', dir=temp_dir) as spill_dir:
+        spill_filenames = [os.path.join(spill_dir, f'partition_{partition}.pickle') for partition in range(num_partitions)]
+        spill_files = [open(filename, 'wb') for filename in spill_filenames]
+        try:
+            # streams are spilled one after another, so records of each partition are ordered by source index
+            for stream_idx in stream_idxs:
+                for obj in sources[stream_idx]:
+                    key_value = key[stream_idx](obj)
+                    spill_file = spill_files[partition_index(key_value, num_partitions)]
+                    pickle.dump((stream_idx, key_value, obj), spill_file, protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            for spill_file in spill_files:
+                spill_file.close()
+
+        random_access_keys = [[] for _ in range(num_partitions)]
+        for idx in random_access_idxs:
+            for key_value in sources[idx].keys:
+                random_access_keys[partition_index(key_value, num_partitions)].append(key_value)
+
+        for (partition, spill_filename) in enumerate(spill_filenames):
+            groups = {}
+            with open(spill_filename, 'rb') as spill_file:
+                for (stream_idx, key_value, obj) in _each_pickled(spill_file):
+                    group = groups.setdefault(key_value, [])
+                    if group and (group[-1][0] == stream_idx):
+                        raise ValueError(f'Key `{key_value}` occurs several times in source at index `{stream_idx}`')
+                    group.append((stream_idx, obj))
+            os.remove(spill_filename)
+            for key_value in random_access_keys[partition]:
+                groups.setdefault(key_value, [])
+            for (key_value, matching_objects) in groups.items():
+                yield (key_value, _fetch_matching(sources, random_access_idxs, key_value, matching_objects))
+
+def _each_pickled(stream):
+    while True:
+        try:
+            yield pickle.load(stream)
+        except EOFError:
+            return
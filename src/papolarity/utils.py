@@ -1,3 +1,6 @@
+import os
+import heapq
+import itertools
 import numpy as np
 
 def flatten(xs):
@@ -16,6 +19,23 @@ def tsv_string_empty_none(row):
     row_strings = [(str(value) if value is not None else '') for value in row]
     return '\t'.join(row_strings)
 
+def each_batch(iterable, batch_size):
+    '''Yields lists of `batch_size` consecutive elements (the last one can be shorter)'''
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def sample_name_by_filename(filename):
+    '''Name of a sample stored at `filename` (file name without coverage-specific extensions)'''
+    name = os.path.basename(filename.rstrip('/'))
+    for extension in ['.gz', '.bedgraph', '.bg', '.bed', '.store']:
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    return name
+
 def take_the_only(arr):
     if len(arr) > 1:
         raise Exception('Several elements when the only one is expected')
@@ -24,12 +44,11 @@ def take_the_only(arr):
     return arr[0]
 
 def common_subsequence(iterators, key=lambda x: x, check_sorted=False):
-    sentinel = object()
-    for (key, aligned_objects) in align_iterators(iterators, key=key, object_missing=sentinel, check_sorted=check_sorted):
-        if sentinel not in aligned_objects:
-            yield (key, aligned_objects)
+    iterators = list(iterators)
+    for (key, matching_objects) in align_iterators_sparse(iterators, key=key, check_sorted=check_sorted):
+        if len(matching_objects) == len(iterators):
+            yield (key, [obj for (idx, obj) in matching_objects])
 
-_sentinel_key = object()
 def align_iterators(iterators, key=lambda x: x, object_missing=None, check_sorted=False):
     '''
     Take a list of iterables yielding objects whose `key` values increase
@@ -41,54 +60,82 @@ def align_iterators(iterators, key=lambda x: x, object_missing=None, check_sorte
     `key` can be either a callable object (same key for each iterator)
     or a list of callable objects (one key per iterator)
     '''
+    iterators = list(iterators)
+    for (key_value, matching_objects) in align_iterators_sparse(iterators, key=key, check_sorted=check_sorted):
+        yield (key_value, dense_aligned_objects(matching_objects, len(iterators), object_missing=object_missing))
+
+def dense_aligned_objects(matching_objects, num_iterators, object_missing=None):
+    '''Converts pairs `(iterator_index, object)` into a list of objects with `object_missing` at absent places'''
+    aligned_objects = [object_missing] * num_iterators
+    for (idx, obj) in matching_objects:
+        aligned_objects[idx] = obj
+    return aligned_objects
+
+def align_iterators_sparse(iterators, key=lambda x: x, check_sorted=False):
+    '''
+    The same as `align_iterators` but yields pairs `(key, [(iterator_index, object), ...])`
+    with only those iterators which have an object with that key (in order of iterator indices).
+    Iterators are merged with a heap, so each step costs O(log k) per advanced iterator
+    instead of O(k) for k iterators.
+    In `case-insensitive` mode keys are merged in the order of `sort --ignore-case`.
+    '''
     iterators = [iter(iterator) for iterator in iterators]
-    num_iters = len(iterators)
-    exhausted = [False] * num_iters
-    objects = [None] * num_iters
     if callable(key):
         key = [key for _ in iterators]
     else:
         assert len(iterators) == len(key)
-    key_values = [_sentinel_key] * num_iters
-    for idx in range(num_iters):
-        objects[idx], key_values[idx], exhausted[idx] = _next_unless_exhausted(iterators[idx], key[idx], exhausted[idx], object_missing=object_missing)
-    while not all(exhausted):
-        min_key = min(k for k in key_values if k is not _sentinel_key)
-        matching_idxs = {idx  for (idx, k) in enumerate(key_values)  if k == min_key}
-        aligned_objects = [(objects[idx] if idx in matching_idxs else object_missing)  for idx in range(num_iters)]
-        yield (min_key, aligned_objects)
-        for idx in matching_idxs:
-            old_key_value = key_values[idx]
-            objects[idx], key_values[idx], exhausted[idx] = _next_unless_exhausted(iterators[idx], key[idx], exhausted[idx])
-            if check_sorted == 'case-sensitive':
-                if (key_values[idx] is not _sentinel_key) and (key_values[idx] <= old_key_value):
-                    raise ValueError(f"Iterator at index `{idx}` is not sorted (case-sensitive): `{key_values[idx]}` follows `{old_key_value}`")
-            elif check_sorted == 'case-insensitive':
-                # It's necessary to use upcase, not lowercase
-                # to be consistent with GNU coreutils `sort --ignore-case`
-                if (key_values[idx] is not _sentinel_key) and (key_values[idx].upper() <= old_key_value.upper()):
-                    raise ValueError(f"Iterator at index `{idx}` is not sorted (case-insensitive): `{key_values[idx].upper()}` follows `{old_key_value.upper()}`")
+    sort_key = _sort_key_function(check_sorted)
+    # heap of tuples (sort_key, iterator_index, key, object); iterator indices are unique, so objects are never compared
+    heap = []
+    for (idx, iterator) in enumerate(iterators):
+        _push_next(heap, idx, iterator, key[idx], sort_key, check_sorted)
+    while heap:
+        min_sort_key, _, min_key, _ = heap[0]
+        matching_objects = []
+        matching_sort_keys = []
+        while heap and (heap[0][0] == min_sort_key):
+            (item_sort_key, idx, _, obj) = heapq.heappop(heap)
+            matching_objects.append((idx, obj))
+            matching_sort_keys.append(item_sort_key)
+        yield (min_key, matching_objects)
+        for ((idx, _), previous_sort_key) in zip(matching_objects, matching_sort_keys):
+            _push_next(heap, idx, iterators[idx], key[idx], sort_key, check_sorted, previous_sort_key=previous_sort_key)
 
-def _next_unless_exhausted(iterator, key, exhausted, object_missing=None):
+def _sort_key_function(check_sorted):
+    if check_sorted == 'case-insensitive':
+        # It's necessary to use upcase, not lowercase
+        # to be consistent with GNU coreutils `sort --ignore-case`
+        return lambda k: (k.upper(), k)
+    else:
+        return lambda k: k
+
+_no_key = object()
+def _push_next(heap, idx, iterator, key, sort_key, check_sorted, previous_sort_key=_no_key):
     '''
-    Utility function to take values from an iterator and transform them to keys
-    until iterator is exhausted and report iterator's status
+    Takes the next object from an iterator (unless it's exhausted) and puts it into a heap.
+    Raises if key of the object doesn't follow the previous one.
     '''
-    if not exhausted:
-        try:
-            obj = next(iterator)
-            k = key(obj)
-            return (obj, k, False)
-        except StopIteration:
-            return (object_missing, _sentinel_key, True)
-    else:
-        return (object_missing, _sentinel_key, True)
+    try:
+        obj = next(iterator)
+    except StopIteration:
+        return
+    k = key(obj)
+    item_sort_key = sort_key(k)
+    if previous_sort_key is not _no_key:
+        if check_sorted == 'case-sensitive':
+            if item_sort_key <= previous_sort_key:
+                raise ValueError(f"Iterator at index `{idx}` is not sorted (case-sensitive): `{item_sort_key}` follows `{previous_sort_key}`")
+        elif check_sorted == 'case-insensitive':
+            if item_sort_key[0] <= previous_sort_key[0]:
+                raise ValueError(f"Iterator at index `{idx}` is not sorted (case-insensitive): `{item_sort_key[0]}` follows `{previous_sort_key[0]}`")
+    heapq.heappush(heap, (item_sort_key, idx, k, obj))
 
-def get_constant_intervals(profile):
-    if len(profile) == 0:
-        return []
+def constant_interval_arrays(profile):
+    '''Arrays `(starts, stops, values)` of maximal constant intervals of a profile'''
+    profile = np.asarray(profile)
     last_value_indices = np.nonzero(np.diff(profile))[0]
     start_indices_inclusive = np.concatenate(([0], last_value_indices + 1))
     end_indices_exclusive = np.concatenate( (last_value_indices + 1, [len(profile)]) )
-    for (start, end) in zip(start_indices_inclusive, end_indices_exclusive):
-        yield (start, end, profile[start])
+    if len(profile) == 0:
+        return (start_indices_inclusive[:0], end_indices_exclusive[:0], profile)
+    return (start_indices_inclusive, end_indices_exclusive, profile[start_indices_inclusive])